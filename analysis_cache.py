@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+ANALYSIS_CACHE = os.environ.get("ANALYSIS_CACHE", ".cache/analisi.sqlite")
+ANALYSIS_CACHE_MB = float(os.environ.get("ANALYSIS_CACHE_MB", 50))
+
+
+def chiave_analisi(immagini, versione):
+    """Chiave di contenuto: hash dei byte delle immagini (nell'ordine) e versione del prompt."""
+    h = hashlib.sha256(str(versione).encode())
+    for dati in immagini:
+        h.update(hashlib.sha256(dati).digest())
+    return h.hexdigest()
+
+
+class AnalysisCache:
+    """Risultati di Gemini su disco (SQLite), indicizzati per contenuto, con espulsione LRU oltre `max_mb`."""
+
+    def __init__(self, path=ANALYSIS_CACHE, max_mb=ANALYSIS_CACHE_MB):
+        if path != ":memory:" and os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_byte = int(max_mb * 2 ** 20)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS analisi (chiave TEXT PRIMARY KEY, dati TEXT, byte INTEGER, uso REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_analisi_uso ON analisi (uso)")
+        self._db.commit()
+
+    def get(self, chiave):
+        with self._lock:
+            riga = self._db.execute("SELECT dati FROM analisi WHERE chiave = ?", (chiave,)).fetchone()
+            if riga is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE analisi SET uso = ? WHERE chiave = ?", (time.time(), chiave))
+            self._db.commit()
+        return json.loads(riga[0])
+
+    def put(self, chiave, dati):
+        testo = json.dumps(dati, ensure_ascii=False)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO analisi VALUES (?, ?, ?, ?)",
+                             (chiave, testo, len(testo.encode()), time.time()))
+            self._espelli()
+            self._db.commit()
+
+    def _espelli(self):
+        totale = self._db.execute("SELECT COALESCE(SUM(byte), 0) FROM analisi").fetchone()[0]
+        if totale <= self.max_byte: return
+        liberare, vecchie = totale - self.max_byte, []
+        for chiave, byte in self._db.execute("SELECT chiave, byte FROM analisi ORDER BY uso"):
+            if liberare <= 0: break
+            vecchie.append((chiave,))
+            liberare -= byte
+        self._db.executemany("DELETE FROM analisi WHERE chiave = ?", vecchie)
+
+    def invalidate(self, chiave):
+        with self._lock:
+            self._db.execute("DELETE FROM analisi WHERE chiave = ?", (chiave,))
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            n, byte = self._db.execute("SELECT COUNT(*), COALESCE(SUM(byte), 0) FROM analisi").fetchone()
+        tot = self.hits + self.misses
+        return {"voci": n, "mb": round(byte / 2 ** 20, 2), "max_mb": round(self.max_byte / 2 ** 20, 1),
+                "hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / tot, 3) if tot else 0.0}
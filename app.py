@@ -1,42 +1,61 @@
 import streamlit as st
-import google.generativeai as genai
-import gspread
-from google.oauth2.service_account import Credentials
-import json
 from PIL import Image, ImageOps 
 import pandas as pd
 import re
-import requests
 import uuid
-import math 
-import time
-import itertools
 from streamlit_js_eval import get_geolocation
-from geopy.geocoders import Nominatim
+from cache import sheet_cache
+from clients import ClientManager
+from distances import DistanceService
+from stores import StoreRegistry, clean_piva
+from search_index import ProductIndex
+from facts import FactTable
+from prices import PriceView
+from cart import km_negozi, ottimizza_carrello
+from receipts import RegistroSalvataggi, ScontrinoGiaSalvato, salva_scontrino
+from ingest import PROMPT_VERSION, analizza_in_parallelo, costruisci_prompt
+from matcher import CatalogMatcher, abbina_prodotti
+from analysis_cache import AnalysisCache, chiave_analisi
+from preprocess import PREPROCESS_MAX_EDGE, prepara_immagine
+from storage import COLONNE_CATALOGO, STORAGE_BACKEND, STORAGE_PATH, SheetsStorage, SQLiteStorage, sincronizza
+from write_queue import WriteQueue
+from metrics import METRICS_FILE, metriche
+from geocoding import GeocodingService, geocodifica_anagrafe
 
 # --- 1. FUNZIONI DI SERVIZIO ---
 
-def get_road_distance(lat1, lon1, lat2, lon2):
-    try:
-        url = f"https://router.project-osrm.org/route/v1/driving/{lon1},{lat1};{lon2},{lat2}?overview=false"
-        r = requests.get(url, timeout=3)
-        data = r.json()
-        if data['code'] == 'Ok':
-            return round(data['routes'][0]['distance'] / 1000, 1)
-    except: pass
-    return None
+@st.cache_resource
+def get_analysis_cache():
+    # Analisi Gemini già fatte, per contenuto delle immagini: stesso scontrino, stessa risposta
+    return AnalysisCache()
+
+@st.cache_resource
+def get_registro_salvataggi():
+    # Chiavi degli scontrini già salvati: doppio clic o nuovo tentativo non duplicano le righe
+    return RegistroSalvataggi()
+
+@st.cache_resource
+def get_distance_service():
+    # Sessione HTTP e cache su disco condivise da tutte le sessioni
+    return DistanceService()
+
+def distanze_negozi(indirizzi, registro, raggio_km=None):
+    """{indirizzo: km} dalla posizione corrente, con una sola richiesta di routing per tutti i negozi.
+    Con raggio_km, i negozi oltre il raggio in linea d'aria restano a 999 senza chiamare il routing."""
+    linea_aria = set()
+    out = km_negozi(indirizzi, registro, st.session_state.my_lat, st.session_state.my_lon, raggio_km=raggio_km,
+                    servizio=get_distance_service(), linea_aria=linea_aria)
+    if linea_aria: st.caption(f"⚠️ Routing non disponibile: {len(linea_aria)} distanze in linea d'aria.")
+    return out
+
+@st.cache_resource
+def get_geocoder():
+    # Un solo client Nominatim (GEOCODER_URL) a frequenza limitata, con cache su disco per indirizzo
+    return GeocodingService()
 
 def get_coords_from_address(address):
-    try:
-        geolocator = Nominatim(user_agent="comparatore_spesa_v32_final")
-        location = geolocator.geocode(address)
-        if location: return location.latitude, location.longitude
-    except: pass
-    return None, None
-
-def clean_piva(piva):
-    solo_numeri = re.sub(r'\D', '', str(piva))
-    return solo_numeri.zfill(11) if solo_numeri else ""
+    coords = get_geocoder().geocode(address)
+    return coords if coords else (None, None)
 
 def clean_price(price_str):
     if isinstance(price_str, (int, float)): return float(price_str)
@@ -44,32 +63,71 @@ def clean_price(price_str):
     try: return float(cleaned)
     except: return 0.0
 
-def generate_short_id():
-    return str(uuid.uuid4())[:8]
-
-def sanitize_value(val):
-    """Pulisce i valori per evitare errori JSON in Google Sheets"""
-    if val is None: return ""
-    if isinstance(val, float):
-        if math.isnan(val) or math.isinf(val): return 0.0
-    return val
+def carica_df(nome):
+    """DataFrame del foglio dalla cache condivisa (colonne e ID_PRODOTTO già ripuliti). Da non modificare in place."""
+    def scarica():
+        with metriche.fase(f"sheets.download.{nome}"): return storage.df(nome)
+    return sheet_cache.get(nome, scarica)
+
+def get_registro_negozi():
+    # Lookup per indirizzo/P.IVA e indice spaziale ricostruiti solo quando l'anagrafe cambia
+    return sheet_cache.derived("registro_negozi", "Anagrafe_Negozi",
+                               lambda prec: StoreRegistry(carica_df("Anagrafe_Negozi").to_dict('records')))
+
+def get_indice_prodotti():
+    # Aggiornato in coda quando il catalogo cresce, ricostruito se cambia altro
+    def costruisci(prec):
+        df_c = carica_df("Catalogo")
+        with metriche.fase("indice_prodotti"): return (prec or ProductIndex()).sync(df_c)
+    return sheet_cache.derived("indice_prodotti", "Catalogo", costruisci)
+
+def get_matcher():
+    # Abbinamento nome letto -> catalogo, aggiornato in coda come l'indice prodotti
+    def costruisci(prec):
+        df_c = carica_df("Catalogo")
+        with metriche.fase("matcher_catalogo"): return (prec or CatalogMatcher()).sync(df_c)
+    return sheet_cache.derived("matcher_catalogo", "Catalogo", costruisci)
+
+def get_fatti():
+    # Scontrini ⋈ Catalogo tipizzato, esteso solo con le righe di scontrino nuove
+    def costruisci(prec):
+        df_s, df_c = carica_df("Scontrini"), carica_df("Catalogo")
+        with metriche.fase("fatti.merge"): return (prec or FactTable()).sync(df_s, df_c)
+    return sheet_cache.derived("fatti", ("Scontrini", "Catalogo"), costruisci)
+
+def get_prezzi():
+    # Ultimo e miglior prezzo per (prodotto, negozio): a ogni salvataggio si aggiornano solo le coppie toccate
+    def costruisci(prec):
+        fatti = get_fatti()
+        with metriche.fase("vista_prezzi"): return (prec or PriceView()).sync(fatti)
+    return sheet_cache.derived("prezzi_correnti", ("Scontrini", "Catalogo"), costruisci)
 
 # --- 2. CONNESSIONE ---
+# Client creati una volta per processo; fogli e modello si aprono al primo utilizzo
+@st.cache_resource
+def get_clients():
+    return ClientManager(dict(st.secrets), api_key=st.secrets["GEMINI_API_KEY"])
+
+# Archivio delle tabelle: Google Sheets (predefinito) o SQLite locale, sincronizzabile con i fogli
+@st.cache_resource
+def get_storage():
+    if STORAGE_BACKEND == "sqlite": return SQLiteStorage(STORAGE_PATH)
+    return SheetsStorage(get_clients())
+
+# Salvataggi registrati su disco e inviati all'archivio in background; a invio riuscito la cache si aggiorna
+@st.cache_resource
+def get_write_queue():
+    return WriteQueue(get_storage(), on_flush=lambda tabelle: sheet_cache.invalidate(*tabelle)).start()
+
+# Tempi per fase del rerun: dal pannello debug (solo questa sessione) o con METRICS=1 (tutte, su file)
+if st.session_state.get('_traccia'): metriche.chiudi(st.session_state._traccia)  # rerun interrotto da st.stop/st.rerun
+debug_metriche = st.sidebar.checkbox("🐞 Metriche prestazioni", key="debug_metriche")
+st.session_state._traccia = metriche.inizia("rerun", attiva=debug_metriche, sessione=id(st.session_state))
+
 try:
-    API_KEY = st.secrets["GEMINI_API_KEY"]
-    genai.configure(api_key=API_KEY)
-    google_info = dict(st.secrets)
-    scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-    creds = Credentials.from_service_account_info(google_info, scopes=scopes)
-    gc = gspread.authorize(creds)
-    
-    sh = gc.open("Database_Prezzi")
-    ws_scontrini = sh.worksheet("Scontrini") 
-    ws_catalogo = sh.worksheet("Catalogo")
-    ws_negozi = sh.worksheet("Anagrafe_Negozi")
-    
-    lista_negozi_raw = ws_negozi.get_all_records()
-    model = genai.GenerativeModel('models/gemini-2.5-flash')
+    clients = get_clients()
+    storage = get_storage()
+    coda = get_write_queue()
 except Exception as e:
     st.error(f"Errore connessione: {e}")
     st.stop()
@@ -82,6 +140,37 @@ if 'uploader_key' not in st.session_state: st.session_state.uploader_key = 0
 
 st.title("🛍️ Spesa Normalizzata & Geolocalizzata - VERSIONE TEST")
 
+with st.sidebar.expander("⚙️ Cache fogli"):
+    st.json(sheet_cache.stats())
+    if isinstance(storage, SQLiteStorage) and st.button("🔄 Sincronizza con Google Sheets"):
+        with st.spinner("Sincronizzazione..."):
+            try:
+                esito = sincronizza(storage, SheetsStorage(clients))
+                sheet_cache.invalidate()
+                st.success(", ".join(f"{t}: ↑{a} ↓{b}" for t, (a, b) in esito.items()))
+            except Exception as e:
+                st.error(f"Errore sincronizzazione: {e}")
+    if st.button("📍 Geocodifica negozi senza coordinate"):
+        with st.spinner("Geocodifica dell'anagrafe..."):
+            try:
+                completati, mancanti = geocodifica_anagrafe(storage, get_geocoder())
+                sheet_cache.invalidate("Anagrafe_Negozi")
+                st.success(f"{completati} negozi geocodificati, {mancanti} ancora senza coordinate.")
+            except Exception as e:
+                st.error(f"Errore geocodifica: {e}")
+    if st.button("🧮 Ricostruisci vista prezzi"):
+        sheet_cache.discard("fatti", "prezzi_correnti")
+        st.success(f"Vista prezzi ricostruita: {len(get_prezzi())} coppie prodotto/negozio.")
+
+with st.sidebar.expander("📤 Coda salvataggi"):
+    stats_coda = coda.stats()
+    st.json(stats_coda)
+    if st.button("📤 Invia ora"):
+        try: st.success(f"Inviate {coda.flush()} righe.")
+        except Exception as e: st.error(f"Invio non riuscito, si riproverà: {e}")
+    if stats_coda["scontrini_in_errore"] and st.button("♻️ Riprova scontrini in errore"):
+        st.success(f"{coda.riprova_errori()} voci di nuovo in coda.")
+
 tab_carica, tab_cerca, tab_carrello = st.tabs(["📷 CARICA", "🔍 CERCA PRODOTTO", "🛒 CARRELLO OTTIMIZZATO"])
 
 # --- TAB 1: CARICAMENTO ---
@@ -95,204 +184,156 @@ with tab_carica:
         key=f"uploader_{st.session_state.uploader_key}"
     )
     
+    with st.expander("🖼️ Ottimizzazione immagini"):
+        ottimizza = st.checkbox("Scala di grigi, ritaglio e compressione prima dell'invio", value=True)
+        max_lato = st.slider("Lato lungo massimo (px)", 800, 3200, PREPROCESS_MAX_EDGE, step=100)
+        forza = st.checkbox("Ignora le analisi già in cache (rianalizza)", value=False)
+        streaming = st.checkbox("Mostra i prodotti man mano che vengono letti (streaming)", value=True)
+        st.json(get_analysis_cache().stats())
+    
     if files:
         imgs = [ImageOps.exif_transpose(Image.open(f)) for f in files]
         st.image(imgs, width=150)
         
+        modo = st.radio("Le immagini sono", ["Uno scontrino per immagine", "Pagine dello stesso scontrino"], horizontal=True)
+        
         if st.button("🚀 ANALIZZA E NORMALIZZA"):
-            with st.spinner("Analisi scontrino in corso..."):
-                try:
-                    # Carichiamo nomi noti per aiutare il matching
-                    try:
-                        catalogo_raw = ws_catalogo.get_all_records()
-                        nomi_noti = list(set([r['NOME_NORMALIZZATO'] for r in catalogo_raw if r['NOME_NORMALIZZATO']]))
-                    except: nomi_noti = []
-                    
-                    # --- PROMPT IBRIDO (CONTABILE + DATA MANAGER + SCONTRINO ID) ---
-                    prompt = f"""
-                    Agisci con due ruoli simultanei: 
-                    1. CONTABILE (per i calcoli di cassa precisi)
-                    2. DATA MANAGER (per la normalizzazione del database)
-
-                    Analizza le immagini dello scontrino seguendo rigorosamente queste FASI:
-
-                    --- FASE 1: TESTATA E IDENTIFICATIVI ---
-                    Cerca:
-                    - P.IVA (solo cifre)
-                    - Indirizzo completo
-                    - Data (YYYY-MM-DD)
-                    - NUMERO SCONTRINO: Cerca etichette come 'Scontrino n.', 'Doc.', 'RT', 'SF', '#'. Estrai il codice identificativo univoco.
-
-                    --- FASE 2: PULIZIA CONTABILE (Regole 'V18') ---
-                    A. SCONTI E PREZZI NEGATIVI: 
-                       Se vedi righe come 'SCONTO', 'FIDATY', o importi col segno meno (-0.50) subito sotto un prodotto:
-                       - NON creare una riga per lo sconto.
-                       - SOTTRAI il valore al prezzo del prodotto sopra. 
-                       - Imposta 'is_offerta' su "SI".
-
-                    B. MOLTIPLICATORI:
-                       Se vedi '3 x 1.50' (3 pezzi a 1.50 l'uno):
-                       - 'quantita_acquistata' = 3
-                       - 'prezzo_unitario' = 1.50
-
-                    --- FASE 3: ESTRAZIONE E NORMALIZZAZIONE DATABASE ---
-                    Per ogni riga risultante dalla Fase 2, estrai:
-                    
-                    1. 'nome_grezzo': Testo originale.
-                    2. 'nome_normalizzato': Nome standard descrittivo (es. 'LATTE GRANAROLO P.S. 1L').
-                       - Se simile a questi, usa ESATTAMENTE questo nome: {nomi_noti[:50]}
-                    3. 'brand': Marca (es. GRANAROLO). Se non c'è, 'GENERICO'.
-                    4. 'categoria': Macro categoria (es. LATTE, PASTA).
-                    5. 'formato': SOLO IL NUMERO (es. 1.0, 0.5).
-                    6. 'unita': SOLO 'KG', 'L', 'PZ'. Converti tutto (500ml -> 0.5 L).
-
-                    OUTPUT JSON:
-                    {{
-                      "testata": {{ "p_iva": "", "indirizzo": "", "data_iso": "", "num_scontrino": "" }},
-                      "prodotti": [
-                        {{
-                          "nome_grezzo": "...", "nome_normalizzato": "...", "brand": "...", "categoria": "...",
-                          "formato": 1.0, "unita": "L", "prezzo_unitario": 0.0, "quantita_acquistata": 1, "is_offerta": "NO"
-                        }}
-                      ]
-                    }}
-                    """
-                    response = model.generate_content([prompt, *imgs])
-                    text_resp = response.text.strip().replace('```json', '').replace('```', '')
-                    st.session_state.dati_analizzati = json.loads(text_resp)
-                    st.rerun()
-                except Exception as e: st.error(f"Errore IA: {e}")
-
-    # --- UI DI REVISIONE ---
+            # Immagini alleggerite (grigio, ritaglio, JPEG ridotto) o originali
+            if ottimizza:
+                with metriche.fase("immagini.preprocess"): preparate = [prepara_immagine(f.getvalue(), max_lato) for f in files]
+            else: preparate = [(img, {'byte_prima': f.size, 'byte_dopo': f.size}) for f, img in zip(files, imgs)]
+            
+            # Ogni scontrino è un lavoro a sé: richieste in parallelo, limitate, ripetute se Gemini è occupato
+            if modo == "Uno scontrino per immagine": indici = [[i] for i in range(len(files))]
+            else: indici = [list(range(len(files)))]
+            gruppi = [(" + ".join(files[i].name for i in g), [preparate[i][0] for i in g]) for g in indici]
+            chiavi = [chiave_analisi([files[i].getvalue() for i in g], PROMPT_VERSION) for g in indici]
+            barra = st.progress(0.0, text=f"Analisi di {len(gruppi)} scontrini...")
+            def avanzamento(r, fatti, totale):
+                barra.progress(fatti / totale, text=f"{'✅' if r['dati'] else '❌'} {r['nome']} ({fatti}/{totale})")
+            # Righe lette finora, aggiornate a ogni prodotto completato nello stream
+            anteprima, letti = st.empty(), []
+            def nuovo_prodotto(i, prod):
+                letti.append({'Scontrino': gruppi[i][0], 'Prodotto': prod.get('nome_grezzo', ''),
+                              'Prezzo €': prod.get('prezzo_unitario', ''), 'Qtà': prod.get('quantita_acquistata', '')})
+                anteprima.dataframe(pd.DataFrame(letti), use_container_width=True, hide_index=True)
+            with metriche.fase("gemini.analisi"):
+                risultati = analizza_in_parallelo(clients.model, costruisci_prompt(), gruppi, on_done=avanzamento,
+                                                  cache=get_analysis_cache(), chiavi=chiavi, forza=forza,
+                                                  on_prodotto=nuovo_prodotto if streaming else None)
+            for r, g in zip(risultati, indici):
+                r['id'] = uuid.uuid4().hex[:8]
+                r['byte_prima'] = sum(preparate[i][1]['byte_prima'] for i in g)
+                r['byte_dopo'] = sum(preparate[i][1]['byte_dopo'] for i in g)
+            # Abbinamento locale al catalogo intero (nomi, marca, formato)
+            try: matcher = get_matcher()
+            except: matcher = None
+            with metriche.fase("catalogo.abbinamento"):
+                for r in risultati:
+                    if matcher and r['dati']: abbina_prodotti(r['dati'].get('prodotti', []), matcher)
+            st.session_state.dati_analizzati = (st.session_state.dati_analizzati or []) + risultati
+            st.rerun()
+
+    # --- UI DI REVISIONE (uno scontrino alla volta) ---
     if st.session_state.dati_analizzati:
-        d = st.session_state.dati_analizzati
-        testata = d.get('testata', {})
-        prodotti = d.get('prodotti', [])
+        voci = st.session_state.dati_analizzati
+        sel = st.selectbox("Scontrino da revisionare", range(len(voci)),
+                           format_func=lambda i: f"{'✅' if voci[i]['dati'] else '❌'} {voci[i]['nome']}")
+        voce = voci[sel]
+        if voce['da_cache']: st.caption("♻️ Analisi dalla cache (stesse immagini già analizzate)")
+        else: st.caption(f"Immagini {voce['byte_prima'] / 1024:.0f} KB → {voce['byte_dopo'] / 1024:.0f} KB inviati · analisi {voce['secondi']:.1f} s")
+        if voce['parziale']: st.warning("⚠️ Risposta interrotta: qui sotto i prodotti letti prima dell'errore, controlla che non ne manchino.")
+        if voce['errore']:
+            st.error(f"Errore IA: {voce['errore']}")
+            if st.button("🗑️ Scarta"):
+                voci.pop(sel)
+                if not voci: st.session_state.dati_analizzati = None
+                st.rerun()
+        else:
+            d = voce['dati']
+            kid = voce['id']
+            testata = d.get('testata', {})
+            prodotti = d.get('prodotti', [])
         
-        # Calcolo Totale
-        tot_calc = sum([clean_price(p.get('prezzo_unitario', 0)) * float(p.get('quantita_acquistata', 1)) for p in prodotti])
+            # Calcolo Totale
+            tot_calc = sum([clean_price(p.get('prezzo_unitario', 0)) * float(p.get('quantita_acquistata', 1)) for p in prodotti])
 
-        # Match Negozio
-        piva_l = clean_piva(testata.get('p_iva', ''))
-        match = next((n for n in lista_negozi_raw if clean_piva(n.get('P_IVA', '')) == piva_l), None)
+            # Match Negozio
+            piva_l = clean_piva(testata.get('p_iva', ''))
+            try: match = get_registro_negozi().per_piva(piva_l)
+            except Exception as e: st.error(f"Errore connessione: {e}"); match = None
         
-        st.markdown("### 🧾 Dettagli Scontrino")
-        c1, c2, c3, c4 = st.columns(4)
-        with c1: insegna_f = st.text_input("Supermercato", value=(match['Insegna_Standard'] if match else f"NUOVO ({piva_l})")).upper()
-        with c2: data_f = st.text_input("Data", value=testata.get('data_iso', '2026-01-01'))
-        with c3: num_scontrino_f = st.text_input("N. Scontrino", value=testata.get('num_scontrino', '')).upper()
-        with c4: st.metric("Totale Letto", f"€ {tot_calc:.2f}")
+            st.markdown("### 🧾 Dettagli Scontrino")
+            c1, c2, c3, c4 = st.columns(4)
+            with c1: insegna_f = st.text_input("Supermercato", value=(match['Insegna_Standard'] if match else f"NUOVO ({piva_l})"), key=f"insegna_{kid}").upper()
+            with c2: data_f = st.text_input("Data", value=testata.get('data_iso', '2026-01-01'), key=f"data_{kid}")
+            with c3: num_scontrino_f = st.text_input("N. Scontrino", value=testata.get('num_scontrino', ''), key=f"num_{kid}").upper()
+            with c4: st.metric("Totale Letto", f"€ {tot_calc:.2f}")
         
-        indirizzo_f = st.text_input("Indirizzo", value=(match['Indirizzo_Standard (Pulito)'] if match else testata.get('indirizzo', ''))).upper()
+            indirizzo_f = st.text_input("Indirizzo", value=(match['Indirizzo_Standard (Pulito)'] if match else testata.get('indirizzo', '')), key=f"indirizzo_{kid}").upper()
+            # Storico del negozio: su SQLite una query sull'indice (Negozio, Indirizzo), su Sheets dal foglio in cache
+            try:
+                storico = storage.righe_negozio(insegna_f, indirizzo_f, df=carica_df("Scontrini"))
+                if not storico.empty: st.caption(f"🗂️ {len(storico)} righe già salvate per questo negozio, ultima il {storico['Data'].astype(str).max()}")
+            except Exception: pass
 
-        st.markdown("### 🛒 Prodotti (Normalizzazione)")
+            st.markdown("### 🛒 Prodotti (Normalizzazione)")
         
-        # Editor Tabella
-        df_editor = pd.DataFrame(prodotti)
-        col_map = {
-            "nome_grezzo": "Scontrino", "nome_normalizzato": "Nome Catalogo (Editabile)", 
-            "prezzo_unitario": "Prezzo €", "quantita_acquistata": "Qtà",
-            "formato": "Peso/Vol (Tot)", "unita": "Unità (KG/L/PZ)",
-            "brand": "Marca", "categoria": "Cat", "is_offerta": "Offerta"
-        }
-        # Aggiunta colonne mancanti per sicurezza
-        for k in col_map.keys():
-            if k not in df_editor.columns: df_editor[k] = ""
+            # Editor Tabella
+            df_editor = pd.DataFrame(prodotti)
+            col_map = {
+                "nome_grezzo": "Scontrino", "nome_normalizzato": "Nome Catalogo (Editabile)", 
+                "prezzo_unitario": "Prezzo €", "quantita_acquistata": "Qtà",
+                "formato": "Peso/Vol (Tot)", "unita": "Unità (KG/L/PZ)",
+                "brand": "Marca", "categoria": "Cat", "is_offerta": "Offerta",
+                "match": "Match Catalogo", "alternative": "Alternative"
+            }
+            # Aggiunta colonne mancanti per sicurezza
+            for k in col_map.keys():
+                if k not in df_editor.columns: df_editor[k] = ""
             
-        df_editor = df_editor.rename(columns=col_map)
-        edited_df = st.data_editor(df_editor, use_container_width=True, num_rows="dynamic", hide_index=True)
+            df_editor = df_editor.rename(columns=col_map)
+            edited_df = st.data_editor(df_editor, use_container_width=True, num_rows="dynamic", hide_index=True, key=f"editor_{kid}")
 
-        if st.button("💾 SALVA NEL DATABASE RELAZIONALE"):
-            with st.spinner("Salvataggio e pulizia in corso..."):
+            if st.button("💾 SALVA NEL DATABASE RELAZIONALE"):
+                with st.spinner("Salvataggio in corso..."):
                 
-                # 1. Controlli Catalogo
-                try:
-                    if not ws_catalogo.get_all_values():
-                        ws_catalogo.append_row(["ID_PRODOTTO", "NOME_NORMALIZZATO", "BRAND", "CATEGORIA", "FORMATO", "UNITA"])
-                except: pass
+                    # Catalogo e scontrini dalla cache condivisa (un solo download ciascuno)
+                    try: df_cat = carica_df("Catalogo")
+                    except: df_cat = pd.DataFrame()
+                    try: df_scontrini = carica_df("Scontrini")
+                    except: df_scontrini = None
+                    # Prodotti nuovi ancora in coda: un secondo scontrino con lo stesso prodotto ne riusa l'ID
+                    in_coda = coda.in_attesa("Catalogo")
+                    if in_coda: df_cat = pd.concat([df_cat, pd.DataFrame(in_coda, columns=COLONNE_CATALOGO)], ignore_index=True)
                 
-                try:
-                    cat_records = ws_catalogo.get_all_records()
-                    df_cat = pd.DataFrame(cat_records)
-                except: df_cat = pd.DataFrame()
-                
-                rows_scontrini = []
-                rows_catalogo_new = []
-                
-                for idx, row in edited_df.iterrows():
-                    # Preparazione Dati Puliti
-                    norm_name = str(row["Nome Catalogo (Editabile)"]).upper().strip()
-                    brand = str(row["Marca"]).upper().strip()
-                    cat = str(row["Cat"]).upper().strip()
-                    unit = str(row["Unità (KG/L/PZ)"]).upper().strip()
-                    
-                    try: fmt = float(str(row["Peso/Vol (Tot)"]).replace(',', '.'))
-                    except: fmt = 1.0
-                    fmt = sanitize_value(fmt)
-                    
-                    # LOGICA ID (Relazionale)
-                    prod_id = None
-                    # A. Cerca nel DB
-                    if not df_cat.empty and 'NOME_NORMALIZZATO' in df_cat.columns:
-                        match_prod = df_cat[df_cat['NOME_NORMALIZZATO'] == norm_name]
-                        if not match_prod.empty: prod_id = str(match_prod.iloc[0]['ID_PRODOTTO'])
-                    
-                    # B. Cerca nei Nuovi
-                    if not prod_id:
-                        for new_p in rows_catalogo_new:
-                            if new_p[1] == norm_name:
-                                prod_id = str(new_p[0]); break
-                    
-                    # C. Crea Nuovo
-                    if not prod_id:
-                        prod_id = generate_short_id()
-                        rows_catalogo_new.append([str(prod_id), norm_name, brand, cat, fmt, unit])
-                    
-                    # Prezzi e Totali
-                    try: p_unit = float(str(row["Prezzo €"]).replace(',', '.'))
-                    except: p_unit = 0.0
-                    try: qta = float(str(row["Qtà"]).replace(',', '.'))
-                    except: qta = 1.0
-                    
-                    p_unit = sanitize_value(p_unit)
-                    qta = sanitize_value(qta)
-                    tot_riga = sanitize_value(p_unit * qta)
-
-                    # COSTRUZIONE RIGA (12 Colonne ora, inclusa Num Scontrino in L)
-                    riga_completa = [
-                        str(data_f),                        # A
-                        str(insegna_f),                     # B
-                        str(indirizzo_f),                   # C
-                        str(row["Scontrino"]).upper(),      # D
-                        tot_riga,                           # E
-                        0,                                  # F
-                        p_unit,                             # G
-                        str(row["Offerta"]).upper(),        # H
-                        qta,                                # I
-                        "SI",                               # J
-                        str(prod_id),                       # K (ID Prodotto)
-                        str(num_scontrino_f)                # L (NUOVO: Numero Scontrino)
-                    ]
-                    rows_scontrini.append(riga_completa)
-
-                # Scrittura su Google Sheets
-                try:
-                    if rows_catalogo_new:
-                        ws_catalogo.append_rows(rows_catalogo_new, value_input_option='USER_ENTERED')
-                    
-                    if rows_scontrini:
-                        ws_scontrini.append_rows(rows_scontrini, value_input_option='USER_ENTERED')
-                        
-                    st.success(f"✅ Salvataggio completato! Aggiunte {len(rows_scontrini)} righe.")
+                    # Registrazione nella coda (al massimo una volta per scontrino): l'invio all'archivio avviene in background
+                    try:
+                        with metriche.fase("salvataggio"):
+                            n_righe = salva_scontrino(storage, df_cat, edited_df, data_f, insegna_f, indirizzo_f, num_scontrino_f,
+                                                      piva=piva_l, registro=get_registro_salvataggi(), df_scontrini=df_scontrini,
+                                                      coda=coda)
+                        st.toast(f"📥 Scontrino in coda: {n_righe} righe, invio in background.")
                     
-                    # Reset e Ricarica
-                    st.session_state.dati_analizzati = None
-                    st.session_state.uploader_key += 1
-                    time.sleep(1)
-                    st.rerun()
+                        # Reset e Ricarica: si passa allo scontrino successivo, l'uploader si svuota alla fine
+                        voci.pop(sel)
+                        if not voci:
+                            st.session_state.dati_analizzati = None
+                            st.session_state.uploader_key += 1
+                        st.rerun()
                     
-                except Exception as e:
-                    st.error(f"Errore scrittura Google: {e}")
+                    except ScontrinoGiaSalvato as e:
+                        # Lo stato nella coda dice se il salvataggio precedente è già arrivato all'archivio
+                        invio = {'in_attesa': " (ancora in coda, invio in background)",
+                                 'errore': " (invio fallito: vedi 📤 Coda salvataggi)"}.get(coda.stato(str(e)), "")
+                        st.warning(f"Questo scontrino (negozio, numero e data) risulta già salvato{invio}: nessuna riga aggiunta.")
+                        voci.pop(sel)
+                        if not voci: st.session_state.dati_analizzati = None
+                    except Exception as e:
+                        # Salvataggio interrotto a metà: il catalogo in cache potrebbe non avere i prodotti già scritti,
+                        # e un nuovo tentativo ne creerebbe altri ID
+                        sheet_cache.invalidate("Catalogo")
+                        st.error(f"Errore salvataggio: {e}")
 
 # --- TAB 2: RICERCA (Logica Relazionale) ---
 with tab_cerca:
@@ -319,65 +360,63 @@ with tab_cerca:
 
     st.markdown("---")
     query = st.text_input("🔍 Cerca Prodotto (es. Latte, Tonno, Granarolo)", key="search_norm").upper().strip()
+    raggio_cerca = st.slider("Raggio (km)", 1, 100, 100, key="raggio_cerca") if st.session_state.my_lat else None
     
     if query:
         with st.spinner("Ricerca nel database normalizzato..."):
             try:
-                data_scontrini = ws_scontrini.get_all_records()
-                data_catalogo = ws_catalogo.get_all_records()
+                df_s = carica_df("Scontrini")
+                df_c = carica_df("Catalogo")
                 
-                if data_scontrini and data_catalogo:
-                    df_s = pd.DataFrame(data_scontrini)
-                    df_c = pd.DataFrame(data_catalogo)
+                if not df_s.empty and not df_c.empty:
+                    # Filtro sul catalogo indicizzato, poi il prezzo corrente di quei prodotti in ogni negozio
+                    indice, prezzi = get_indice_prodotti(), get_prezzi()
+                    # Più parole in un altro ordine o in campi diversi (es. "GRANAROLO LATTE"): tutte come parole intere
+                    with metriche.fase("ricerca.indice"):
+                        ids = indice.search(query) or (indice.search_tokens(query) if len(query.split()) > 1 else set())
+                        res = prezzi.righe(ids).copy()
                     
-                    # Join Relazionale
-                    df_s['ID_PRODOTTO'] = df_s['ID_PRODOTTO'].astype(str)
-                    df_c['ID_PRODOTTO'] = df_c['ID_PRODOTTO'].astype(str)
-                    df_full = pd.merge(df_s, df_c, on='ID_PRODOTTO', how='inner')
-                    
-                    # Filtro
-                    mask = (
-                        df_full['NOME_NORMALIZZATO'].str.contains(query, na=False) |
-                        df_full['BRAND'].str.contains(query, na=False) |
-                        df_full['CATEGORIA'].str.contains(query, na=False)
-                    )
-                    res = df_full[mask].copy()
+                    # Calcolo Distanze (deduplicate per negozio, una richiesta in blocco)
+                    if st.session_state.my_lat:
+                        registro = get_registro_negozi()
+                        km_map = distanze_negozi(res['Indirizzo'].astype(str), registro, raggio_km=raggio_cerca)
+                        # Negozi senza coordinate in anagrafe: restano nei risultati con distanza sconosciuta (vuota, in fondo a parità di prezzo)
+                        ignoti = {a for a in km_map if registro.coords_of(a) is None}
+                        for a in ignoti: km_map[a] = float('nan')
+                        res['KM'] = res['Indirizzo'].astype(str).map(km_map)
+                        res = res[(res['KM'] <= raggio_cerca) | res['KM'].isna()].copy()
+                        n_ignoti = res.loc[res['KM'].isna(), 'Indirizzo'].nunique()
+                        if n_ignoti: st.caption(f"❔ {n_ignoti} negozi senza coordinate: distanza sconosciuta.")
+                    else: res['KM'] = 999
                     
                     if not res.empty:
-                        # Calcoli Prezzi
-                        res['Prezzo_Unitario'] = res['Prezzo_Unitario'].apply(clean_price)
-                        res['FORMATO'] = pd.to_numeric(res['FORMATO'], errors='coerce').fillna(1)
-                        res['PREZZO_AL_L_KG'] = res['Prezzo_Unitario'] / res['FORMATO']
-                        
-                        # Calcolo Distanze
-                        def add_dist(row):
-                            if not st.session_state.my_lat: return 999
-                            addr_clean = re.sub(r'\W+', '', str(row['Indirizzo'])).upper()
-                            neg = next((n for n in lista_negozi_raw if re.sub(r'\W+', '', str(n.get('Indirizzo_Standard (Pulito)', ''))).upper() == addr_clean), None)
-                            if neg and neg.get('Latitudine'):
-                                try: return get_road_distance(st.session_state.my_lat, st.session_state.my_lon, float(str(neg['Latitudine']).replace(',','.')), float(str(neg['Longitudine']).replace(',','.')))
-                                except: return 888
-                            return 999
-
-                        res['KM'] = res.apply(add_dist, axis=1)
-                        res = res.sort_values(by=['PREZZO_AL_L_KG', 'KM'])
+                        # Prezzo per KG/L/PZ calcolato al salvataggio: si confrontano prezzi nella stessa unità,
+                        # prima quella più frequente tra i risultati
+                        u = res['UNITA_RIF'].mode().iloc[0]
+                        res = res.assign(_ALTRA_UNITA=res['UNITA_RIF'] != u).sort_values(by=['_ALTRA_UNITA', 'PREZZO_AL_L_KG', 'KM'])
                         
                         # Top Result
                         best = res.iloc[0]
-                        u = best['UNITA']
                         st.success(f"🏆 Best: **{best['NOME_NORMALIZZATO']}** a **{best['PREZZO_AL_L_KG']:.2f} €/{u}**")
                         st.caption(f"Presso {best['Negozio']} - {best['Data']}")
+                        with st.expander("📜 Storico prezzi del prodotto"):
+                            storico = storage.righe_prodotti("Scontrini", [best['ID_PRODOTTO']], df=df_s)
+                            st.dataframe(storico.reindex(columns=['Data', 'Negozio', 'Indirizzo', 'Prezzo_Unitario', 'In_Offerta']).sort_values(by='Data', ascending=False),
+                                         use_container_width=True, hide_index=True)
                         
-                        # Table
-                        show_cols = ['Data', 'NOME_NORMALIZZATO', 'Prezzo_Unitario', 'PREZZO_AL_L_KG', 'Negozio', 'Indirizzo', 'KM', 'In_Offerta']
-                        renames = {'NOME_NORMALIZZATO': 'Prodotto', 'Prezzo_Unitario': 'Prezzo Conf.', 'PREZZO_AL_L_KG': f'Prezzo/{u}'}
+                        # Table: ultimo prezzo rilevato, con il minimo storico dello stesso negozio
+                        show_cols = ['Data', 'NOME_NORMALIZZATO', 'Prezzo_Unitario', 'PREZZO_AL_L_KG', 'UNITA_RIF', 'PREZZO_MIN_AL_L_KG',
+                                     'N_OSSERVAZIONI', 'Negozio', 'Indirizzo', 'KM', 'In_Offerta']
+                        renames = {'NOME_NORMALIZZATO': 'Prodotto', 'Prezzo_Unitario': 'Prezzo Conf.', 'PREZZO_AL_L_KG': 'Prezzo/Unità',
+                                   'UNITA_RIF': 'Unità', 'PREZZO_MIN_AL_L_KG': 'Minimo/Unità', 'N_OSSERVAZIONI': 'Rilevazioni'}
                         
                         st.dataframe(
                             res[show_cols].rename(columns=renames), 
                             use_container_width=True, 
                             hide_index=True,
                             column_config={
-                                f"Prezzo/{u}": st.column_config.NumberColumn(format="%.2f €"),
+                                "Prezzo/Unità": st.column_config.NumberColumn(format="%.2f €"),
+                                "Minimo/Unità": st.column_config.NumberColumn(format="%.2f €"),
                                 "Prezzo Conf.": st.column_config.NumberColumn(format="%.2f €"),
                                 "KM": st.column_config.NumberColumn(format="%.1f km")
                             }
@@ -430,10 +469,11 @@ with tab_carrello:
         # --- NUOVO SELETTORE PER FRAZIONAMENTO ---
         stops_option = st.select_slider(
             "Max Negozi (Tappe)", 
-            options=[1, 2, 3, "Illimitato"],
+            options=[1, 2, 3, 4, 5, 6, "Illimitato"],
             value=1
         )
         st.caption("Aumenta le tappe per risparmiare di più.")
+        costo_km = st.number_input("Costo viaggio (€/km, 0 = ignora)", min_value=0.0, max_value=5.0, value=0.0, step=0.05, key="costo_km_tab3")
         
         st.write("") 
         b1, b2 = st.columns(2)
@@ -449,147 +489,25 @@ with tab_carrello:
             with st.spinner(f"Ottimizzazione combinatoria per {len(items)} articoli..."):
                 try:
                     # Caricamento e Pulizia DB (Standard)
-                    data_s = ws_scontrini.get_all_records()
-                    data_c = ws_catalogo.get_all_records()
-                    if not data_s or not data_c: st.error("DB vuoto"); st.stop()
-
-                    df_s = pd.DataFrame(data_s); df_c = pd.DataFrame(data_c)
-                    df_s.columns = [c.strip() for c in df_s.columns]
-                    df_c.columns = [c.strip() for c in df_c.columns]
-                    df_s['ID_PRODOTTO'] = df_s['ID_PRODOTTO'].astype(str).str.strip()
-                    df_c['ID_PRODOTTO'] = df_c['ID_PRODOTTO'].astype(str).str.strip()
-                    
-                    df_full = pd.merge(df_s, df_c, on='ID_PRODOTTO', how='inner')
-                    df_full['Prezzo_Unitario'] = df_full['Prezzo_Unitario'].apply(clean_price)
+                    if carica_df("Scontrini").empty or carica_df("Catalogo").empty: st.error("DB vuoto"); st.stop()
+                    # Prezzi correnti: un'osservazione per (prodotto, negozio), senza rileggere lo storico
+                    prezzi = get_prezzi()
                     
-                    # Filtro Distanze
-                    unique_shops = df_full[['Negozio', 'Indirizzo']].drop_duplicates()
-                    shop_geo = {} # { "Negozio - Indirizzo": dist }
-                    valid_shop_keys = []
-
-                    for _, row in unique_shops.iterrows():
-                        k = f"{row['Negozio']} - {row['Indirizzo']}"
-                        if st.session_state.my_lat:
-                            addr_clean = re.sub(r'\W+', '', str(row['Indirizzo'])).upper()
-                            neg = next((n for n in lista_negozi_raw if re.sub(r'\W+', '', str(n.get('Indirizzo_Standard (Pulito)', ''))).upper() == addr_clean), None)
-                            dist = 999
-                            if neg and neg.get('Latitudine'):
-                                try: dist = get_road_distance(st.session_state.my_lat, st.session_state.my_lon, float(str(neg['Latitudine']).replace(',','.')), float(str(neg['Longitudine']).replace(',','.')))
-                                except: dist = 888
-                        else: dist = 0
-                        
-                        shop_geo[k] = dist
-                        if dist <= max_dist_km: valid_shop_keys.append(k)
-                    
-                    if not valid_shop_keys: st.warning("Nessun negozio nel raggio."); st.stop()
-
-                    # --- CREAZIONE MATRICE PREZZI ---
-                    # Struttura: { 'LATTE': { 'Shop A': (0.90, 'Latte Granarolo'), 'Shop B': ... } }
-                    price_matrix = {item: {} for item in items}
-                    
-                    for item in items:
-                        # Ricerca
-                        mask = (df_full['NOME_NORMALIZZATO'].str.contains(item, na=False) | df_full['CATEGORIA'].str.contains(item, na=False))
-                        df_item = df_full[mask]
-                        if df_item.empty: continue
-                        
-                        # Trova miglior prezzo per ogni negozio valido
-                        for shop_key in valid_shop_keys:
-                            neg, ind = shop_key.split(' - ', 1)
-                            sub = df_item[(df_item['Negozio'] == neg) & (df_item['Indirizzo'] == ind)]
-                            if not sub.empty:
-                                best_row = sub.loc[sub['Prezzo_Unitario'].idxmin()]
-                                price_matrix[item][shop_key] = (best_row['Prezzo_Unitario'], best_row['NOME_NORMALIZZATO'])
-
-                    # --- ALGORITMO DI OTTIMIZZAZIONE COMBINATORIA ---
-                    # 1. Calcolo Vincitore Singolo (Tappa = 1)
-                    best_single_shop = None
-                    best_single_total = float('inf')
-                    single_results = []
-
-                    for shop in valid_shop_keys:
-                        tot = 0
-                        found = 0
-                        missing_count = 0
-                        for item in items:
-                            if shop in price_matrix[item]:
-                                tot += price_matrix[item][shop][0]
-                                found += 1
-                            else:
-                                missing_count += 1
-                        
-                        single_results.append({
-                            'Negozio': shop, 'Totale': tot, 'Trovati': found, 
-                            'Missing': missing_count, 'Distanza': shop_geo[shop]
-                        })
-                        
-                        # Logica "Vincitore": Più prodotti trovati, poi prezzo minore
-                        # Penalizziamo pesantemente chi ha prodotti mancanti per il sorting
-                        score = (missing_count * 10000) + tot 
-                        if score < best_single_total and found > 0:
-                            best_single_total = score
-                            best_single_shop = shop
-
-                    # Ordiniamo la classifica singola
-                    df_res = pd.DataFrame(single_results).sort_values(by=['Missing', 'Totale']).reset_index(drop=True)
-                    winner_single = df_res.iloc[0] if not df_res.empty else None
-
-                    # 2. Calcolo Multistop (Se richiesto)
-                    best_combo = None
-                    best_combo_total = float('inf')
-                    best_combo_details = {} # {Item: (Price, ShopKey, Name)}
-
-                    if stops_option == 1:
-                        # Se l'utente vuole 1 stop, il "combo" è il vincitore singolo
-                        target_combo = [winner_single['Negozio']] if winner_single is not None else []
-                    elif stops_option == "Illimitato":
-                        # Mix puro: prende il minimo ovunque
-                        target_combo = valid_shop_keys # Consideriamo tutti i negozi come potenziali
-                    else:
-                        # Combinazioni: 2 o 3 negozi
-                        # Genera combinazioni di dimensione 'stops_option'
-                        # Filtriamo negozi che hanno almeno 1 prodotto per non esplodere
-                        candidate_shops = [r['Negozio'] for r in single_results if r['Trovati'] > 0]
-                        target_combo = None # Sarà calcolato nel loop
-                    
-                    # LOGICA CORE MULTI-STOP
-                    if stops_option != 1:
-                        # Se è illimitato, non iteriamo combinazioni, facciamo one-pass su tutti
-                        combinations = [valid_shop_keys] if stops_option == "Illimitato" else itertools.combinations(candidate_shops, stops_option)
-                        
-                        for combo in combinations:
-                            current_combo_tot = 0
-                            current_combo_map = {}
-                            missing_in_combo = 0
-                            
-                            for item in items:
-                                # Trova il prezzo minimo per questo item TRA I NEGOZI DELLA COMBO
-                                min_p = float('inf')
-                                best_s = None
-                                best_n = ""
-                                
-                                found_in_this_combo = False
-                                for shop in combo:
-                                    if shop in price_matrix[item]:
-                                        p, n = price_matrix[item][shop]
-                                        if p < min_p:
-                                            min_p = p
-                                            best_s = shop
-                                            best_n = n
-                                        found_in_this_combo = True
-                                
-                                if found_in_this_combo:
-                                    current_combo_tot += min_p
-                                    current_combo_map[item] = (min_p, best_s, best_n)
-                                else:
-                                    missing_in_combo += 1
-                            
-                            # Valutazione
-                            score = (missing_in_combo * 10000) + current_combo_tot
-                            if score < best_combo_total:
-                                best_combo_total = score
-                                best_combo_details = current_combo_map
-                                best_combo = combo
+                    # Filtro Distanze (senza posizione tutti i negozi valgono 0 km)
+                    indirizzi = prezzi.df['Indirizzo'].drop_duplicates().astype(str)
+                    km_map = distanze_negozi(indirizzi, get_registro_negozi(), raggio_km=max_dist_km) if st.session_state.my_lat else None
+
+                    # --- OTTIMIZZAZIONE (cart.ottimizza_carrello, la stessa di piani_spesa.py) ---
+                    # Matrice densa articoli × negozi nel raggio, classifica dei negozi singoli e, con più tappe,
+                    # branch-and-bound sulla matrice prezzi
+                    carrello = ottimizza_carrello(
+                        prezzi, get_indice_prodotti(), items, km=km_map, raggio_km=max_dist_km,
+                        tappe=None if stops_option == "Illimitato" else stops_option, costo_km=costo_km, time_budget=1.0
+                    )
+                    if not carrello.pm.shops: st.warning("Nessun negozio nel raggio."); st.stop()
+                    pm, shop_geo, plan = carrello.pm, carrello.distanze, carrello.plan
+                    df_res, winner_single = carrello.classifica, carrello.vincitore
+                    best_combo_details = carrello.dettaglio # {Item: (Price, ShopKey, Name)}
 
                     # --- VISUALIZZAZIONE RISULTATI ---
                     
@@ -605,8 +523,9 @@ with tab_carrello:
                         with st.expander("📝 Vedi lista spesa", expanded=True):
                             shop = winner_single['Negozio']
                             for item in items:
-                                if shop in price_matrix[item]:
-                                    p, n = price_matrix[item][shop]
+                                hit = pm.get(item, shop)
+                                if hit:
+                                    p, n = hit
                                     st.markdown(f"✅ **{item}**: € {p:.2f} <span style='color:grey'>({n})</span>", unsafe_allow_html=True)
                                 else:
                                     st.markdown(f"❌ **{item}**: _Non disponibile_", unsafe_allow_html=True)
@@ -622,6 +541,7 @@ with tab_carrello:
                              if diff > 0.1: risparmio = f"(Risparmi € {diff:.2f} rispetto alla spesa unica)"
                         
                         st.info(f"⚡ PIANO OTTIMIZZATO ({stops_option if stops_option != 'Illimitato' else 'MAX'} TAPPE)")
+                        if not plan.ottimo: st.caption("⏱️ Tempo esaurito: miglior piano trovato finora.")
                         
                         c1, c2 = st.columns(2)
                         c1.metric("Totale Ottimizzato", f"€ {real_total:.2f}")
@@ -673,8 +593,9 @@ with tab_carrello:
                         label = f"#{index+1} | € {totale:.2f} | {trovati}/{len(items)} art. | {distanza} km | {shop_name}"
                         with st.expander(label):
                             for item in items:
-                                if shop_name in price_matrix[item]:
-                                    p, n = price_matrix[item][shop_name]
+                                hit = pm.get(item, shop_name)
+                                if hit:
+                                    p, n = hit
                                     st.markdown(f"✅ **{item}**: € {p:.2f} <span style='color:grey'>({n})</span>", unsafe_allow_html=True)
                                 else:
                                     st.markdown(f"❌ **{item}**: _Non disponibile_", unsafe_allow_html=True)
@@ -682,3 +603,11 @@ with tab_carrello:
                 except Exception as e:
                     st.error(f"Errore tecnico: {e}")
 
+# --- PANNELLO METRICHE (rerun corrente) ---
+traccia = metriche.chiudi(st.session_state.pop('_traccia', None))
+if traccia:
+    with st.sidebar.expander("🐞 Tempi di questo rerun", expanded=True):
+        st.caption(f"Totale {traccia['ms']:.0f} ms · le fasi annidate includono le interne · storico in {METRICS_FILE}")
+        fasi = pd.DataFrame([{'Fase': n, 'Volte': f['volte'], 'ms': f['ms']} for n, f in traccia['fasi'].items()])
+        if not fasi.empty: st.dataframe(fasi.sort_values('ms', ascending=False), hide_index=True, use_container_width=True)
+        if traccia['contatori']: st.json(traccia['contatori'])
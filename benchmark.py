@@ -0,0 +1,274 @@
+"""Benchmark su dati sintetici: ricerca, matrice prezzi, ottimizzatore, salvataggio scontrino, geocodifica e clean_db.
+
+Tutto gira in memoria (fake_sheets o SQLite :memory:): nessuna chiamata a Google Sheets, Gemini, OSRM o Nominatim.
+
+    python benchmark.py --righe 1000 10000 100000 --negozi 50 500 --json risultati.json
+    python benchmark.py --memoria --righe 10000 100000 1000000   # MB della storia prezzi prima/dopo la compattazione
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import clean_db
+from cart import build_price_matrix, km_negozi, shop_key
+from distances import DistanceService
+from facts import FactTable
+from prices import PriceView
+from fake_sheets import FakeClients, FakeSpreadsheet, FakeWorksheet, StubGeocoder, StubRoutingSession
+from geocoding import GeocodingService, geocodifica_anagrafe
+from optimizer import optimize
+from receipts import salva_scontrino
+from search_index import ProductIndex
+from storage import COLONNE_CATALOGO, COLONNE_SCONTRINI, SheetsStorage, SQLiteStorage
+from stores import StoreRegistry
+
+PRODOTTI = ["LATTE", "TONNO", "PASTA", "RISO", "PANE", "BURRO", "YOGURT", "UOVA", "CAFFE", "ZUCCHERO",
+            "FARINA", "OLIO", "BISCOTTI", "PASSATA", "MOZZARELLA", "PROSCIUTTO", "ACQUA", "BIRRA", "MELE", "BANANE"]
+VARIANTI = ["INTERO", "PARZ SCREMATO", "BIO", "CLASSICO", "LIGHT", "INTEGRALE", "EXTRA", "FRESCO"]
+MARCHE = ["GRANAROLO", "BARILLA", "RIO MARE", "MULINO BIANCO", "LAVAZZA", "COOP", "ESSELUNGA", "CONAD"]
+CATEGORIE = ["LATTICINI", "DISPENSA", "BEVANDE", "FRUTTA", "SALUMI", "COLAZIONE"]
+INSEGNE = ["ESSELUNGA", "COOP", "CONAD", "LIDL", "CARREFOUR", "PAM", "EUROSPIN", "IPER"]
+CASA = (45.46, 9.19)
+
+
+def genera(n_righe, n_negozi, seed=0):
+    """Catalogo, Scontrini e Anagrafe_Negozi sintetici (DataFrame con le colonne dei fogli veri)."""
+    rng = np.random.default_rng(seed)
+    n_prod = max(50, n_righe // 10)
+    catalogo = pd.DataFrame({
+        'ID_PRODOTTO': [f"P{i:07d}" for i in range(n_prod)],
+        'NOME_NORMALIZZATO': [f"{PRODOTTI[i % len(PRODOTTI)]} {VARIANTI[(i // len(PRODOTTI)) % len(VARIANTI)]} {i}"
+                              for i in range(n_prod)],
+        'BRAND': rng.choice(MARCHE, n_prod),
+        'CATEGORIA': rng.choice(CATEGORIE, n_prod),
+        'FORMATO': rng.choice([0.25, 0.5, 1, 1.5, 2], n_prod),
+        'UNITA': rng.choice(["KG", "L", "PZ"], n_prod),
+    })[COLONNE_CATALOGO]
+
+    negozi = pd.DataFrame({
+        'Insegna_Standard': [INSEGNE[i % len(INSEGNE)] for i in range(n_negozi)],
+        'Indirizzo_Standard (Pulito)': [f"VIA ROMA {i + 1}, MILANO" for i in range(n_negozi)],
+        'P_IVA': [f"{i + 1:011d}" for i in range(n_negozi)],
+        'Latitudine': np.round(CASA[0] + rng.uniform(-0.4, 0.4, n_negozi), 6),
+        'Longitudine': np.round(CASA[1] + rng.uniform(-0.5, 0.5, n_negozi), 6),
+    })
+
+    neg = rng.integers(0, n_negozi, n_righe)
+    prod = rng.integers(0, n_prod, n_righe)
+    prezzo = np.round(rng.uniform(0.3, 15.0, n_righe), 2)
+    qta = rng.integers(1, 4, n_righe)
+    giorni = pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 365, n_righe), unit="D")
+    scontrini = pd.DataFrame(dict(zip(COLONNE_SCONTRINI, [
+        giorni.strftime("%Y-%m-%d"),
+        negozi['Insegna_Standard'].to_numpy()[neg],
+        negozi['Indirizzo_Standard (Pulito)'].to_numpy()[neg],
+        catalogo['NOME_NORMALIZZATO'].to_numpy()[prod],
+        np.round(prezzo * qta, 2),
+        0,
+        prezzo,
+        rng.choice(["SI", "NO"], n_righe, p=[0.2, 0.8]),
+        qta,
+        "SI",
+        catalogo['ID_PRODOTTO'].to_numpy()[prod],
+        [f"S{i // 20:06d}" for i in range(n_righe)],
+    ])))
+    return catalogo, scontrini, negozi
+
+
+def genera_legacy(n_righe, quota_duplicati=0.1, seed=0):
+    """Foglio storico ripulito da clean_db, con una quota di righe duplicate."""
+    rng = np.random.default_rng(seed)
+    n_unici = max(1, int(n_righe * (1 - quota_duplicati)))
+    df = pd.DataFrame({
+        'Data': [f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}" for i in range(n_unici)],
+        'Supermercato': rng.choice(INSEGNE, n_unici),
+        'Indirizzo': [f"VIA ROMA {i % 97 + 1}" for i in range(n_unici)],
+        'Prodotto': [f"{PRODOTTI[i % len(PRODOTTI)]} {i}" for i in range(n_unici)],
+        'Prezzo_Netto': np.round(rng.uniform(0.3, 15.0, n_unici), 2),
+        'Prezzo Un.': np.round(rng.uniform(0.3, 15.0, n_unici), 2),
+    })
+    dup = df.iloc[rng.integers(0, n_unici, n_righe - n_unici)]
+    return pd.concat([df, dup], ignore_index=True)
+
+
+def archivio(backend, tabelle):
+    """Storage del backend richiesto riempito con {tabella: DataFrame} (foglio in memoria o SQLite in memoria)."""
+    if backend == "sqlite":
+        st = SQLiteStorage(":memory:")
+        for t, df in tabelle.items(): st.append(t, df.values.tolist(), colonne=df.columns.tolist())
+        return st
+    return SheetsStorage(FakeClients(FakeSpreadsheet([FakeWorksheet.from_df(t, df) for t, df in tabelle.items()])))
+
+
+def revisione(catalogo, n=30, seed=0):
+    """Scontrino come esce dall'editor di revisione: metà prodotti già a catalogo, metà nuovi."""
+    rng = np.random.default_rng(seed)
+    noti = catalogo['NOME_NORMALIZZATO'].sample(n // 2, random_state=seed).tolist()
+    nomi = noti + [f"NUOVO PRODOTTO {seed}-{i}" for i in range(n - len(noti))]
+    return pd.DataFrame({
+        "Scontrino": nomi, "Nome Catalogo (Editabile)": nomi,
+        "Marca": rng.choice(MARCHE, n), "Cat": rng.choice(CATEGORIE, n),
+        "Peso/Vol (Tot)": rng.choice(["0,5", "1", "1.5"], n), "Unità (KG/L/PZ)": rng.choice(["KG", "L", "PZ"], n),
+        "Prezzo €": [f"{p:.2f}".replace('.', ',') for p in rng.uniform(0.3, 15.0, n)],
+        "Qtà": rng.integers(1, 4, n).astype(str), "Offerta": rng.choice(["SI", "NO"], n),
+    })
+
+
+def misura(fn, setup=None, ripetizioni=3):
+    """Tempo migliore su `ripetizioni` esecuzioni e picco di memoria (tracemalloc) su un'esecuzione a parte."""
+    tempi = []
+    for _ in range(ripetizioni):
+        arg = setup() if setup else None
+        t0 = time.perf_counter()
+        fn(arg) if setup else fn()
+        tempi.append(time.perf_counter() - t0)
+    arg = setup() if setup else None
+    tracemalloc.start()
+    try:
+        fn(arg) if setup else fn()
+        picco = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'secondi': min(tempi), 'picco_mb': picco / 2 ** 20}
+
+
+def esegui(n_righe, n_negozi, ripetizioni=3, k=4, costo_km=0.2, seed=0, backend="sheets"):
+    catalogo, scontrini, negozi = genera(n_righe, n_negozi, seed)
+    storage = archivio(backend, {"Scontrini": scontrini, "Catalogo": catalogo, "Anagrafe_Negozi": negozi})
+    df_s, df_c = storage.df("Scontrini"), storage.df("Catalogo")
+    registro = StoreRegistry(storage.df("Anagrafe_Negozi").to_dict('records'))
+    indice, fatti = ProductIndex.from_catalog(df_c), FactTable.build(df_s, df_c)
+    distanze = DistanceService(cache_path=None, session=StubRoutingSession())
+    items = ["LATTE", "PASTA", "TONNO", "CAFFE", "OLIO", "BISCOTTI", "MELE", "BIRRA"]
+
+    prezzi = PriceView.build(fatti)
+
+    def ricerca(query="LATTE", raggio_km=20):
+        # Come la scheda di ricerca: prezzo corrente per (prodotto, negozio) dalla vista, non lo storico
+        res = prezzi.righe(indice.search(query)).copy()
+        indirizzi = res['Indirizzo'].astype(str)
+        km = km_negozi(indirizzi, registro, *CASA, raggio_km=raggio_km, servizio=distanze)
+        for a in km:
+            if registro.coords_of(a) is None: km[a] = float('nan')
+        res['KM'] = indirizzi.map(km)
+        res = res[(res['KM'] <= raggio_km) | res['KM'].isna()]
+        if res.empty: return res
+        u = res['UNITA_RIF'].mode().iloc[0]
+        return res.assign(_ALTRA_UNITA=res['UNITA_RIF'] != u).sort_values(by=['_ALTRA_UNITA', 'PREZZO_AL_L_KG', 'KM'])
+
+    shops = fatti.df[['Negozio', 'Indirizzo']].drop_duplicates()
+    chiavi = [shop_key(n, i) for n, i in zip(shops['Negozio'], shops['Indirizzo'])]
+    pm = build_price_matrix(fatti, indice, items, chiavi)
+    km = distanze.distances(*CASA, [registro.coords_of(str(i)) or CASA for i in shops['Indirizzo']])
+    viaggio = [d if d is not None else 999 for d in km]
+
+    def salva(vuoto):
+        salva_scontrino(vuoto, df_c, revisione(df_c, seed=seed), "2026-01-01",
+                        "ESSELUNGA", "VIA ROMA 1, MILANO", "S999999")
+
+    def archivio_vuoto():
+        return archivio(backend, {"Scontrini": pd.DataFrame(columns=COLONNE_SCONTRINI),
+                                  "Catalogo": pd.DataFrame(columns=COLONNE_CATALOGO)})
+
+    def anagrafe_senza_coordinate():
+        return archivio(backend, {"Anagrafe_Negozi": negozi.assign(Latitudine="", Longitudine="")})
+
+    def geocodifica(anagrafe):
+        # Geocoder fittizio senza cache né limite di frequenza: si misura il giro completo di geocodifica_anagrafe
+        return geocodifica_anagrafe(anagrafe, GeocodingService(geocoder=StubGeocoder(), cache_path=None, rps=0))
+
+    legacy = genera_legacy(n_righe, seed=seed)
+
+    stato = os.path.join(tempfile.mkdtemp(), "clean_db_state.json")
+
+    def pulizia(foglio):
+        with contextlib.redirect_stdout(io.StringIO()): clean_db.run_cleanup(worksheet=foglio, stato_path=stato)
+
+    def foglio_legacy(storico=legacy):
+        return FakeSpreadsheet([FakeWorksheet.from_df("Foglio1", storico)]).get_worksheet(0)
+
+    def foglio_con_nuove_righe():
+        # Storico già ripulito (stato salvato) più l'1% di righe nuove, metà duplicate
+        foglio = foglio_legacy(legacy.iloc[:len(legacy) - max(2, len(legacy) // 100)])
+        pulizia(foglio)
+        nuove = legacy.iloc[len(legacy) - max(2, len(legacy) // 100):]
+        foglio.append_rows(nuove.values.tolist())
+        return foglio
+
+    casi = {
+        'caricamento_fogli': (lambda: (storage.df("Scontrini"), storage.df("Catalogo")), None),
+        'costruzione_indici': (lambda: (ProductIndex.from_catalog(df_c), FactTable.build(df_s, df_c)), None),
+        'vista_prezzi': (lambda: PriceView.build(fatti), None),
+        'ricerca_prodotto': (ricerca, None),
+        'matrice_prezzi': (lambda: build_price_matrix(fatti, indice, items, chiavi), None),
+        'ottimizzazione_multistop': (lambda: optimize(pm.prices, k=k, travel_km=viaggio, costo_km=costo_km), None),
+        'salvataggio_scontrino': (salva, archivio_vuoto),
+        'geocodifica_negozi': (geocodifica, anagrafe_senza_coordinate),
+        'clean_db_completo': (pulizia, lambda: (os.path.exists(stato) and os.remove(stato)) or foglio_legacy()),
+        'clean_db_incrementale': (pulizia, foglio_con_nuove_righe),
+    }
+    out = {}
+    for nome, (fn, setup) in casi.items():
+        out[nome] = misura(fn, setup, ripetizioni)
+    return out
+
+
+def memoria(n_righe, n_negozi, seed=0, backend="sheets"):
+    """MB occupati dalla storia prezzi: merge dei fogli come vengono caricati (prima) e FactTable compatta (dopo)."""
+    catalogo, scontrini, _ = genera(n_righe, n_negozi, seed)
+    storage = archivio(backend, {"Scontrini": scontrini, "Catalogo": catalogo})
+    df_s, df_c = storage.df("Scontrini"), storage.df("Catalogo")
+    mb = lambda b: round(b / 2 ** 20, 2)
+    prima = pd.merge(df_s, df_c, on='ID_PRODOTTO', how='inner').memory_usage(deep=True).sum()
+    fatti = FactTable.build(df_s, df_c)
+    return {'fogli_caricati_mb': mb(df_s.memory_usage(deep=True).sum() + df_c.memory_usage(deep=True).sum()),
+            'merge_prima_mb': mb(prima), 'fatti_compatti_mb': mb(fatti.memoria()),
+            'vista_prezzi_mb': mb(PriceView.build(fatti).memoria()), 'riduzione': round(prima / fatti.memoria(), 1)}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--righe", type=int, nargs="+", default=[1000, 10000])
+    ap.add_argument("--negozi", type=int, nargs="+", default=[50, 500])
+    ap.add_argument("--ripetizioni", type=int, default=3)
+    ap.add_argument("--tappe", type=int, default=4)
+    ap.add_argument("--backend", choices=["sheets", "sqlite"], default="sheets")
+    ap.add_argument("--json", help="scrive i risultati anche in questo file")
+    ap.add_argument("--memoria", action="store_true", help="solo il confronto di memoria prima/dopo la compattazione")
+    args = ap.parse_args(argv)
+
+    risultati = []
+    if args.memoria:
+        for n_righe in args.righe:
+            for n_negozi in args.negozi:
+                m = memoria(n_righe, n_negozi, backend=args.backend)
+                risultati.append({'backend': args.backend, 'righe': n_righe, 'negozi': n_negozi, **m})
+                print(f"{n_righe:>7} righe {n_negozi:>4} negozi  merge {m['merge_prima_mb']:8.1f} MB -> fatti "
+                      f"{m['fatti_compatti_mb']:7.1f} MB (x{m['riduzione']}), vista prezzi {m['vista_prezzi_mb']:6.1f} MB",
+                      flush=True)
+        if args.json:
+            with open(args.json, "w") as f: json.dump(risultati, f, indent=2)
+        return risultati
+
+    for n_righe in args.righe:
+        for n_negozi in args.negozi:
+            for caso, m in esegui(n_righe, n_negozi, args.ripetizioni, k=args.tappe, backend=args.backend).items():
+                riga = {'backend': args.backend, 'righe': n_righe, 'negozi': n_negozi, 'caso': caso, **m}
+                risultati.append(riga)
+                print(f"{n_righe:>7} righe {n_negozi:>4} negozi  {caso:<26} {m['secondi'] * 1000:9.1f} ms"
+                      f"  {m['picco_mb']:8.1f} MB", flush=True)
+    if args.json:
+        with open(args.json, "w") as f: json.dump(risultati, f, indent=2)
+    return risultati
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+
+
+class SheetCache:
+    """Cache di processo per i DataFrame dei fogli, condivisa da tutte le sessioni Streamlit."""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._entries = {}   # nome -> (valore, caricato_il)
+        self._versions = {}  # nome -> contatore, cresce ad ogni ricarica/invalidazione
+        self._derived = {}   # nome -> (valore, versione del foglio sorgente)
+
+    def _key_lock(self, nome):
+        with self._lock:
+            return self._key_locks.setdefault(nome, threading.Lock())
+
+    def _fresh(self, nome):
+        entry = self._entries.get(nome)
+        if entry and time.monotonic() - entry[1] < self.ttl: return entry
+        return None
+
+    def get(self, nome, loader):
+        with self._lock:
+            entry = self._fresh(nome)
+            if entry:
+                self.hits += 1
+                return entry[0]
+        # Un solo download per foglio anche con più sessioni in attesa
+        with self._key_lock(nome):
+            with self._lock:
+                entry = self._fresh(nome)
+                if entry:
+                    self.hits += 1
+                    return entry[0]
+                self.misses += 1
+            valore = loader()
+            with self._lock:
+                self._entries[nome] = (valore, time.monotonic())
+                self._versions[nome] = self._versions.get(nome, 0) + 1
+            return valore
+
+    def _valido(self, entry, fonti):
+        return (entry is not None and entry[1] == tuple(self._versions.get(f, 0) for f in fonti)
+                and all(self._fresh(f) for f in fonti))
+
+    def derived(self, nome, fonti, builder):
+        """Struttura derivata da uno o più fogli (indici, lookup): ricostruita solo quando un foglio cambia versione.
+
+        Il builder riceve il valore precedente (None la prima volta) per aggiornarlo in modo incrementale.
+        """
+        fonti = (fonti,) if isinstance(fonti, str) else tuple(fonti)
+        with self._lock:
+            entry = self._derived.get(nome)
+            if self._valido(entry, fonti): return entry[0]
+        with self._key_lock(nome):
+            with self._lock:
+                entry = self._derived.get(nome)
+                if self._valido(entry, fonti): return entry[0]
+            # Il builder ricarica i fogli scaduti: le versioni vanno lette dopo
+            valore = builder(entry[0] if entry else None)
+            with self._lock:
+                self._derived[nome] = (valore, tuple(self._versions.get(f, 0) for f in fonti))
+            return valore
+
+    def version(self, nome):
+        with self._lock:
+            return self._versions.get(nome, 0)
+
+    def invalidate(self, *nomi):
+        """Scarta subito i fogli indicati (tutti se non specificati), es. dopo un append."""
+        with self._lock:
+            for nome in (nomi or list(self._entries)):
+                if self._entries.pop(nome, None) is not None:
+                    self._versions[nome] = self._versions.get(nome, 0) + 1
+
+    def discard(self, *nomi):
+        """Scarta le strutture derivate indicate: alla prossima richiesta vengono ricostruite da zero."""
+        with self._lock:
+            for nome in nomi: self._derived.pop(nome, None)
+
+    def stats(self):
+        with self._lock:
+            tot = self.hits + self.misses
+            now = time.monotonic()
+            return {
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / tot, 3) if tot else 0.0,
+                "ttl": self.ttl,
+                "fogli": {n: round(now - e[1], 1) for n, e in self._entries.items()},
+            }
+
+
+# Istanza unica per processo: i moduli importati sopravvivono ai rerun di Streamlit
+sheet_cache = SheetCache(ttl=float(os.environ.get("CACHE_TTL", 300)))
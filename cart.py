@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+
+from geo import haversine_km
+from metrics import metriche
+from optimizer import optimize
+from stores import norm_indirizzo
+
+CAMPI_CARRELLO = ('NOME_NORMALIZZATO', 'CATEGORIA')
+COLONNE_CLASSIFICA = ['Negozio', 'Totale', 'Trovati', 'Missing', 'Distanza', 'Punteggio']
+
+
+def shop_key(negozio, indirizzo):
+    return f"{negozio} - {indirizzo}"
+
+
+class PriceMatrix:
+    """Matrice densa articoli × negozi del miglior prezzo (inf se l'articolo manca), con i nomi prodotto
+    e, per articolo, l'unità di riferimento (KG/L/PZ) su cui sono stati confrontati i prodotti."""
+
+    def __init__(self, items, shops, prices, names, units=None):
+        self.items = list(items)
+        self.shops = list(shops)
+        self.prices = prices
+        self.names = names
+        self.units = list(units) if units is not None else [""] * len(self.items)
+        self.item_index = {}
+        for i, item in enumerate(self.items): self.item_index.setdefault(item, i)
+        self.shop_index = {s: j for j, s in enumerate(self.shops)}
+
+    @property
+    def found(self):
+        return np.isfinite(self.prices)
+
+    def get(self, item, shop):
+        """(prezzo, nome prodotto) dell'articolo nel negozio, None se non disponibile."""
+        i, j = self.item_index[item], self.shop_index.get(shop)
+        if j is None or not np.isfinite(self.prices[i, j]): return None
+        return float(self.prices[i, j]), self.names[i, j]
+
+
+def build_price_matrix(fatti, indice, items, shops, campi=CAMPI_CARRELLO):
+    """Matrice prezzi in un solo passaggio: righe corrispondenti agli articoli, poi la più conveniente per (articolo, negozio).
+
+    fatti: FactTable (tutto lo storico) o PriceView (prezzi correnti); indice: ProductIndex;
+    shops: chiavi "Negozio - Indirizzo" ammesse.
+    """
+    n_i, n_s = len(items), len(shops)
+    prices = np.full((n_i, n_s), np.inf)
+    names = np.full((n_i, n_s), "", dtype=object)
+
+    # 1. Articolo -> posizioni nella fact table (una ricerca per articolo, nessuna scansione)
+    pos = [fatti.index.rows(indice.search(item, campi=campi)) for item in items]
+    it = np.repeat(np.arange(n_i), [len(p) for p in pos])
+    pos = np.concatenate(pos) if pos else np.array([], dtype=np.int64)
+    if not len(pos) or not n_s: return PriceMatrix(items, shops, prices, names)
+
+    # 2. Righe -> colonna del negozio tramite i codici precalcolati (-1 se fuori dai negozi ammessi)
+    col = pd.Index(shops).get_indexer(fatti.chiavi_negozio)
+    js = col[fatti.codici_negozio[pos]]
+    ok = js >= 0
+    it, js, pos = it[ok], js[ok], pos[ok]
+    if not len(pos): return PriceMatrix(items, shops, prices, names)
+
+    # 3. Una sola unità di riferimento per articolo, come nella ricerca: la più frequente tra le sue righe
+    #    (a parità la prima in ordine alfabetico). €/PZ, €/L e €/KG non si confrontano tra loro
+    codici, unita = pd.factorize(fatti.df['UNITA_RIF'].to_numpy(dtype=object)[pos], sort=True)
+    conteggi = np.bincount(it * len(unita) + codici, minlength=n_i * len(unita)).reshape(n_i, len(unita))
+    moda = conteggi.argmax(axis=1)
+    ok = codici == moda[it]
+    it, js, pos = it[ok], js[ok], pos[ok]
+    units = np.where(conteggi.max(axis=1) > 0, np.asarray(unita, dtype=object)[moda], "")
+
+    # 4. Per cella (articolo, negozio) vince la confezione più economica, in O(righe); a parità la prima riga.
+    #    Lo stesso prezzo sceglie la cella e confronta i negozi: è quello che si paga alla cassa
+    cella = it * n_s + js
+    pc = fatti.prezzi[pos]
+    migliori = np.full(n_i * n_s, np.inf)
+    np.minimum.at(migliori, cella, pc)
+    vincenti = np.flatnonzero(pc == migliori[cella])
+    celle, primo = np.unique(cella[vincenti], return_index=True)
+    scelte = pos[vincenti[primo]]
+    prices.reshape(-1)[celle] = migliori[celle]
+    names.reshape(-1)[celle] = fatti.df['NOME_NORMALIZZATO'].to_numpy(dtype=object)[scelte]
+    return PriceMatrix(items, shops, prices, names, units)
+
+
+def km_negozi(indirizzi, registro, lat, lon, raggio_km=None, servizio=None, linea_aria=None):
+    """{indirizzo: km} da (lat, lon), con una sola richiesta di routing per tutti i negozi.
+
+    999 per i negozi senza coordinate o (con raggio_km) oltre il raggio in linea d'aria, che non passano dal
+    routing. servizio: DistanceService, None per la distanza in linea d'aria. Dove il routing non risponde vale la
+    distanza in linea d'aria; linea_aria, se è un set, riceve gli indirizzi per cui è successo.
+    """
+    coords = {a: registro.coords_of(a) for a in set(indirizzi)}
+    validi = [a for a, c in coords.items() if c]
+    if raggio_km is not None:
+        vicini = registro.vicini(lat, lon, raggio_km)
+        validi = [a for a in validi if norm_indirizzo(a) in vicini]
+    aria = np.round(haversine_km(lat, lon, [coords[a][0] for a in validi], [coords[a][1] for a in validi]), 1).tolist()
+    if servizio is None: km = aria
+    else:
+        with metriche.fase("osrm.distanze"): km = servizio.distances(lat, lon, [coords[a] for a in validi])
+    out = {a: 999 for a in coords}
+    for a, d, d_aria in zip(validi, km, aria):
+        if d is None and linea_aria is not None: linea_aria.add(a)
+        out[a] = d if d is not None else d_aria
+    return out
+
+
+def _json(v):
+    v = v.item() if hasattr(v, 'item') else v
+    return round(v, 4) if isinstance(v, float) else v
+
+
+class CartResult:
+    """Esito di ottimizza_carrello: classifica dei negozi singoli e, con più tappe, il piano diviso tra negozi."""
+
+    def __init__(self, items, pm, distanze, classifica, plan=None):
+        self.items = items
+        self.pm = pm
+        self.distanze = distanze          # chiave negozio -> km (0 senza posizione)
+        self.classifica = classifica      # COLONNE_CLASSIFICA, per Missing e Punteggio crescenti
+        self.vincitore = classifica.iloc[0] if not classifica.empty else None
+        self.plan = plan
+        self.dettaglio = {}               # articolo -> (prezzo, negozio, nome prodotto) del piano multi-tappa
+        if plan is not None:
+            for i, item in enumerate(items):
+                j = plan.assignment[i]
+                if j >= 0: self.dettaglio[item] = (float(pm.prices[i, j]), pm.shops[j], pm.names[i, j])
+
+    def assegnazioni(self):
+        """articolo -> (prezzo, negozio, nome prodotto) o None: dal piano se c'è, altrimenti dal negozio vincitore."""
+        if self.plan is not None: return {item: self.dettaglio.get(item) for item in self.items}
+        if self.vincitore is None: return {item: None for item in self.items}
+        shop = self.vincitore['Negozio']
+        out = {}
+        for item in self.items:
+            hit = self.pm.get(item, shop)
+            out[item] = (hit[0], shop, hit[1]) if hit else None
+        return out
+
+    def record(self):
+        """Dizionario serializzabile in JSON: totale, negozi con i rispettivi articoli, mancanti e classifica."""
+        assegnate, negozi = self.assegnazioni(), {}
+        for item, hit in assegnate.items():
+            if hit is None: continue
+            p, shop, nome = hit
+            n = negozi.setdefault(shop, {'negozio': shop, 'distanza_km': float(self.distanze[shop]), 'subtotale': 0.0, 'articoli': []})
+            n['subtotale'] = round(n['subtotale'] + p, 2)
+            # I prezzi della vista sono float32: arrotondati per non esporre le cifre spurie della conversione
+            n['articoli'].append({'articolo': item, 'prezzo': round(p, 4), 'prodotto': str(nome)})
+        mancanti = [item for item, hit in assegnate.items() if hit is None]
+        return {
+            'totale': round(sum(n['subtotale'] for n in negozi.values()), 2),
+            'trovati': len(self.items) - len(mancanti), 'articoli': len(self.items), 'negozi_ammessi': len(self.pm.shops),
+            'ottimo': True if self.plan is None else bool(self.plan.ottimo),
+            'negozi': list(negozi.values()), 'mancanti': mancanti,
+            'classifica': [{k: _json(v) for k, v in r.items()} for r in self.classifica.head(5).to_dict('records')],
+        }
+
+
+def ottimizza_carrello(prezzi, indice, items, km=None, raggio_km=None, tappe=1, costo_km=0.0, time_budget=None):
+    """Il carrello ottimizzato della scheda 🛒 senza Streamlit.
+
+    prezzi: PriceView (o FactTable); indice: ProductIndex; km: {indirizzo: km} dalla posizione (km_negozi),
+    None senza posizione (tutti i negozi a 0 km); tappe: massimo di negozi, None = illimitate.
+    Con tappe=1 basta la classifica dei negozi singoli, altrimenti optimize sceglie i negozi.
+    """
+    shops = prezzi.df[['Negozio', 'Indirizzo']].drop_duplicates()
+    distanze, ammessi = {}, []
+    for negozio, indirizzo in zip(shops['Negozio'], shops['Indirizzo']):
+        k = shop_key(negozio, indirizzo)
+        distanze[k] = km.get(str(indirizzo), 999) if km is not None else 0
+        if raggio_km is None or distanze[k] <= raggio_km: ammessi.append(k)
+
+    with metriche.fase("carrello.matrice"): pm = build_price_matrix(prezzi, indice, items, ammessi)
+
+    # Negozio singolo: totali sulle colonne della matrice, un articolo mancante conta più del prezzo
+    trovati = pm.found.sum(axis=0)
+    totali = np.where(pm.found, pm.prices, 0).sum(axis=0)
+    classifica = pd.DataFrame([{
+        'Negozio': shop, 'Totale': float(totali[j]), 'Trovati': int(trovati[j]), 'Missing': len(items) - int(trovati[j]),
+        'Distanza': distanze[shop], 'Punteggio': float(totali[j]) + costo_km * distanze[shop]
+    } for j, shop in enumerate(pm.shops)], columns=COLONNE_CLASSIFICA)
+    classifica = classifica.sort_values(by=['Missing', 'Punteggio']).reset_index(drop=True)
+
+    plan = None
+    if tappe != 1 and pm.shops:
+        with metriche.fase("carrello.ottimizzazione"):
+            plan = optimize(pm.prices, k=tappe, travel_km=[distanze[sh] for sh in pm.shops], costo_km=costo_km,
+                            time_budget=time_budget)
+    return CartResult(items, pm, distanze, classifica, plan)
@@ -1,51 +1,145 @@
-import gspread
-import pandas as pd
-from google.oauth2.service_account import Credentials
 import os
 import json
+import bisect
+import hashlib
+import argparse
 
-def run_cleanup():
-    tr:
+from metrics import metriche
+
+# Colonne che identificano un duplicato (stessa Data, Negozio, Prodotto e Prezzo)
+COLONNE_DEDUP = ['Data', 'Supermercato', 'Indirizzo', 'Prodotto', 'Prezzo_Netto', 'Prezzo Un.']
+# Stato persistente: impronte delle righe già viste e ultima riga elaborata (cache della GitHub Action)
+CLEANUP_STATE = os.environ.get("CLEANUP_STATE", ".cache/clean_db_state.json")
+BLOCCO = 5000  # righe per lettura
+
+def apri_foglio():
+    import gspread
+    from google.oauth2.service_account import Credentials
+    # Recupero credenziali
+    info = json.loads(os.environ['GOOGLE_SHEETS_JSON'])
+    creds = Credentials.from_service_account_info(info, scopes=["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"])
+    gc = gspread.authorize(creds)
+
+    # Apertura foglio
+    sh = gc.open("Database_Prezzi")
+    return sh.get_worksheet(0)
+
+def _lettera(n):
+    """1 -> A, 27 -> AA"""
+    s = ""
+    while n: n, r = divmod(n - 1, 26); s = chr(65 + r) + s
+    return s
+
+def _impronta(valori):
+    return hashlib.blake2b("\x1f".join(v.strip() for v in valori).encode(), digest_size=8).hexdigest()
+
+def _leggi_righe(worksheet, da_riga, n_colonne, blocco=BLOCCO):
+    """Righe dalla riga `da_riga` (1-based) in poi, lette a blocchi: (numero riga, valori) con le celle finali completate."""
+    ultima_col = _lettera(n_colonne)
+    r = da_riga
+    while True:
+        with metriche.fase("sheets.lettura"):
+            valori = worksheet.get(f"A{r}:{ultima_col}{r + blocco - 1}")
+        metriche.conta("sheets.chiamate")
+        metriche.conta("righe_lette", len(valori))
+        for i, riga in enumerate(valori):
+            yield r + i, list(riga) + [""] * (n_colonne - len(riga))
+        if len(valori) < blocco: return
+        r += blocco
+
+def _carica_stato(percorso):
+    try:
+        with open(percorso) as f: return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _salva_stato(percorso, stato):
+    if os.path.dirname(percorso): os.makedirs(os.path.dirname(percorso), exist_ok=True)
+    tmp = percorso + ".tmp"
+    with open(tmp, "w") as f: json.dump(stato, f)
+    os.replace(tmp, percorso)
+
+def _elimina_righe(worksheet, righe):
+    """Cancella le righe indicate (1-based) con un'unica batch_update, dal fondo verso l'alto."""
+    intervalli = []
+    for r in sorted(righe, reverse=True):
+        if intervalli and intervalli[-1][0] == r + 1: intervalli[-1][0] = r
+        else: intervalli.append([r, r])
+    richieste = [{"deleteDimension": {"range": {"sheetId": worksheet.id, "dimension": "ROWS",
+                                                "startIndex": a - 1, "endIndex": b}}} for a, b in intervalli]
+    if richieste:
+        metriche.conta("sheets.chiamate")
+        with metriche.fase("sheets.eliminazione"): worksheet.spreadsheet.batch_update({"requests": richieste})
+
+def run_cleanup(worksheet=None, stato_path=CLEANUP_STATE, completo=False, blocco=BLOCCO):
+    """Rimuove le righe duplicate dal primo foglio tenendo l'ultima occorrenza. Restituisce quante righe ha rimosso.
+
+    Incrementale: legge solo le righe dopo l'ultima elaborata (watermark nello stato) e le confronta con le
+    impronte salvate; i duplicati vengono cancellati riga per riga, senza svuotare e riscrivere il foglio.
+    Se intestazioni o ultima riga nota non corrispondono più, o con completo=True, rilegge tutto il foglio.
+    worksheet: foglio già aperto (es. benchmark), altrimenti da GOOGLE_SHEETS_JSON.
+    """
+    try:
         print("Inizio procedura di pulizia...")
-        # Recupero credenziali
-        info = json.loads(os.environ['GOOGLE_SHEETS_JSON'])
-        creds = Credentials.from_service_account_info(info, scopes=["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"])
-        gc = gspread.authorize(creds)
-        
-        # Apertura foglio
-        sh = gc.open("Database_Prezzi")
-        worksheet = sh.get_worksheet(0)
-        
-        # Caricamento dati
-        data = worksheet.get_all_records()
-        if not data:
+        if worksheet is None: worksheet = apri_foglio()
+
+        # Intestazioni (nomi generici per trovare le colonne anche se hanno spazi)
+        with metriche.fase("sheets.intestazioni"): header = [str(c).strip() for c in worksheet.row_values(1)]
+        if not header:
             print("Database vuoto.")
-            return
-            
-        df = pd.DataFrame(data)
-        original_rows = len(df)
-        
-        # Pulizia: consideriamo duplicata una riga con stessa Data, Negozio, Prodotto e Prezzo
-        # Usiamo nomi generici per trovare le colonne anche se hanno spazi
-        df.columns = [c.strip() for c in df.columns]
-        subset_cols = [c for c in df.columns if c in ['Data', 'Supermercato', 'Indirizzo', 'Prodotto', 'Prezzo_Netto', 'Prezzo Un.']]
-        
-        df_pulito = df.drop_duplicates(subset=subset_cols, keep='last')
-        
-        if len(df_pulito) < original_rows:
-            # Svuota tutto
-            worksheet.clear()
-            # Prepara i dati per il caricamento (Intestazioni + Righe)
-            nuovi_dati = [df_pulito.columns.values.tolist()] + df_pulito.values.tolist()
-            # Scrittura (usando il metodo più compatibile)
-            worksheet.update('A1', nuovi_dati)
-            print(f"✅ Successo! Rimosse {original_rows - len(df_pulito)} righe duplicate.")
+            return 0
+        idx = [i for i, c in enumerate(header) if c in COLONNE_DEDUP] or list(range(len(header)))
+
+        stato = None if completo else _carica_stato(stato_path)
+        if stato and stato.get('header') != header: stato = None
+        impronte = stato['impronte'] if stato else {}  # impronta -> riga del foglio dell'ultima occorrenza
+        watermark = stato['righe'] if stato else 1     # ultima riga già elaborata (1 = intestazioni)
+
+        # Lettura a blocchi dalla riga del watermark: la prima riga letta serve a verificare che sia ancora quella
+        da_eliminare, ultima, n_lette = [], stato['ultima'] if stato else None, 0
+        verificata = watermark == 1
+        # scansione comprende le letture (sheets.lettura): la differenza è il tempo delle impronte
+        with metriche.fase("scansione"):
+            for r, riga in _leggi_righe(worksheet, max(watermark, 2), len(header), blocco):
+                if r == watermark:
+                    verificata = _impronta(riga) == ultima
+                    if not verificata: break
+                    continue
+                n_lette += 1
+                ultima, watermark = _impronta(riga), r
+                if not any(riga): continue
+                k = _impronta([riga[i] for i in idx])
+                if k in impronte: da_eliminare.append(impronte[k])
+                impronte[k] = r
+        if not verificata:
+            print("Foglio modificato dall'ultima esecuzione: ricostruzione completa.")
+            return run_cleanup(worksheet, stato_path, completo=True, blocco=blocco)
+
+        if da_eliminare:
+            _elimina_righe(worksheet, da_eliminare)
+            # Le righe sotto quelle cancellate risalgono
+            da_eliminare.sort()
+            impronte = {k: r - bisect.bisect_left(da_eliminare, r) for k, r in impronte.items()}
+            watermark -= len(da_eliminare)
+            print(f"✅ Successo! Rimosse {len(da_eliminare)} righe duplicate ({n_lette} righe nuove esaminate).")
         else:
-            print("✨ Nessun duplicato trovato.")
-            
+            print(f"✨ Nessun duplicato trovato ({n_lette} righe nuove esaminate).")
+
+        with metriche.fase("stato.salvataggio"):
+            _salva_stato(stato_path, {'header': header, 'righe': watermark, 'ultima': ultima, 'impronte': impronte})
+        metriche.conta("righe_rimosse", len(da_eliminare))
+        return len(da_eliminare)
+
     except Exception as e:
         print(f"❌ Errore: {e}")
         raise e
 
 if __name__ == "__main__":
-    run_cleanup(
+    ap = argparse.ArgumentParser(description="Rimozione dei duplicati dal foglio Database_Prezzi")
+    ap.add_argument("--completo", action="store_true", help="ignora lo stato salvato e rilegge tutto il foglio")
+    ap.add_argument("--stato", default=CLEANUP_STATE)
+    ap.add_argument("--metriche", action="store_true", help="accoda tempi e chiamate a METRICS_FILE (come METRICS=1)")
+    args = ap.parse_args()
+    metriche.inizia("clean_db", attiva=args.metriche, completo=args.completo)
+    try: run_cleanup(stato_path=args.stato, completo=args.completo)
+    finally: metriche.chiudi()
@@ -0,0 +1,74 @@
+import threading
+
+from metrics import metriche
+
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+
+
+def _conta_byte(risposta, *args, **kwargs):
+    metriche.conta("sheets.byte", len(risposta.content or b''))
+
+
+def _is_auth_error(e):
+    """Errori transitori di autenticazione/trasporto per cui ha senso riconnettersi."""
+    status = getattr(getattr(e, 'response', None), 'status_code', None)
+    if status in (401, 500, 502, 503): return True
+    return type(e).__name__ in ('RefreshError', 'TransportError', 'ConnectionError', 'ChunkedEncodingError')
+
+
+class ClientManager:
+    """Connessioni a Google Sheets e Gemini create una sola volta per processo e solo quando servono."""
+
+    def __init__(self, service_info, api_key=None, nome_db="Database_Prezzi", nome_modello='models/gemini-2.5-flash'):
+        self.service_info = dict(service_info)
+        self.api_key = api_key
+        self.nome_db = nome_db
+        self.nome_modello = nome_modello
+        self._lock = threading.RLock()
+        self._sh = None
+        self._worksheets = {}
+        self._model = None
+
+    @property
+    def spreadsheet(self):
+        with self._lock:
+            if self._sh is None:
+                import gspread
+                from google.oauth2.service_account import Credentials
+                creds = Credentials.from_service_account_info(self.service_info, scopes=SCOPES)
+                gc = gspread.authorize(creds)
+                # Byte ricevuti da Sheets per il pannello metriche (sessione requests di gspread 5 e 6)
+                sessione = getattr(getattr(gc, 'http_client', None), 'session', None) or getattr(gc, 'session', None)
+                if sessione is not None: sessione.hooks.setdefault('response', []).append(_conta_byte)
+                self._sh = gc.open(self.nome_db)
+            return self._sh
+
+    def worksheet(self, nome):
+        with self._lock:
+            if nome not in self._worksheets:
+                self._worksheets[nome] = self.spreadsheet.worksheet(nome)
+            return self._worksheets[nome]
+
+    def call(self, nome, fn, tentativi=2):
+        """Esegue fn(worksheet); se la sessione Google è scaduta si riconnette e riprova."""
+        for i in range(tentativi):
+            metriche.conta("sheets.chiamate")
+            try:
+                return fn(self.worksheet(nome))
+            except Exception as e:
+                if i == tentativi - 1 or not _is_auth_error(e): raise
+                self.reset()
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                import google.generativeai as genai
+                genai.configure(api_key=self.api_key)
+                self._model = genai.GenerativeModel(self.nome_modello)
+            return self._model
+
+    def reset(self):
+        with self._lock:
+            self._sh = None
+            self._worksheets = {}
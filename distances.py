@@ -0,0 +1,94 @@
+import os
+import sqlite3
+import threading
+
+import requests
+
+from metrics import metriche
+
+OSRM_URL = os.environ.get("OSRM_URL", "https://router.project-osrm.org")
+DISTANCE_CACHE = os.environ.get("DISTANCE_CACHE", ".cache/distanze.sqlite")
+
+
+class DistanceService:
+    """Distanze stradali OSRM risolte in blocco (servizio 'table') con cache persistente su disco.
+
+    Le coordinate vengono arrotondate a `precisione` decimali (3 ≈ 100 m) sia per
+    deduplicare le richieste sia come chiave della cache.
+    """
+
+    def __init__(self, base_url=None, cache_path=DISTANCE_CACHE, precisione=3,
+                 timeout=5, max_coords=100, session=None):
+        self.base_url = (base_url or OSRM_URL).rstrip('/')
+        self.precisione = precisione
+        self.timeout = timeout
+        self.max_coords = max_coords
+        self.session = session or requests.Session()
+        self.richieste = 0
+        self._lock = threading.Lock()
+        self._mem = {}
+        self._db = None
+        if cache_path:
+            if os.path.dirname(cache_path): os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            self._db = sqlite3.connect(cache_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS distanze (chiave TEXT PRIMARY KEY, km REAL)")
+            self._db.commit()
+
+    def _punto(self, lat, lon):
+        return (round(float(lat), self.precisione), round(float(lon), self.precisione))
+
+    def _chiave(self, o, d):
+        return f"{o[0]},{o[1]};{d[0]},{d[1]}"
+
+    def _leggi_cache(self, chiavi):
+        trovate = {k: self._mem[k] for k in chiavi if k in self._mem}
+        mancanti = [k for k in chiavi if k not in trovate]
+        if self._db is not None and mancanti:
+            with self._lock:
+                for i in range(0, len(mancanti), 500):
+                    blocco = mancanti[i:i + 500]
+                    q = f"SELECT chiave, km FROM distanze WHERE chiave IN ({','.join('?' * len(blocco))})"
+                    for k, km in self._db.execute(q, blocco): trovate[k] = km
+            self._mem.update(trovate)
+        return trovate
+
+    def _scrivi_cache(self, valori):
+        self._mem.update(valori)
+        if self._db is not None and valori:
+            with self._lock:
+                self._db.executemany("INSERT OR REPLACE INTO distanze VALUES (?, ?)", valori.items())
+                self._db.commit()
+
+    def _table(self, origine, destinazioni):
+        """Una richiesta OSRM 'table' dall'origine verso più destinazioni (km, None se non raggiungibile)."""
+        coords = ";".join(f"{lon},{lat}" for lat, lon in [origine] + destinazioni)
+        url = f"{self.base_url}/table/v1/driving/{coords}"
+        self.richieste += 1
+        metriche.conta("osrm.richieste")
+        r = self.session.get(url, params={"sources": 0, "annotations": "distance"}, timeout=self.timeout)
+        metriche.conta("osrm.byte", len(getattr(r, 'content', b'') or b''))
+        data = r.json()
+        if data.get('code') != 'Ok': return [None] * len(destinazioni)
+        riga = data['distances'][0][1:]
+        return [round(m / 1000, 1) if m is not None else None for m in riga]
+
+    def distances(self, lat, lon, destinazioni):
+        """Distanze in km da (lat, lon) verso una lista di (lat, lon); None dove il calcolo fallisce."""
+        o = self._punto(lat, lon)
+        punti = [self._punto(*d) for d in destinazioni]
+        chiavi = {p: self._chiave(o, p) for p in set(punti)}
+        noti = self._leggi_cache(list(chiavi.values()))
+
+        da_calcolare = [p for p, k in chiavi.items() if k not in noti]
+        passo = self.max_coords - 1
+        for i in range(0, len(da_calcolare), passo):
+            blocco = da_calcolare[i:i + passo]
+            try: km = self._table(o, blocco)
+            except Exception: continue
+            nuovi = {chiavi[p]: v for p, v in zip(blocco, km) if v is not None}
+            self._scrivi_cache(nuovi)
+            noti.update(nuovi)
+        return [noti.get(chiavi[p]) for p in punti]
+
+    def distance(self, lat1, lon1, lat2, lon2):
+        return self.distances(lat1, lon1, [(lat2, lon2)])[0]
@@ -0,0 +1,141 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from search_index import RowIndex
+from units import COLONNE_UNITA, prezzi_float, quantita_colonne
+
+# Prezzi, quantità e formati in float32: 7 cifre significative bastano per importi e pesi, con metà della memoria
+COLONNE_FLOAT32 = ('Prezzo_Unitario', 'PREZZO_AL_L_KG', 'FORMATO', 'Totale_Riga', 'Sconto', 'Quantita', 'Prezzo_Per_Unita')
+
+
+def _float32(serie):
+    if pd.api.types.is_numeric_dtype(serie): return serie.astype(np.float32)
+    return pd.to_numeric(serie.astype(str).str.replace(',', '.', regex=False), errors='coerce').astype(np.float32)
+
+
+def compatta(df):
+    """Rappresentazione compatta per la cache condivisa (in place): ogni testo ripetuto diventa category (codici interi
+    più un dizionario), prezzi e formati float32; le date sono già datetime64 in DATA_DT."""
+    for c in df.columns:
+        serie = df[c]
+        if isinstance(serie.dtype, pd.CategoricalDtype) or pd.api.types.is_datetime64_any_dtype(serie): continue
+        if c in COLONNE_FLOAT32: df[c] = _float32(serie)
+        elif not pd.api.types.is_numeric_dtype(serie): df[c] = serie.astype(str).astype('category')
+    return df
+
+
+def _concat_compatto(a, b):
+    """concat che conserva le colonne category: le categorie nuove vanno in coda, i codici già assegnati non cambiano."""
+    a, b = a.copy(deep=False), b.copy(deep=False)
+    categoria = lambda s: isinstance(s.dtype, pd.CategoricalDtype)
+    for c in a.columns:
+        if c not in b.columns or categoria(a[c]) == categoria(b[c]): continue
+        # Una parte category e l'altra numerica (es. Num_Scontrino tutto intero in un blocco): il lato numerico
+        # diventa testo come in compatta, altrimenti concat ricadrebbe su object
+        if categoria(a[c]) and pd.api.types.is_numeric_dtype(b[c]): b[c] = b[c].astype(str).astype('category')
+        elif pd.api.types.is_numeric_dtype(a[c]): a[c] = a[c].astype(str).astype('category')
+    for c in a.columns:
+        if c in b.columns and categoria(a[c]) and categoria(b[c]):
+            nuove = b[c].cat.categories.difference(a[c].cat.categories, sort=False)
+            if len(nuove): a[c] = a[c].cat.add_categories(nuove)
+            b[c] = b[c].cat.set_categories(a[c].cat.categories)
+    return pd.concat([a, b], ignore_index=True)
+
+
+def _hash_ids(serie):
+    return pd.util.hash_pandas_object(serie.astype(str), index=False).to_numpy()
+
+
+def _tipizza(df):
+    df['Prezzo_Unitario'] = prezzi_float(df['Prezzo_Unitario'])
+    # Prezzo per KG/L/PZ salvato con lo scontrino; per le righe non ancora completate da `units.py backfill`
+    # si converte qui formato e unità del catalogo, come al salvataggio
+    prodotto = df.reindex(columns=['FORMATO', 'UNITA', 'NOME_NORMALIZZATO']).fillna("")
+    q, u = quantita_colonne(prodotto['FORMATO'], prodotto['UNITA'], prodotto['NOME_NORMALIZZATO'])
+    salvato = df.reindex(columns=COLONNE_UNITA)
+    p_rif = pd.to_numeric(salvato[COLONNE_UNITA[0]].astype(str).str.replace(',', '.', regex=False), errors='coerce')
+    u_rif = salvato[COLONNE_UNITA[1]].fillna("").astype(str).str.strip()
+    ok = p_rif.notna().to_numpy() & (u_rif != "").to_numpy()
+    df['PREZZO_AL_L_KG'] = np.where(ok, p_rif.to_numpy(dtype=float), df['Prezzo_Unitario'].to_numpy() / q)
+    df['UNITA_RIF'] = np.where(ok, u_rif.to_numpy(dtype=object), u)
+    df['FORMATO'] = pd.to_numeric(df['FORMATO'], errors='coerce').fillna(1)
+    df['DATA_DT'] = pd.to_datetime(df['Data'].astype(str), errors='coerce')
+    df['CHIAVE_NEGOZIO'] = df['Negozio'].astype(str) + " - " + df['Indirizzo'].astype(str)
+    return compatta(df)
+
+
+class FactTable:
+    """Scontrini ⋈ Catalogo materializzato, con colonne tipizzate, esteso solo con le nuove righe di scontrino.
+
+    `df` è condiviso tra le sessioni: va letto, mai modificato in place. Le colonne sono compatte (vedi compatta):
+    ID_PRODOTTO e CHIAVE_NEGOZIO sono category, i loro codici interi restano stabili mentre la tabella cresce.
+    """
+
+    def __init__(self):
+        self.df = pd.DataFrame()
+        self.n_scontrini = 0           # righe di Scontrini già incorporate
+        self._hash_scontrini = np.array([], dtype=np.uint64)  # ID_PRODOTTO delle righe incorporate, per sync
+        self._hash_catalogo = None
+        self._orfani = set()           # ID_PRODOTTO di righe incorporate senza prodotto nel catalogo di allora
+        self.index = RowIndex()        # ID_PRODOTTO -> posizioni in df
+        self.codici_negozio = np.array([], dtype=np.int32)  # per riga: codice di CHIAVE_NEGOZIO
+        self.chiavi_negozio = []                            # codice -> "Negozio - Indirizzo"
+        self.prezzi = np.array([])                          # per riga: Prezzo_Unitario come array
+        self.prezzi_unita = np.array([])                    # per riga: prezzo per KG/L/PZ
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.df)
+
+    @classmethod
+    def build(cls, df_s, df_c):
+        ft = cls()
+        ft._estendi(df_s, df_c)
+        return ft
+
+    def _estendi(self, df_s, df_c):
+        nuove = df_s.iloc[self.n_scontrini:]
+        righe = _tipizza(pd.merge(nuove, df_c, on='ID_PRODOTTO', how='inner'))
+        with self._lock:
+            if self.df.empty: df = righe.reset_index(drop=True)
+            else: df = _concat_compatto(self.df, righe)
+            self.index.add(righe['ID_PRODOTTO'])
+            self.df = df
+            self.codici_negozio = df['CHIAVE_NEGOZIO'].cat.codes.to_numpy()
+            self.chiavi_negozio = df['CHIAVE_NEGOZIO'].cat.categories.tolist()
+            self.prezzi = df['Prezzo_Unitario'].to_numpy(dtype=float)
+            self.prezzi_unita = df['PREZZO_AL_L_KG'].to_numpy(dtype=float)
+            self.n_scontrini = len(df_s)
+            self._hash_scontrini = np.concatenate([self._hash_scontrini, _hash_ids(nuove['ID_PRODOTTO'])])
+            self._hash_catalogo = pd.util.hash_pandas_object(df_c, index=False).values
+            ids = nuove['ID_PRODOTTO']
+            self._orfani.update(ids[~ids.isin(df_c['ID_PRODOTTO'])].tolist())
+
+    def sync(self, df_s, df_c):
+        """Allinea al contenuto dei fogli: aggiunge le righe di scontrino in coda, ricostruisce se è cambiato altro.
+
+        Scontrini e Catalogo si ricaricano separatamente: se arrivano nel catalogo prodotti citati da righe già
+        incorporate senza corrispondenza (i fogli erano di momenti diversi) si ricostruisce, così quelle righe entrano.
+        """
+        n, h = self.n_scontrini, self._hash_catalogo
+        hash_c = pd.util.hash_pandas_object(df_c, index=False).values
+        catalogo_ok = h is not None and len(hash_c) >= len(h) and (hash_c[:len(h)] == h).all()
+        if catalogo_ok and self._orfani and len(hash_c) > len(h):
+            catalogo_ok = not df_c['ID_PRODOTTO'].iloc[len(h):].isin(self._orfani).any()
+        scontrini_ok = len(df_s) >= n and np.array_equal(_hash_ids(df_s['ID_PRODOTTO'].iloc[:n]), self._hash_scontrini)
+        if not (catalogo_ok and scontrini_ok): return FactTable.build(df_s, df_c)
+        if len(df_s) > n or len(hash_c) > len(h): self._estendi(df_s, df_c)
+        return self
+
+    def memoria(self):
+        """Byte occupati da df e dagli array di supporto (indice per ID escluso)."""
+        with self._lock:
+            return int(self.df.memory_usage(deep=True).sum() + self.codici_negozio.nbytes + self.prezzi.nbytes
+                       + self.prezzi_unita.nbytes + self._hash_scontrini.nbytes)
+
+    def righe(self, ids):
+        """Righe della fact table per un insieme di ID_PRODOTTO, nell'ordine originale."""
+        with self._lock:
+            return self.df.iloc[self.index.rows(ids)]
@@ -0,0 +1,170 @@
+import re
+import zlib
+import threading
+from collections import Counter
+
+from geo import haversine_km
+
+
+def _a1(cella):
+    """'B3' -> (riga 0-based, colonna 0-based)."""
+    m = re.match(r'([A-Z]+)(\d+)', cella.upper())
+    col = 0
+    for ch in m.group(1): col = col * 26 + ord(ch) - 64
+    return int(m.group(2)) - 1, col - 1
+
+
+class FakeWorksheet:
+    """Foglio gspread in memoria: stessi metodi usati dall'app e da clean_db, con il conteggio delle chiamate."""
+
+    def __init__(self, title, righe=None):
+        self.title = title
+        self.id = zlib.crc32(title.encode())
+        self.spreadsheet = None  # impostato da FakeSpreadsheet
+        self.rows = [list(r) for r in (righe or [])]  # riga 0 = intestazioni
+        self.chiamate = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_df(cls, title, df):
+        return cls(title, [df.columns.tolist()] + df.values.tolist())
+
+    def get_all_values(self):
+        self.chiamate['get_all_values'] += 1
+        with self._lock:
+            return [["" if v is None else str(v) for v in r] for r in self.rows]
+
+    def get_all_records(self):
+        self.chiamate['get_all_records'] += 1
+        with self._lock:
+            if not self.rows: return []
+            head = self.rows[0]
+            return [{h: (r[i] if i < len(r) else "") for i, h in enumerate(head)} for r in self.rows[1:]]
+
+    def get(self, intervallo):
+        """Valori di un intervallo 'A2:F100' come testo, senza le righe vuote finali (come gspread)."""
+        self.chiamate['get'] += 1
+        a, b = intervallo.split(':')
+        (r0, c0), (r1, c1) = _a1(a), _a1(b)
+        with self._lock:
+            out = [["" if v is None else str(v) for v in r[c0:c1 + 1]] for r in self.rows[r0:r1 + 1]]
+        while out and not any(out[-1]): out.pop()
+        return out
+
+    def delete_rows(self, start, end=None):
+        with self._lock: del self.rows[start - 1:(end or start)]
+
+    def row_values(self, n):
+        self.chiamate['row_values'] += 1
+        with self._lock:
+            return list(self.rows[n - 1]) if n <= len(self.rows) else []
+
+    def append_row(self, values, value_input_option=None):
+        self.chiamate['append_row'] += 1
+        with self._lock: self.rows.append(list(values))
+
+    def append_rows(self, values, value_input_option=None):
+        self.chiamate['append_rows'] += 1
+        with self._lock: self.rows.extend(list(r) for r in values)
+
+    def clear(self):
+        self.chiamate['clear'] += 1
+        with self._lock: self.rows = []
+
+    def update(self, a=None, b=None, range_name=None, values=None, **kwargs):
+        """Accetta update('A1', valori) (gspread < 6), update(valori, 'A1') e update(range_name=..., values=...)."""
+        self.chiamate['update'] += 1
+        if values is not None: cella, valori = range_name or 'A1', values
+        else: cella, valori = (a, b) if isinstance(a, str) else (b or 'A1', a)
+        r0, c0 = _a1(cella.split(':')[0])
+        with self._lock:
+            for i, riga in enumerate(valori):
+                while len(self.rows) <= r0 + i: self.rows.append([])
+                dest = self.rows[r0 + i]
+                if len(dest) < c0 + len(riga): dest.extend([""] * (c0 + len(riga) - len(dest)))
+                dest[c0:c0 + len(riga)] = list(riga)
+
+
+class FakeSpreadsheet:
+    def __init__(self, fogli=()):
+        self._fogli = {}
+        self.chiamate = Counter()
+        for ws in fogli: self.add(ws)
+
+    def add(self, ws):
+        ws.spreadsheet = self
+        self._fogli[ws.title] = ws
+        return ws
+
+    def batch_update(self, body):
+        """Solo le richieste deleteDimension sulle righe, applicate in ordine come fa l'API."""
+        self.chiamate['batch_update'] += 1
+        per_id = {ws.id: ws for ws in self._fogli.values()}
+        for req in body.get('requests', []):
+            r = req['deleteDimension']['range']
+            per_id[r['sheetId']].delete_rows(r['startIndex'] + 1, r['endIndex'])
+        return {}
+
+    def worksheet(self, nome):
+        return self._fogli[nome]
+
+    def get_worksheet(self, i):
+        return list(self._fogli.values())[i]
+
+
+class FakeClients:
+    """Sostituto di ClientManager per benchmark e prove: stessi metodi worksheet() e call()."""
+
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def worksheet(self, nome):
+        return self.spreadsheet.worksheet(nome)
+
+    def call(self, nome, fn, tentativi=2):
+        return fn(self.worksheet(nome))
+
+    def reset(self):
+        pass
+
+
+class _Risposta:
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class StubRoutingSession:
+    """Al posto di requests.Session per DistanceService: risponde come OSRM 'table' con km in linea d'aria × fattore."""
+
+    def __init__(self, fattore=1.3):
+        self.fattore = fattore
+        self.richieste = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.richieste += 1
+        punti = [tuple(map(float, p.split(','))) for p in url.rsplit('/', 1)[1].split(';')]
+        (lon0, lat0), dest = punti[0], punti[1:]
+        km = haversine_km(lat0, lon0, [p[1] for p in dest], [p[0] for p in dest]) * self.fattore
+        return _Risposta({'code': 'Ok', 'distances': [[0.0] + (km * 1000).tolist()]})
+
+
+class _Luogo:
+    def __init__(self, lat, lon):
+        self.latitude, self.longitude = lat, lon
+
+
+class StubGeocoder:
+    """Geocoder fittizio con l'interfaccia di geopy: coordinate deterministiche ricavate dall'indirizzo."""
+
+    def __init__(self, lat=45.46, lon=9.19, span=0.5):
+        self.lat, self.lon, self.span = lat, lon, span
+        self.richieste = 0
+
+    def geocode(self, indirizzo):
+        self.richieste += 1
+        h = zlib.crc32(str(indirizzo).upper().encode())
+        return _Luogo(self.lat + ((h & 0xFFFF) / 0xFFFF - 0.5) * self.span,
+                      self.lon + ((h >> 16) / 0xFFFF - 0.5) * self.span)
@@ -0,0 +1,55 @@
+import math
+
+import numpy as np
+
+R_TERRA_KM = 6371.0088
+KM_PER_GRADO = 111.195
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Distanza in linea d'aria (km) da un punto verso array di punti: limite inferiore della distanza stradale."""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lons, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * R_TERRA_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class StoreIndex:
+    """Indice spaziale a griglia sui negozi per le ricerche "entro R km da (lat, lon)"."""
+
+    def __init__(self, lats, lons, keys, cella_km=5.0):
+        lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+        ok = ~(np.isnan(lats) | np.isnan(lons))
+        self.lats, self.lons = lats[ok], lons[ok]
+        self.keys = np.asarray(keys, dtype=object)[ok]
+        lat_medio = float(self.lats.mean()) if len(self.lats) else 0.0
+        self.dlat = cella_km / KM_PER_GRADO
+        self.dlon = self.dlat / max(math.cos(math.radians(lat_medio)), 0.01)
+        self._celle = {}
+        ci = np.floor(self.lats / self.dlat).astype(int)
+        cj = np.floor(self.lons / self.dlon).astype(int)
+        for pos, cella in enumerate(zip(ci.tolist(), cj.tolist())):
+            self._celle.setdefault(cella, []).append(pos)
+        self._celle = {c: np.array(v) for c, v in self._celle.items()}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def within(self, lat, lon, r_km):
+        """Chiavi e distanze in linea d'aria dei negozi entro r_km, ordinati per distanza."""
+        if not len(self.keys): return [], np.array([])
+        dlat = r_km / KM_PER_GRADO
+        dlon = dlat / max(math.cos(math.radians(min(abs(lat) + dlat, 89.9))), 0.01)
+        i0, i1 = math.floor((lat - dlat) / self.dlat), math.floor((lat + dlat) / self.dlat)
+        j0, j1 = math.floor((lon - dlon) / self.dlon), math.floor((lon + dlon) / self.dlon)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self._celle):
+            # Raggio ampio rispetto ai negozi: conviene il calcolo vettoriale su tutti
+            cand = np.arange(len(self.keys))
+        else:
+            blocchi = [self._celle[(i, j)] for i in range(i0, i1 + 1) for j in range(j0, j1 + 1) if (i, j) in self._celle]
+            cand = np.concatenate(blocchi) if blocchi else np.array([], dtype=int)
+        km = haversine_km(lat, lon, self.lats[cand], self.lons[cand])
+        dentro = km <= r_km
+        cand, km = cand[dentro], km[dentro]
+        ordine = np.argsort(km)
+        return self.keys[cand[ordine]].tolist(), km[ordine]
@@ -0,0 +1,128 @@
+"""Geocodifica degli indirizzi con cache persistente e un solo client Nominatim per processo, a frequenza limitata.
+
+    python geocoding.py anagrafe   # coordinate mancanti in Anagrafe_Negozi, scritte in blocco (usa GOOGLE_SHEETS_JSON)
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from urllib.parse import urlsplit
+
+from metrics import metriche
+from rate_limit import TokenBucket
+from storage import STORAGE_BACKEND, STORAGE_PATH, SheetsStorage, SQLiteStorage
+from stores import norm_indirizzo
+
+GEOCODER_URL = os.environ.get("GEOCODER_URL", "https://nominatim.openstreetmap.org")
+GEOCODER_RPS = float(os.environ.get("GEOCODER_RPS", 1))  # policy di Nominatim: al massimo una richiesta al secondo
+GEOCODE_CACHE = os.environ.get("GEOCODE_CACHE", ".cache/geocodifica.sqlite")
+USER_AGENT = "comparatore_spesa_v32_final"
+
+
+class GeocodingService:
+    """Indirizzo -> (lat, lon) con cache su disco per indirizzo normalizzato (norm_indirizzo).
+
+    Anche gli indirizzi non trovati restano in cache, così non vengono richiesti di nuovo; gli errori di rete no.
+    geocoder: oggetto con geocode(indirizzo) come quelli di geopy (es. StubGeocoder), altrimenti Nominatim su `url`.
+    """
+
+    def __init__(self, geocoder=None, url=None, cache_path=GEOCODE_CACHE, rps=GEOCODER_RPS, timeout=10):
+        self.url = url or GEOCODER_URL
+        self.timeout = timeout
+        self.richieste = 0
+        self._geocoder = geocoder
+        self._bucket = TokenBucket(rps) if rps else None
+        self._lock = threading.Lock()
+        self._mem = {}
+        self._db = None
+        if cache_path:
+            if os.path.dirname(cache_path): os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            self._db = sqlite3.connect(cache_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS geocodifica (chiave TEXT PRIMARY KEY, lat REAL, lon REAL)")
+            self._db.commit()
+
+    @property
+    def geocoder(self):
+        with self._lock:
+            if self._geocoder is None:
+                from geopy.geocoders import Nominatim
+                u = urlsplit(self.url)
+                self._geocoder = Nominatim(user_agent=USER_AGENT, domain=u.netloc + u.path.rstrip('/'),
+                                           scheme=u.scheme or "https", timeout=self.timeout)
+            return self._geocoder
+
+    def _in_cache(self, chiave):
+        if chiave in self._mem: return True, self._mem[chiave]
+        if self._db is None: return False, None
+        with self._lock:
+            riga = self._db.execute("SELECT lat, lon FROM geocodifica WHERE chiave = ?", (chiave,)).fetchone()
+        if riga is None: return False, None
+        self._mem[chiave] = valore = (riga[0], riga[1]) if riga[0] is not None else None
+        return True, valore
+
+    def _memorizza(self, chiave, valore):
+        self._mem[chiave] = valore
+        if self._db is not None:
+            with self._lock:
+                self._db.execute("INSERT OR REPLACE INTO geocodifica VALUES (?, ?, ?)",
+                                 (chiave, *(valore if valore else (None, None))))
+                self._db.commit()
+
+    def geocode(self, indirizzo):
+        """(lat, lon) dell'indirizzo, None se non trovato o se il servizio non risponde."""
+        chiave = norm_indirizzo(indirizzo)
+        if not chiave: return None
+        trovato, valore = self._in_cache(chiave)
+        if trovato: return valore
+        if self._bucket: self._bucket.acquire()
+        self.richieste += 1
+        metriche.conta("geocoding.richieste")
+        try:
+            with metriche.fase("geocoding"): luogo = self.geocoder.geocode(str(indirizzo))
+        except Exception:
+            return None
+        valore = (float(luogo.latitude), float(luogo.longitude)) if luogo else None
+        self._memorizza(chiave, valore)
+        return valore
+
+
+def geocodifica_anagrafe(storage, servizio, colonna="Indirizzo_Standard (Pulito)"):
+    """Completa Latitudine e Longitudine dei negozi che non le hanno, con un'unica scrittura sull'anagrafe.
+
+    Restituisce (negozi completati, negozi ancora senza coordinate).
+    """
+    df = storage.df("Anagrafe_Negozi")
+    if df.empty: return 0, 0
+    coords = df.reindex(columns=["Latitudine", "Longitudine"]).astype(object).where(lambda d: d.notna(), "")
+    valori, completati, mancanti = [], 0, 0
+    for indirizzo, (lat, lon) in zip(df[colonna].astype(str), coords.values.tolist()):
+        if str(lat).strip() and str(lon).strip():
+            valori.append([lat, lon])
+            continue
+        trovato = servizio.geocode(indirizzo)
+        if trovato:
+            valori.append(list(trovato))
+            completati += 1
+        else:
+            valori.append([lat, lon])
+            mancanti += 1
+    if completati: storage.scrivi_colonne("Anagrafe_Negozi", ["Latitudine", "Longitudine"], valori)
+    return completati, mancanti
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Coordinate mancanti dei negozi in Anagrafe_Negozi")
+    ap.add_argument("comando", choices=["anagrafe"])
+    ap.add_argument("--db", default=STORAGE_PATH, help="database SQLite (con STORAGE_BACKEND=sqlite)")
+    args = ap.parse_args(argv)
+    if STORAGE_BACKEND == "sqlite": storage = SQLiteStorage(args.db)
+    else:
+        from clients import ClientManager
+        storage = SheetsStorage(ClientManager(json.loads(os.environ['GOOGLE_SHEETS_JSON'])))
+    completati, mancanti = geocodifica_anagrafe(storage, GeocodingService())
+    print(f"Anagrafe_Negozi: {completati} negozi geocodificati, {mancanti} ancora senza coordinate")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import metriche
+from rate_limit import TokenBucket
+
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 4))
+INGEST_RPM = float(os.environ.get("INGEST_RPM", 10))  # richieste al minuto verso Gemini
+# Da incrementare a ogni modifica del prompt o del formato di risposta: invalida la cache delle analisi
+PROMPT_VERSION = 2
+
+
+# Un limite per processo e per rpm: analisi lanciate insieme da più sessioni si dividono la stessa quota
+_LIMITI = {}
+_LOCK_LIMITI = threading.Lock()
+
+
+def _limite(rpm, max_workers):
+    if not rpm: return None
+    with _LOCK_LIMITI:
+        if rpm not in _LIMITI: _LIMITI[rpm] = TokenBucket(rpm / 60.0, capacita=max(1, max_workers))
+        return _LIMITI[rpm]
+
+
+def costruisci_prompt():
+    # --- PROMPT IBRIDO (CONTABILE + DATA MANAGER + SCONTRINO ID) ---
+    # Dimensione costante: l'abbinamento al catalogo lo fa matcher.py dopo l'estrazione
+    return """
+    Agisci con due ruoli simultanei: 
+    1. CONTABILE (per i calcoli di cassa precisi)
+    2. DATA MANAGER (per la normalizzazione del database)
+
+    Analizza le immagini dello scontrino seguendo rigorosamente queste FASI:
+
+    --- FASE 1: TESTATA E IDENTIFICATIVI ---
+    Cerca:
+    - P.IVA (solo cifre)
+    - Indirizzo completo
+    - Data (YYYY-MM-DD)
+    - NUMERO SCONTRINO: Cerca etichette come 'Scontrino n.', 'Doc.', 'RT', 'SF', '#'. Estrai il codice identificativo univoco.
+
+    --- FASE 2: PULIZIA CONTABILE (Regole 'V18') ---
+    A. SCONTI E PREZZI NEGATIVI: 
+       Se vedi righe come 'SCONTO', 'FIDATY', o importi col segno meno (-0.50) subito sotto un prodotto:
+       - NON creare una riga per lo sconto.
+       - SOTTRAI il valore al prezzo del prodotto sopra. 
+       - Imposta 'is_offerta' su "SI".
+
+    B. MOLTIPLICATORI:
+       Se vedi '3 x 1.50' (3 pezzi a 1.50 l'uno):
+       - 'quantita_acquistata' = 3
+       - 'prezzo_unitario' = 1.50
+
+    --- FASE 3: ESTRAZIONE E NORMALIZZAZIONE DATABASE ---
+    Per ogni riga risultante dalla Fase 2, estrai:
+    
+    1. 'nome_grezzo': Testo originale.
+    2. 'nome_normalizzato': Nome standard descrittivo (es. 'LATTE GRANAROLO P.S. 1L').
+    3. 'brand': Marca (es. GRANAROLO). Se non c'è, 'GENERICO'.
+    4. 'categoria': Macro categoria (es. LATTE, PASTA).
+    5. 'formato': SOLO IL NUMERO (es. 1.0, 0.5).
+    6. 'unita': SOLO 'KG', 'L', 'PZ'. Converti tutto (500ml -> 0.5 L).
+
+    OUTPUT JSON:
+    {
+      "testata": { "p_iva": "", "indirizzo": "", "data_iso": "", "num_scontrino": "" },
+      "prodotti": [
+        {
+          "nome_grezzo": "...", "nome_normalizzato": "...", "brand": "...", "categoria": "...",
+          "formato": 1.0, "unita": "L", "prezzo_unitario": 0.0, "quantita_acquistata": 1, "is_offerta": "NO"
+        }
+      ]
+    }
+    """
+
+
+def parse_risposta(testo):
+    return json.loads(testo.strip().replace('```json', '').replace('```', ''))
+
+
+_CHIAVE = re.compile(r'"(\w+)"\s*:\s*$')
+
+
+class JsonStreamParser:
+    """Legge la risposta JSON a pezzi ed estrae 'testata' e ogni oggetto di 'prodotti' appena si chiude."""
+
+    def __init__(self):
+        self.testo = ""
+        self.testata = None
+        self.prodotti = []
+        self._i = 0
+        self._pila = []        # (carattere di apertura, chiave a cui è assegnato)
+        self._in_stringa = False
+        self._escape = False
+        self._inizio = None    # (posizione, profondità) dell'oggetto in corso di lettura
+
+    def feed(self, pezzo):
+        """Aggiunge testo; restituisce i prodotti completati in questo pezzo."""
+        self.testo += pezzo
+        nuovi = []
+        t = self.testo
+        for i in range(self._i, len(t)):
+            c = t[i]
+            if self._in_stringa:
+                if self._escape: self._escape = False
+                elif c == '\\': self._escape = True
+                elif c == '"': self._in_stringa = False
+            elif c == '"': self._in_stringa = True
+            elif c in '{[':
+                m = _CHIAVE.search(t, max(0, i - 64), i)
+                chiave = m.group(1) if m else None
+                genitore = self._pila[-1] if self._pila else None
+                if c == '{' and self._inizio is None and (
+                        genitore == ('[', 'prodotti') or (chiave == 'testata' and len(self._pila) == 1)):
+                    self._inizio = (i, len(self._pila))
+                self._pila.append((c, chiave))
+            elif c in '}]' and self._pila:
+                self._pila.pop()
+                if c == '}' and self._inizio and self._inizio[1] == len(self._pila):
+                    try: obj = json.loads(t[self._inizio[0]:i + 1])
+                    except ValueError: obj = None
+                    if isinstance(obj, dict):
+                        if self._pila and self._pila[-1] == ('[', 'prodotti'):
+                            self.prodotti.append(obj)
+                            nuovi.append(obj)
+                        else: self.testata = obj
+                    self._inizio = None
+        self._i = len(t)
+        return nuovi
+
+    def risultato(self):
+        """(dati, completo): la risposta intera se è JSON valido, altrimenti quanto letto finora."""
+        try: return parse_risposta(self.testo), True
+        except ValueError:
+            if not self.prodotti: raise
+            return {'testata': self.testata or {}, 'prodotti': list(self.prodotti)}, False
+
+
+def _ritentabile(e):
+    """Errori temporanei di Gemini (quota, sovraccarico, timeout) o risposta JSON troncata."""
+    status = getattr(e, 'code', None) or getattr(getattr(e, 'response', None), 'status_code', None)
+    if status in (429, 500, 502, 503, 504): return True
+    return type(e).__name__ in ('ResourceExhausted', 'ServiceUnavailable', 'DeadlineExceeded', 'InternalServerError',
+                                'TooManyRequests', 'JSONDecodeError', 'ConnectionError', 'Timeout')
+
+
+def analizza_scontrino(model, prompt, immagini, bucket=None, tentativi=3, attesa=2.0, on_prodotto=None):
+    """Una richiesta a Gemini per uno scontrino (una o più pagine), con ripetizione e attesa esponenziale.
+
+    Restituisce (dati, completo). Con on_prodotto la risposta arriva in streaming e ogni prodotto viene passato
+    appena letto; se lo stream si interrompe dopo qualche prodotto si tiene quanto letto (completo=False).
+    """
+    byte = sum(len(b['data']) for b in immagini if isinstance(b, dict) and 'data' in b)
+    for i in range(tentativi):
+        if bucket:
+            with metriche.fase("gemini.attesa_quota"): bucket.acquire()
+        parser = JsonStreamParser()
+        metriche.conta("gemini.richieste")
+        metriche.conta("gemini.byte_inviati", byte)
+        try:
+            with metriche.fase("gemini.richiesta"):
+                if on_prodotto is None:
+                    testo = model.generate_content([prompt, *immagini]).text
+                    metriche.conta("gemini.byte_ricevuti", len(testo.encode()))
+                    return parse_risposta(testo), True
+                for pezzo in model.generate_content([prompt, *immagini], stream=True):
+                    metriche.conta("gemini.byte_ricevuti", len(pezzo.text.encode()))
+                    for p in parser.feed(pezzo.text): on_prodotto(p)
+            return parser.risultato()
+        except Exception as e:
+            if parser.prodotti: return {'testata': parser.testata or {}, 'prodotti': list(parser.prodotti)}, False
+            if i == tentativi - 1 or not _ritentabile(e): raise
+            time.sleep(attesa * 2 ** i * (0.5 + random.random()))
+
+
+def analizza_in_parallelo(model, prompt, gruppi, max_workers=INGEST_WORKERS, rpm=INGEST_RPM, on_done=None,
+                          cache=None, chiavi=None, forza=False, on_prodotto=None, **kwargs):
+    """Analizza ogni gruppo di immagini come scontrino a sé, in parallelo e con un limite di richieste al minuto.
+
+    gruppi: lista di (nome, [immagini]). Restituisce, nello stesso ordine, dict con nome, dati (o None), errore
+    (o None), secondi (durata dell'analisi, attese comprese), da_cache e parziale. on_done(risultato, completati,
+    totale) viene chiamata dal thread chiamante man mano che i lavori finiscono; con on_prodotto(indice, prodotto)
+    le risposte arrivano in streaming e ogni prodotto viene notificato, sempre dal thread chiamante, appena letto.
+    Con cache (AnalysisCache) e chiavi (una per gruppo) gli scontrini già analizzati non vengono reinviati,
+    salvo forza=True; le nuove analisi riuscite vengono memorizzate.
+    """
+    bucket = _limite(rpm, max_workers)
+    risultati = [None] * len(gruppi)
+    completati = 0
+    da_fare = []
+    for i, (nome, _) in enumerate(gruppi):
+        dati = cache.get(chiavi[i]) if cache is not None and not forza else None
+        if dati is None:
+            da_fare.append(i)
+            continue
+        risultati[i] = {'nome': nome, 'dati': dati, 'errore': None, 'secondi': 0.0, 'da_cache': True, 'parziale': False}
+        completati += 1
+        if on_done: on_done(risultati[i], completati, len(gruppi))
+    # I prodotti letti dai thread passano da una coda: i callback (Streamlit) girano solo nel thread chiamante
+    eventi = queue.Queue()
+    traccia = metriche.corrente()  # i worker contano nella traccia del chiamante
+
+    def svuota():
+        while True:
+            try: i, p = eventi.get_nowait()
+            except queue.Empty: return
+            on_prodotto(i, p)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        def lavoro(i):
+            t0 = time.perf_counter()
+            notifica = (lambda p: eventi.put((i, p))) if on_prodotto else None
+            try:
+                with metriche.usa(traccia):
+                    dati, completo = analizza_scontrino(model, prompt, gruppi[i][1], bucket, on_prodotto=notifica, **kwargs)
+                return dati, completo, None, time.perf_counter() - t0
+            except Exception as e: return None, False, str(e), time.perf_counter() - t0
+
+        in_corso = {pool.submit(lavoro, i): i for i in da_fare}
+        while in_corso:
+            finiti, _ = wait(in_corso, timeout=0.1 if on_prodotto else None, return_when=FIRST_COMPLETED)
+            if on_prodotto: svuota()
+            for fut in finiti:
+                i = in_corso.pop(fut)
+                dati, completo, errore, secondi = fut.result()
+                r = {'nome': gruppi[i][0], 'dati': dati, 'errore': errore, 'secondi': round(secondi, 2),
+                     'da_cache': False, 'parziale': dati is not None and not completo}
+                # Le risposte interrotte non vanno in cache: la prossima volta si riprova
+                if cache is not None and dati is not None and completo: cache.put(chiavi[i], dati)
+                risultati[i] = r
+                completati += 1
+                if on_done: on_done(r, completati, len(gruppi))
+    return risultati
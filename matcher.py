@@ -0,0 +1,159 @@
+import heapq
+import re
+import threading
+
+from units import UNITA, _dal_testo, quantita_canonica
+
+_NON_ALFANUM = re.compile(r'[^0-9A-Z]+')
+
+SOGLIA_MATCH = 0.6      # sopra questa affidabilità (se compatibile) il nome del catalogo sostituisce quello del modello
+MARCHE_GENERICHE = {'', 'GENERICO', 'NAN', 'NONE'}
+
+
+def normalizza(testo):
+    return _NON_ALFANUM.sub(' ', str(testo).upper()).strip()
+
+
+def _trigrammi(testo):
+    t = f"  {testo} "
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+
+def _num(v):
+    try: return round(float(str(v).replace(',', '.')), 3)
+    except (TypeError, ValueError): return None
+
+
+def _misura(nome, formato=None, unita=None):
+    """(quantità, unità di riferimento) scritta nel nome o, in mancanza, nei campi formato/unità; None se non nota."""
+    trovata = _dal_testo(nome)
+    if trovata: return round(trovata[0], 6), trovata[1]
+    if _num(formato) is not None and normalizza(unita) in UNITA: return quantita_canonica(formato, unita)
+    return None
+
+
+def _coperta(w, parole):
+    """Parola della query presente nel nome, anche abbreviata (GRAN -> GRANAROLO)."""
+    return any(x == w or (len(w) >= 3 and x.startswith(w)) for x in parole)
+
+
+class CatalogMatcher:
+    """Abbinamento approssimato nome letto -> prodotto del Catalogo (trigrammi e parole, con marca e formato).
+
+    Ogni NOME_NORMALIZZATO distinto è indicizzato una volta; una ricerca tocca solo i nomi che
+    condividono trigrammi con la query, quindi il costo non cresce con tutto il catalogo.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.nomi = []        # nomi distinti, con l'ID e gli attributi della prima riga
+        self._info = []       # (ID_PRODOTTO, BRAND, FORMATO, UNITA)
+        self._parole = []
+        self._n_tri = []
+        self._pos = {}        # nome -> posizione
+        self._tri = {}        # trigramma -> [posizioni]
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.nomi)
+
+    @classmethod
+    def from_catalog(cls, df):
+        m = cls()
+        m.add(df)
+        return m
+
+    def add(self, df):
+        if df.empty or 'NOME_NORMALIZZATO' not in df.columns: return
+        col = lambda c: df[c].tolist() if c in df.columns else [''] * len(df)
+        with self._lock:
+            for id_p, nome, brand, fmt, unita in zip(df['ID_PRODOTTO'].astype(str), col('NOME_NORMALIZZATO'),
+                                                     col('BRAND'), col('FORMATO'), col('UNITA')):
+                self.ids.append(id_p)
+                chiave = normalizza(nome)
+                if not chiave or chiave in self._pos: continue
+                p = self._pos[chiave] = len(self.nomi)
+                self.nomi.append(str(nome))
+                self._info.append((id_p, normalizza(brand), _num(fmt), normalizza(unita)))
+                self._parole.append(chiave.split())
+                tri = _trigrammi(chiave)
+                self._n_tri.append(len(tri))
+                for g in tri: self._tri.setdefault(g, []).append(p)
+
+    def sync(self, df):
+        """Come ProductIndex.sync: indicizza solo le righe nuove se il catalogo è cresciuto in coda."""
+        n = len(self.ids)
+        if len(df) >= n and df['ID_PRODOTTO'].astype(str).iloc[:n].tolist() == self.ids:
+            self.add(df.iloc[n:])
+            return self
+        return CatalogMatcher.from_catalog(df)
+
+    def match(self, nome, brand=None, formato=None, unita=None, k=3, candidati=50):
+        """Migliori k prodotti per il nome letto: lista di (nome catalogo, ID_PRODOTTO, affidabilità 0..1)."""
+        q = normalizza(nome)
+        if not q: return []
+        tri_q = _trigrammi(q)
+        parole_q = q.split()
+        brand_q, fmt_q, unita_q = normalizza(brand or ''), _num(formato), normalizza(unita or '')
+        with self._lock:
+            comuni = {}
+            for g in tri_q:
+                for p in self._tri.get(g, ()): comuni[p] = comuni.get(p, 0) + 1
+            migliori = heapq.nlargest(candidati, comuni, key=lambda p: comuni[p] / (len(tri_q) + self._n_tri[p]))
+            out = []
+            for p in migliori:
+                dice = 2 * comuni[p] / (len(tri_q) + self._n_tri[p])
+                # Parole della query presenti nel nome, anche abbreviate (GRAN -> GRANAROLO)
+                parole = self._parole[p]
+                coperte = sum(1 for w in parole_q if _coperta(w, parole))
+                punteggio = 0.6 * dice + 0.4 * coperte / len(parole_q)
+                id_p, brand_c, fmt_c, unita_c = self._info[p]
+                if brand_q not in MARCHE_GENERICHE and brand_c not in MARCHE_GENERICHE:
+                    punteggio += 0.1 if brand_q == brand_c or brand_q in self._parole[p] else -0.1
+                if fmt_q is not None and fmt_c is not None and unita_q and unita_c:
+                    punteggio += 0.1 if (fmt_q, unita_q) == (fmt_c, unita_c) else -0.05
+                out.append((self.nomi[p], id_p, round(min(max(punteggio, 0.0), 1.0), 3)))
+        out.sort(key=lambda x: -x[2])
+        return out[:k]
+
+    def compatibile(self, nome, nome_catalogo, formato=None, unita=None):
+        """False se il prodotto del catalogo è simile ma diverso: misura nota diversa (1L contro 0.5L) o una parola
+        del nome letto assente (ZERO, PENNE). Contano le parole alfabetiche di almeno due lettere; le misure a parte."""
+        with self._lock:
+            p = self._pos.get(normalizza(nome_catalogo))
+            if p is None: return False
+            _, _, fmt_c, unita_c = self._info[p]
+            parole = self._parole[p]
+            misura_c = _misura(self.nomi[p], fmt_c, unita_c)
+        misura_q = _misura(nome, formato, unita)
+        if misura_q is not None and misura_c is not None and misura_q != misura_c: return False
+        return all(_coperta(w, parole) for w in normalizza(nome).split() if len(w) >= 2 and w.isalpha())
+
+
+def abbina_prodotti(prodotti, matcher, soglia=SOGLIA_MATCH):
+    """Completa i prodotti estratti dal modello con il miglior prodotto del catalogo (in place).
+
+    Aggiunge 'match' (affidabilità) e 'alternative'; sopra la soglia, e solo se il prodotto è compatibile con
+    il nome proposto dal modello (CatalogMatcher.compatibile), 'nome_normalizzato' diventa il nome del catalogo,
+    così al salvataggio si riusa lo stesso ID_PRODOTTO. Altrimenti il nome resta quello letto e il catalogo è
+    solo un suggerimento: un ID sbagliato fonderebbe lo storico prezzi di prodotti diversi.
+    """
+    for p in prodotti:
+        migliori = {}
+        for campo in ('nome_normalizzato', 'nome_grezzo'):
+            for nome, id_p, s in matcher.match(p.get(campo, ''), p.get('brand'), p.get('formato'), p.get('unita')):
+                if s > migliori.get(nome, (None, -1))[1]: migliori[nome] = (id_p, s)
+        ordinati = sorted(migliori.items(), key=lambda x: -x[1][1])[:3]
+        if not ordinati:
+            p['match'], p['alternative'] = "", ""
+            continue
+        nome, (_, s) = ordinati[0]
+        letto = p.get('nome_normalizzato') or p.get('nome_grezzo', '')
+        ok = matcher.compatibile(letto, nome, p.get('formato'), p.get('unita'))
+        if s >= soglia and ok:
+            p['nome_normalizzato'] = nome
+            ordinati = ordinati[1:]
+        p['match'] = f"{s:.0%}" if ok else f"{s:.0%} (prodotto diverso?)"
+        # Sotto la soglia, o se incompatibile, anche il migliore resta solo un suggerimento
+        p['alternative'] = " | ".join(n for n, _ in ordinati)
+    return prodotti
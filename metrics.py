@@ -0,0 +1,119 @@
+"""Tempi per fase e contatori di chiamate esterne, per capire dove va il tempo di un rerun o di clean_db.
+
+    with metriche.fase("sheets.download"): ...
+    metriche.conta("osrm.byte", len(r.content))
+
+Le fasi e i contatori finiscono nella traccia attiva del thread (aperta con inizia); senza traccia attiva
+costano una lettura di threading.local. Alla chiusura la traccia viene accodata in JSON lines a METRICS_FILE.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS = os.environ.get("METRICS", "0") == "1"  # attive per tutte le sessioni, non solo dal pannello debug
+METRICS_FILE = os.environ.get("METRICS_FILE", ".cache/metriche.jsonl")
+
+
+class _Nulla:
+    def __enter__(self): return None
+    def __exit__(self, *exc): return False
+
+
+_NULLA = _Nulla()
+
+
+class Traccia:
+    """Fasi (volte, ms totali) e contatori di un rerun o di un'esecuzione, aggiornabili da più thread."""
+
+    def __init__(self, nome, **attributi):
+        self.nome = nome
+        self.attributi = attributi
+        self.inizio = time.time()
+        self._t0 = time.perf_counter()
+        self.ms = None
+        self.fasi = {}       # nome -> [volte, ms]
+        self.contatori = {}
+        self._lock = threading.Lock()
+
+    def aggiungi_fase(self, nome, ms):
+        with self._lock:
+            f = self.fasi.setdefault(nome, [0, 0.0])
+            f[0] += 1
+            f[1] += ms
+
+    def conta(self, nome, n=1):
+        with self._lock: self.contatori[nome] = self.contatori.get(nome, 0) + n
+
+    def chiusa(self):
+        return self.ms is not None
+
+    def record(self):
+        with self._lock:
+            return {"ts": round(self.inizio, 3), "traccia": self.nome, **self.attributi,
+                    "ms": round(self.ms if self.ms is not None else (time.perf_counter() - self._t0) * 1000, 1),
+                    "fasi": {n: {"volte": v, "ms": round(ms, 1)} for n, (v, ms) in self.fasi.items()},
+                    "contatori": dict(self.contatori)}
+
+
+class Metriche:
+    def __init__(self, path=METRICS_FILE, sempre=METRICS):
+        self.path = path
+        self.sempre = sempre
+        self._locale = threading.local()
+        self._lock = threading.Lock()
+
+    def corrente(self):
+        return getattr(self._locale, 'traccia', None)
+
+    def inizia(self, nome, attiva=False, **attributi):
+        """Apre una traccia per il thread corrente; None (e nessun costo) se le metriche sono spente."""
+        if not (attiva or self.sempre):
+            self._locale.traccia = None
+            return None
+        t = self._locale.traccia = Traccia(nome, **attributi)
+        return t
+
+    def chiudi(self, traccia=None, scrivi=True):
+        """Chiude la traccia (quella del thread se non indicata), la accoda al file e la restituisce come dict."""
+        t = traccia or self.corrente()
+        if t is None: return None
+        if self.corrente() is t: self._locale.traccia = None
+        if t.chiusa(): return t.record()
+        t.ms = (time.perf_counter() - t._t0) * 1000
+        rec = t.record()
+        if scrivi and self.path:
+            try:
+                if os.path.dirname(self.path): os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with self._lock, open(self.path, "a") as f: f.write(json.dumps(rec, default=str) + "\n")
+            except OSError:
+                pass
+        return rec
+
+    @contextmanager
+    def usa(self, traccia):
+        """Attribuisce alla traccia indicata il lavoro di un altro thread (es. i worker di ingest)."""
+        prec = self.corrente()
+        self._locale.traccia = traccia
+        try: yield traccia
+        finally: self._locale.traccia = prec
+
+    def fase(self, nome):
+        t = getattr(self._locale, 'traccia', None)
+        if t is None: return _NULLA
+        return self._fase(t, nome)
+
+    @contextmanager
+    def _fase(self, t, nome):
+        t0 = time.perf_counter()
+        try: yield t
+        finally: t.aggiungi_fase(nome, (time.perf_counter() - t0) * 1000)
+
+    def conta(self, nome, n=1):
+        t = getattr(self._locale, 'traccia', None)
+        if t is not None: t.conta(nome, n)
+
+
+# Istanza unica per processo, come sheet_cache
+metriche = Metriche()
@@ -0,0 +1,187 @@
+import time
+
+import numpy as np
+
+PENALITA_MANCANTE = 10000  # come nella classifica: un articolo mancante pesa più di qualsiasi prezzo
+
+
+class Plan:
+    """Piano di spesa: negozi scelti (colonne della matrice) e, per ogni articolo, il negozio dove prenderlo."""
+
+    def __init__(self, shops, assignment, totale, mancanti, costo, ottimo, nodi=0):
+        self.shops = shops            # colonne scelte, nell'ordine di inserimento
+        self.assignment = assignment  # per articolo: colonna, -1 se non disponibile
+        self.totale = totale          # somma dei prezzi degli articoli trovati
+        self.mancanti = mancanti
+        self.costo = costo            # obiettivo: totale + penalità mancanti + costo viaggio
+        self.ottimo = ottimo          # False se il tempo è scaduto prima di chiudere la ricerca
+        self.nodi = nodi
+
+
+def _dominati(c, viaggio):
+    """Negozi che un altro negozio batte (o pareggia) su ogni articolo e sul viaggio."""
+    n = c.shape[1]
+    fuori = np.zeros(n, dtype=bool)
+    for a in range(n):
+        if fuori[a]: continue
+        le = (c <= c[:, [a]]).all(axis=0) & (viaggio <= viaggio[a])
+        eq = (c == c[:, [a]]).all(axis=0) & (viaggio == viaggio[a])
+        # b domina a se non è peggiore ovunque; a parità perfetta resta il primo
+        dom = le & ~eq | (eq & (np.arange(n) < a))
+        dom[a] = False
+        if dom[~fuori].any(): fuori[a] = True
+    return fuori
+
+
+def _scambi(C, V, scelti):
+    """Migliora l'insieme scambiando un negozio scelto con uno escluso finché conviene (Teitz-Bart)."""
+    scelti = list(scelti)
+    vuoto = np.full(C.shape[0], float(PENALITA_MANCANTE))
+    migliore = C[:, scelti].min(axis=1).sum() + V[scelti].sum()
+    migliorato = True
+    while migliorato:
+        migliorato = False
+        for pos in range(len(scelti)):
+            resto = scelti[:pos] + scelti[pos + 1:]
+            base = C[:, resto].min(axis=1) if resto else vuoto
+            valori = np.minimum(base[:, None], C).sum(axis=0) + V + V[resto].sum()
+            j = int(valori.argmin())
+            if valori[j] < migliore - 1e-9 and j not in resto:
+                scelti[pos], migliore, migliorato = j, valori[j], True
+    return scelti, migliore
+
+
+def _piano(c, prezzi, scelti, viaggio, ottimo, nodi):
+    n_i = len(c)
+    if not scelti:
+        return Plan([], [-1] * n_i, 0.0, n_i, n_i * PENALITA_MANCANTE, ottimo, nodi)
+    cols = np.array(scelti)
+    # A parità di prezzo vince il negozio scelto per primo
+    best = cols[c[:, cols].argmin(axis=1)]
+    p = prezzi[np.arange(n_i), best]
+    trovato = np.isfinite(p)
+    totale = float(p[trovato].sum())
+    mancanti = int((~trovato).sum())
+    costo = totale + mancanti * PENALITA_MANCANTE + float(viaggio[cols].sum())
+    return Plan(list(scelti), np.where(trovato, best, -1).tolist(), totale, mancanti, costo, ottimo, nodi)
+
+
+def _iniziale(C, V, k):
+    """Soluzione di partenza: golosa, poi rifinita con scambi. Spesso è già l'ottimo e serve a potare."""
+    cur, scelti, tv = np.full(C.shape[0], float(PENALITA_MANCANTE)), [], 0.0
+    for _ in range(k):
+        valori = np.minimum(cur[:, None], C).sum(axis=0) + V + tv
+        j = int(valori.argmin())
+        if valori[j] >= cur.sum() + tv: break
+        cur, tv = np.minimum(cur, C[:, j]), tv + V[j]
+        scelti.append(j)
+    if not scelti: return [], cur.sum()
+    return _scambi(C, V, scelti)
+
+
+def _lagrangiano(C, V, k, ub, iterazioni=150):
+    """Limite inferiore per rilassamento lagrangiano dei vincoli di assegnazione (subgradiente, passo di Polyak).
+
+    Per moltiplicatori lam: L = Σ lam_i + Σ_i min(0, PENALITA - lam_i) + somma dei k rho_s più negativi,
+    con rho_s = V_s + Σ_i min(0, C_is - lam_i). Restituisce il miglior limite e i suoi moltiplicatori.
+    """
+    m = C.shape[1]
+    lam = C.min(axis=1).astype(float)
+    migliore, lam_best, passo, fermo = -np.inf, lam, 2.0, 0
+    for _ in range(iterazioni):
+        d = np.minimum(C - lam[:, None], 0)
+        rho = V + d.sum(axis=0)
+        sel = np.argpartition(rho, k - 1)[:k] if k < m else np.arange(m)
+        sel = sel[rho[sel] < 0]
+        lb = lam.sum() + np.minimum(PENALITA_MANCANTE - lam, 0).sum() + rho[sel].sum()
+        if lb > migliore + 1e-9: migliore, lam_best, fermo = lb, lam, 0
+        else:
+            fermo += 1
+            if fermo >= 5: passo, fermo = passo / 2, 0
+        if migliore >= ub - 1e-9 or passo < 1e-4: break
+        g = 1.0 - (lam > PENALITA_MANCANTE) - (d[:, sel] < 0).sum(axis=1)
+        norma = float((g * g).sum())
+        if not norma: break
+        lam = lam + passo * (ub - lb) / norma * g
+    return migliore, lam_best
+
+
+def optimize(prices, k=None, travel_km=None, costo_km=0.0, time_budget=None):
+    """Miglior insieme di al più k negozi (k=None: nessun limite) per la matrice articoli × negozi.
+
+    Obiettivo: somma dei minimi prezzi per articolo + PENALITA_MANCANTE per articolo non trovato
+    + costo_km × distanza casa→negozio per ogni tappa. Branch-and-bound: negozi dominati eliminati,
+    soluzione iniziale golosa con scambi, limite lagrangiano alla radice (che fissa fuori i negozi
+    inutili) e ad ogni nodo, minimi residui per articolo. Con time_budget (secondi) restituisce il
+    migliore trovato, con ottimo=False.
+    """
+    prezzi = np.asarray(prices, dtype=float)
+    n_i, n_s = prezzi.shape
+    c = np.where(np.isfinite(prezzi), prezzi, PENALITA_MANCANTE)
+    viaggio = np.zeros(n_s) if travel_km is None else np.asarray(travel_km, dtype=float) * costo_km
+    k = n_s if k is None else min(k, n_s)
+    if not n_i or not n_s or k <= 0:
+        return _piano(c, prezzi, [], viaggio, True, 0)
+
+    # Senza costo di viaggio basta il minimo per articolo, se sta nelle tappe concesse
+    if not viaggio.any():
+        utili = [int(j) for j in dict.fromkeys(c.argmin(axis=1)) if np.isfinite(prezzi[:, j]).any()]
+        if len(utili) <= k: return _piano(c, prezzi, utili, viaggio, True, 0)
+
+    # Candidati: negozi con almeno un articolo e non dominati
+    cand = np.flatnonzero(np.isfinite(prezzi).any(axis=0))
+    cand = cand[~_dominati(c[:, cand], viaggio[cand])]
+    if not len(cand): return _piano(c, prezzi, [], viaggio, True, 0)
+    k = min(k, len(cand))
+    t0 = time.perf_counter()
+
+    scelti, ub = _iniziale(c[:, cand], viaggio[cand], k)
+    stato = {'costo': ub, 'scelti': [int(cand[j]) for j in scelti], 'nodi': 0, 'scaduto': False}
+    lb, lam = _lagrangiano(c[:, cand], viaggio[cand], k, ub)
+    if lb >= ub - 1e-9:
+        return _piano(c, prezzi, stato['scelti'], viaggio, True, 0)
+
+    # Fissaggio lagrangiano: fuori i negozi che, imposti nel piano, porterebbero il limite oltre la soluzione nota
+    rho = viaggio[cand] + np.minimum(c[:, cand] - lam[:, None], 0).sum(axis=0)
+    sel = np.argsort(rho, kind='stable')[:k]
+    sel = sel[rho[sel] < 0]
+    lb_forzato = lb + rho - (rho[sel].max() if len(sel) == k else 0.0)
+    tieni = lb_forzato < ub - 1e-9
+    tieni[sel] = True
+    cand, rho = cand[tieni], rho[tieni]
+    ordine = np.argsort(rho, kind='stable')  # i più promettenti per primi
+    cand, rho = cand[ordine], rho[ordine]
+    C, V = c[:, cand], viaggio[cand]
+    n = len(cand)
+    # suf[j]: minimo per articolo tra i candidati da j in poi
+    suf = np.full((n + 1, n_i), float(PENALITA_MANCANTE))
+    for j in range(n - 1, -1, -1): suf[j] = np.minimum(suf[j + 1], C[:, j])
+    lam_tot = lam.sum()
+
+    def visita(start, cur, tv, scelti):
+        stato['nodi'] += 1
+        if time_budget is not None and time.perf_counter() - t0 > time_budget:
+            stato['scaduto'] = True
+            return
+        rimaste = k - len(scelti)
+        # Limite lagrangiano del nodo con i moltiplicatori della radice: i negozi scelti valgono cur
+        resto = rho[start:]
+        if rimaste < len(resto): resto = np.partition(resto, rimaste - 1)[:rimaste]
+        if tv + lam_tot + np.minimum(cur - lam, 0).sum() + np.minimum(resto, 0).sum() >= stato['costo'] - 1e-9: return
+        # Stesso limite con moltiplicatori = cur: somma dei migliori guadagni singoli, più stretto in profondità
+        guadagni = np.maximum(cur[:, None] - C[:, start:], 0).sum(axis=0) - V[start:]
+        if rimaste < len(guadagni): guadagni = np.partition(guadagni, -rimaste)[-rimaste:]
+        if cur.sum() + tv - np.maximum(guadagni, 0).sum() >= stato['costo'] - 1e-9: return
+        for j in range(start, n):
+            # I minimi residui crescono con j: oltre questo punto nessun figlio migliora
+            if np.minimum(cur, suf[j]).sum() + tv >= stato['costo'] - 1e-9: break
+            nuovo = np.minimum(cur, C[:, j])
+            if (nuovo == cur).all() and V[j] >= 0: continue
+            ntv = tv + V[j]
+            val = nuovo.sum() + ntv
+            if val < stato['costo'] - 1e-9: stato.update(costo=val, scelti=[int(cand[x]) for x in scelti + [j]])
+            if rimaste > 1 and j + 1 < n: visita(j + 1, nuovo, ntv, scelti + [j])
+            if stato['scaduto']: return
+
+    visita(0, np.full(n_i, float(PENALITA_MANCANTE)), 0.0, [])
+    return _piano(c, prezzi, stato['scelti'], viaggio, not stato['scaduto'], stato['nodi'])
@@ -0,0 +1,188 @@
+"""Carrello ottimizzato per molte liste della spesa senza Streamlit (es. i piani settimanali delle famiglie).
+
+    python piani_spesa.py liste.jsonl --output piani.jsonl          # una riga JSON per lista
+    python piani_spesa.py liste.csv --output piani.csv --processi 8  # una riga CSV per articolo
+
+Ogni lista ha id, prodotti (elenco JSON, oppure testo con un prodotto per riga o separati da ';'), lat e lon
+(facoltative: senza posizione tutti i negozi valgono 0 km), raggio_km, tappe (numero o "illimitato") e costo_km;
+i campi assenti prendono i valori delle opzioni. I prezzi si caricano una volta sola e le liste si distribuiscono
+su un pool di processi: i risultati escono nell'ordine delle liste man mano che sono pronti.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cart import km_negozi, ottimizza_carrello
+from distances import DistanceService
+from facts import FactTable
+from prices import PriceView
+from search_index import ProductIndex
+from storage import STORAGE_BACKEND, STORAGE_PATH, SheetsStorage, SQLiteStorage
+from stores import StoreRegistry
+
+COLONNE_CSV = ['id', 'articolo', 'negozio', 'prezzo', 'prodotto', 'distanza_km', 'totale_lista', 'errore']
+ILLIMITATE = ('illimitato', 'illimitate', 'max')
+
+
+class Motore:
+    """Prezzi correnti, indice prodotti e anagrafe negozi caricati una volta, per ottimizzare liste in serie."""
+
+    def __init__(self, prezzi, indice, registro, distanze=None, time_budget=1.0):
+        self.prezzi = prezzi
+        self.indice = indice
+        self.registro = registro
+        self.distanze = distanze          # DistanceService per le distanze stradali, None per la linea d'aria
+        self.time_budget = time_budget
+
+    @classmethod
+    def da_storage(cls, storage, **kwargs):
+        df_s, df_c = storage.df("Scontrini"), storage.df("Catalogo")
+        prezzi = PriceView.build(FactTable.build(df_s, df_c))
+        registro = StoreRegistry(storage.df("Anagrafe_Negozi").to_dict('records'))
+        return cls(prezzi, ProductIndex.from_catalog(df_c), registro, **kwargs)
+
+    def ottimizza(self, lista):
+        """Record JSON della lista (vedi leggi_liste); un errore finisce nel campo 'errore' senza fermare le altre."""
+        t0 = time.perf_counter()
+        out = {'id': lista['id']}
+        try:
+            km = None
+            if lista['lat'] is not None and lista['lon'] is not None:
+                indirizzi = self.prezzi.df['Indirizzo'].drop_duplicates().astype(str)
+                km = km_negozi(indirizzi, self.registro, lista['lat'], lista['lon'], raggio_km=lista['raggio_km'],
+                               servizio=self.distanze)
+            carrello = ottimizza_carrello(self.prezzi, self.indice, lista['prodotti'], km=km, raggio_km=lista['raggio_km'],
+                                          tappe=lista['tappe'], costo_km=lista['costo_km'], time_budget=self.time_budget)
+            out.update(carrello.record())
+        except Exception as e:
+            out['errore'] = str(e)
+        out['secondi'] = round(time.perf_counter() - t0, 3)
+        return out
+
+
+def _lista(r, i, raggio_km, tappe, costo_km):
+    num = lambda v: float(str(v).replace(',', '.')) if v not in (None, '') else None
+    prodotti = r.get('prodotti') or []
+    if isinstance(prodotti, str): prodotti = re.split(r'[\n;]', prodotti)
+    t = r.get('tappe')
+    if t in (None, ''): t = tappe
+    # Uno 0 esplicito nella lista (es. costo_km: 0) vale, non prende il default delle opzioni
+    raggio, costo = num(r.get('raggio_km')), num(r.get('costo_km'))
+    return {
+        'id': str(r.get('id') or i + 1),
+        'prodotti': [str(x).strip().upper() for x in prodotti if str(x).strip()],
+        'lat': num(r.get('lat')), 'lon': num(r.get('lon')),
+        'raggio_km': raggio if raggio is not None else raggio_km,
+        'tappe': None if t is None or str(t).strip().lower() in ILLIMITATE else int(float(t)),
+        'costo_km': costo if costo is not None else costo_km,
+    }
+
+
+def leggi_liste(percorso, raggio_km=20.0, tappe=1, costo_km=0.0):
+    """Liste da CSV (intestazione id,prodotti,lat,lon,...), JSON (elenco di oggetti) o JSON lines."""
+    with open(percorso, newline='', encoding='utf-8') as f:
+        if percorso.lower().endswith('.csv'): righe = list(csv.DictReader(f))
+        else:
+            testo = f.read()
+            righe = json.loads(testo) if testo.lstrip().startswith('[') else [json.loads(l) for l in testo.splitlines() if l.strip()]
+    return [_lista(r, i, raggio_km, tappe, costo_km) for i, r in enumerate(righe)]
+
+
+def righe_csv(rec):
+    """Una riga per articolo (negozio vuoto se non trovato); una sola riga per le liste in errore."""
+    if 'errore' in rec: return [{'id': rec['id'], 'errore': rec['errore']}]
+    righe = [{'id': rec['id'], 'articolo': a['articolo'], 'negozio': n['negozio'], 'prezzo': a['prezzo'],
+              'prodotto': a['prodotto'], 'distanza_km': n['distanza_km'], 'totale_lista': rec['totale']}
+             for n in rec['negozi'] for a in n['articoli']]
+    return righe + [{'id': rec['id'], 'articolo': a, 'totale_lista': rec['totale']} for a in rec['mancanti']]
+
+
+# Motore del processo: nel padre prima di creare il pool, ereditato dai worker con fork
+_MOTORE = None
+
+
+def _avvia_worker(apri, stradali, time_budget):
+    global _MOTORE
+    # Con spawn/forkserver il worker parte vuoto e ricarica i prezzi; con fork li eredita
+    if _MOTORE is None: _MOTORE = Motore.da_storage(apri(), time_budget=time_budget)
+    # Connessione SQLite e sessione HTTP della cache distanze proprie di ogni processo
+    _MOTORE.distanze = DistanceService() if stradali else None
+
+
+def _ottimizza(lista):
+    return _MOTORE.ottimizza(lista)
+
+
+def ottimizza_liste(liste, apri, processi=None, stradali=True, time_budget=1.0):
+    """Record delle liste nello stesso ordine, generati man mano; apri() restituisce lo Storage da cui leggere i prezzi.
+
+    processi: worker del pool (default: i core), 1 per lavorare nel processo corrente.
+    """
+    global _MOTORE
+    processi = processi or os.cpu_count() or 1
+    _MOTORE = Motore.da_storage(apri(), time_budget=time_budget)
+    if processi == 1 or len(liste) < 2:
+        _MOTORE.distanze = DistanceService() if stradali else None
+        yield from map(_MOTORE.ottimizza, liste)
+        return
+    metodi = multiprocessing.get_all_start_methods()
+    contesto = multiprocessing.get_context('fork' if 'fork' in metodi else None)
+    with ProcessPoolExecutor(processi, mp_context=contesto, initializer=_avvia_worker,
+                             initargs=(apri, stradali, time_budget)) as pool:
+        yield from pool.map(_ottimizza, liste, chunksize=max(1, len(liste) // (processi * 4)))
+
+
+class ApriStorage:
+    """Apre lo storage dei prezzi; picklable, così anche un worker avviato con spawn può ricaricarli."""
+
+    def __init__(self, db=STORAGE_PATH, backend=STORAGE_BACKEND):
+        self.db = db
+        self.backend = backend
+
+    def __call__(self):
+        if self.backend == "sqlite": return SQLiteStorage(self.db)
+        from clients import ClientManager
+        return SheetsStorage(ClientManager(json.loads(os.environ['GOOGLE_SHEETS_JSON'])))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("liste", help="file .csv, .json o .jsonl con le liste")
+    ap.add_argument("--output", default="-", help="file .jsonl o .csv dei risultati (default: JSON lines su stdout)")
+    ap.add_argument("--processi", type=int, default=None, help="worker del pool (default: numero di core)")
+    ap.add_argument("--raggio", type=float, default=20.0, help="raggio in km per le liste che non lo indicano")
+    ap.add_argument("--tappe", default="1", help="massimo di negozi per le liste che non lo indicano, o 'illimitato'")
+    ap.add_argument("--costo-km", type=float, default=0.0, help="costo viaggio in €/km per le liste che non lo indicano")
+    ap.add_argument("--tempo", type=float, default=1.0, help="secondi massimi di ottimizzazione per lista")
+    ap.add_argument("--linea-aria", action="store_true", help="distanze in linea d'aria invece del routing OSRM")
+    ap.add_argument("--db", default=STORAGE_PATH, help="database SQLite (con STORAGE_BACKEND=sqlite)")
+    args = ap.parse_args(argv)
+
+    liste = leggi_liste(args.liste, args.raggio, args.tappe, args.costo_km)
+    apri = ApriStorage(args.db)
+    formato_csv = args.output.lower().endswith('.csv')
+    f = sys.stdout if args.output == "-" else open(args.output, "w", newline='', encoding='utf-8')
+    t0, errori = time.perf_counter(), 0
+    try:
+        scrittore = csv.DictWriter(f, fieldnames=COLONNE_CSV) if formato_csv else None
+        if scrittore: scrittore.writeheader()
+        for rec in ottimizza_liste(liste, apri, args.processi, stradali=not args.linea_aria, time_budget=args.tempo):
+            errori += 'errore' in rec
+            if scrittore: scrittore.writerows(righe_csv(rec))
+            else: f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            f.flush()
+    finally:
+        if f is not sys.stdout: f.close()
+    secondi = time.perf_counter() - t0
+    print(f"{len(liste)} liste in {secondi:.1f} s ({len(liste) / max(secondi, 1e-9):.1f} liste/s), {errori} in errore",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
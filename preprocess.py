@@ -0,0 +1,61 @@
+import io
+import os
+
+import numpy as np
+from PIL import Image, ImageOps
+
+PREPROCESS_MAX_EDGE = int(os.environ.get("PREPROCESS_MAX_EDGE", 1600))
+PREPROCESS_QUALITY = int(os.environ.get("PREPROCESS_QUALITY", 80))
+
+
+def _soglia_otsu(arr):
+    """Soglia che separa meglio i due gruppi di grigi (carta chiara / sfondo scuro)."""
+    hist = np.bincount(arr.ravel(), minlength=256).astype(float)
+    livelli = np.arange(256)
+    w0 = np.cumsum(hist)
+    w1 = w0[-1] - w0
+    m0 = np.cumsum(hist * livelli)
+    media0 = m0 / np.maximum(w0, 1)
+    media1 = (m0[-1] - m0) / np.maximum(w1, 1)
+    return int(np.argmax(w0 * w1 * (media0 - media1) ** 2))
+
+
+def area_scontrino(img, lato=256, quota=0.15, margine=0.02):
+    """Riquadro (sinistra, alto, destra, basso) della carta chiara, o None se non si distingue dallo sfondo.
+
+    Lavora su una miniatura: righe e colonne con almeno `quota` di pixel sopra la soglia di Otsu sono carta.
+    """
+    mini = img.convert("L")
+    mini.thumbnail((lato, lato))
+    arr = np.asarray(mini)
+    chiaro = arr > _soglia_otsu(arr)
+    righe, colonne = np.flatnonzero(chiaro.mean(axis=1) > quota), np.flatnonzero(chiaro.mean(axis=0) > quota)
+    if not len(righe) or not len(colonne): return None
+    h, w = arr.shape
+    sx, sy = img.width / w, img.height / h
+    m = int(margine * max(w, h))
+    box = (max(0, colonne[0] - m) * sx, max(0, righe[0] - m) * sy,
+           min(w, colonne[-1] + 1 + m) * sx, min(h, righe[-1] + 1 + m) * sy)
+    box = tuple(int(round(v)) for v in box)
+    # Ritaglio inutile (quasi tutta l'immagine) o sospetto (troppo piccolo): meglio non toccare
+    area = (box[2] - box[0]) * (box[3] - box[1]) / float(img.width * img.height)
+    return box if 0.2 < area < 0.95 else None
+
+
+def prepara_immagine(dati, max_lato=PREPROCESS_MAX_EDGE, qualita=PREPROCESS_QUALITY, ritaglia=True):
+    """Scontrino pronto per Gemini: orientamento EXIF, scala di grigi, contrasto, ritaglio, ridimensionamento, JPEG.
+
+    dati: bytes del file caricato. Restituisce (blob {'mime_type', 'data'} per generate_content, info sui byte).
+    """
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(dati)))
+    dimensioni = img.size
+    img = ImageOps.autocontrast(img.convert("L"), cutoff=1)
+    if ritaglia:
+        box = area_scontrino(img)
+        if box: img = img.crop(box)
+    img.thumbnail((max_lato, max_lato), Image.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=qualita, optimize=True)
+    out = buf.getvalue()
+    info = {'byte_prima': len(dati), 'byte_dopo': len(out), 'dimensioni_prima': dimensioni, 'dimensioni_dopo': img.size}
+    return {'mime_type': 'image/jpeg', 'data': out}, info
@@ -0,0 +1,110 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from search_index import RowIndex
+
+CHIAVE_CELLA = ['ID_PRODOTTO', 'CHIAVE_NEGOZIO']
+# Colonne dei fatti riportate nella vista (ricerca e carrello): il testo grezzo dello scontrino e i totali restano nei fatti
+COLONNE_VISTA = ['ID_PRODOTTO', 'NOME_NORMALIZZATO', 'BRAND', 'CATEGORIA', 'FORMATO', 'UNITA', 'Negozio', 'Indirizzo',
+                 'CHIAVE_NEGOZIO', 'Data', 'DATA_DT', 'Prezzo_Unitario', 'PREZZO_AL_L_KG', 'UNITA_RIF', 'In_Offerta']
+_MAI = pd.Timestamp.min  # data illeggibile: la rilevazione conta come la più vecchia
+
+
+def _osservazioni(df, inizio):
+    """Righe della fact table nel formato delle celle aggregate (una osservazione ciascuna).
+
+    Prodotto e negozio sono i codici interi delle colonne category della FactTable, stabili mentre cresce.
+    """
+    pos = np.arange(inizio, inizio + len(df), dtype=np.int32)
+    return pd.DataFrame({
+        'ID_PRODOTTO': df['ID_PRODOTTO'].cat.codes.to_numpy(),
+        'CHIAVE_NEGOZIO': df['CHIAVE_NEGOZIO'].cat.codes.to_numpy(),
+        'POS_ULTIMA': pos, 'DATA_ULTIMA': df['DATA_DT'].fillna(_MAI).to_numpy(),
+        'POS_MIN': pos, 'PREZZO_MIN': df['Prezzo_Unitario'].to_numpy(dtype=np.float32),
+        'N': np.ones(len(df), dtype=np.int32),
+    })
+
+
+def _aggrega(parti):
+    """Una riga per (ID_PRODOTTO, negozio): ultima rilevazione (a parità di data la riga più recente),
+    prezzo minimo (a parità la prima riga, come idxmin) e numero di osservazioni. Accetta anche celle già aggregate."""
+    ultime = parti.sort_values(['DATA_ULTIMA', 'POS_ULTIMA'], kind='stable').drop_duplicates(CHIAVE_CELLA, keep='last')
+    minimi = parti.sort_values(['PREZZO_MIN', 'POS_MIN'], kind='stable').drop_duplicates(CHIAVE_CELLA, keep='first')
+    n = parti.groupby(CHIAVE_CELLA, sort=False)['N'].sum().rename('N').reset_index()
+    out = ultime[CHIAVE_CELLA + ['POS_ULTIMA', 'DATA_ULTIMA']]
+    out = out.merge(minimi[CHIAVE_CELLA + ['POS_MIN', 'PREZZO_MIN']], on=CHIAVE_CELLA).merge(n, on=CHIAVE_CELLA)
+    return out.astype({'N': np.int32})
+
+
+class PriceView:
+    """Prezzo più recente e minimo per (prodotto, negozio), mantenuto al crescere della FactTable.
+
+    `df` ha una riga per coppia: la riga dei fatti dell'ultima rilevazione (COLONNE_VISTA) più PREZZO_MIN, PREZZO_MIN_AL_L_KG,
+    DATA_MIN e N_OSSERVAZIONI. Espone index, chiavi_negozio, codici_negozio e prezzi come FactTable, quindi
+    build_price_matrix la accetta al posto dei fatti e confronta i prezzi correnti invece di tutto lo storico.
+    """
+
+    def __init__(self):
+        self.fatti = None
+        self.n_fatti = 0                  # righe della fact table già incorporate
+        self.celle = pd.DataFrame()
+        self.df = pd.DataFrame()
+        self.index = RowIndex()           # ID_PRODOTTO -> posizioni in df
+        self.codici_negozio = np.array([], dtype=np.int32)
+        self.chiavi_negozio = []
+        self.prezzi = np.array([])        # per riga: ultimo Prezzo_Unitario
+        self.prezzi_unita = np.array([])  # per riga: ultimo prezzo per KG/L/PZ
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.df)
+
+    @classmethod
+    def build(cls, fatti):
+        pv = cls()
+        pv._estendi(fatti)
+        return pv
+
+    def _estendi(self, fatti):
+        if not len(fatti):
+            self.fatti = fatti
+            return
+        nuove = _osservazioni(fatti.df.iloc[self.n_fatti:], self.n_fatti)
+        if self.celle.empty: celle = _aggrega(nuove)
+        else:
+            # Si riaggregano solo le celle toccate dalle righe nuove
+            toccate = pd.MultiIndex.from_frame(self.celle[CHIAVE_CELLA]).isin(pd.MultiIndex.from_frame(nuove[CHIAVE_CELLA]))
+            celle = pd.concat([self.celle[~toccate], _aggrega(pd.concat([self.celle[toccate], nuove]))], ignore_index=True)
+        celle = celle.sort_values('POS_ULTIMA', kind='stable').reset_index(drop=True)
+
+        colonne = [c for c in COLONNE_VISTA if c in fatti.df.columns]
+        df = fatti.df[colonne].iloc[celle['POS_ULTIMA'].to_numpy()].reset_index(drop=True)
+        df['PREZZO_MIN'] = celle['PREZZO_MIN'].to_numpy(dtype=np.float32)
+        df['PREZZO_MIN_AL_L_KG'] = fatti.df['PREZZO_AL_L_KG'].to_numpy()[celle['POS_MIN'].to_numpy()]
+        df['DATA_MIN'] = fatti.df['Data'].iloc[celle['POS_MIN'].to_numpy()].reset_index(drop=True)
+        df['N_OSSERVAZIONI'] = celle['N'].to_numpy()
+        index = RowIndex()
+        index.add(df['ID_PRODOTTO'])
+        with self._lock:
+            self.fatti, self.n_fatti, self.celle, self.df, self.index = fatti, len(fatti), celle, df, index
+            self.codici_negozio = df['CHIAVE_NEGOZIO'].cat.codes.to_numpy()
+            self.chiavi_negozio = df['CHIAVE_NEGOZIO'].cat.categories.tolist()
+            self.prezzi = df['Prezzo_Unitario'].to_numpy(dtype=float)
+            self.prezzi_unita = df['PREZZO_AL_L_KG'].to_numpy(dtype=float)
+
+    def sync(self, fatti):
+        """Incorpora le righe aggiunte in coda alla stessa FactTable; se questa è stata ricostruita, ricostruisce."""
+        if fatti is not self.fatti or len(fatti) < self.n_fatti: return PriceView.build(fatti)
+        if len(fatti) > self.n_fatti: self._estendi(fatti)
+        return self
+
+    def memoria(self):
+        with self._lock:
+            return int(self.df.memory_usage(deep=True).sum() + self.celle.memory_usage(deep=True).sum())
+
+    def righe(self, ids):
+        """Una riga per negozio per ciascuno degli ID_PRODOTTO indicati, senza scorrere lo storico."""
+        with self._lock:
+            return self.df.iloc[self.index.rows(ids)]
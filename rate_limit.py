@@ -0,0 +1,25 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Limite di frequenza condiviso tra i thread: `rate` gettoni al secondo, fino a `capacita` accumulabili."""
+
+    def __init__(self, rate, capacita=1):
+        self.rate = rate
+        self.capacita = capacita
+        self._gettoni = float(capacita)
+        self._t = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._gettoni = min(self.capacita, self._gettoni + (now - self._t) * self.rate)
+                self._t = now
+                if self._gettoni >= 1:
+                    self._gettoni -= 1
+                    return
+                attesa = (1 - self._gettoni) / self.rate
+            time.sleep(attesa)
@@ -0,0 +1,194 @@
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from storage import COLONNE_CATALOGO
+from units import prezzo_per_unita
+
+SAVE_LEDGER = os.environ.get("SAVE_LEDGER", ".cache/salvataggi.sqlite")
+SAVE_TIMEOUT = float(os.environ.get("SAVE_TIMEOUT", 300))  # secondi dopo cui una prenotazione 'in_corso' è scaduta
+
+
+class ScontrinoGiaSalvato(Exception):
+    """Lo stesso scontrino (negozio + numero + data) è già stato salvato o è in corso di salvataggio."""
+
+
+def generate_short_id():
+    return str(uuid.uuid4())[:8]
+
+
+def sanitize_value(val):
+    """Pulisce i valori per evitare errori JSON in Google Sheets"""
+    if val is None: return ""
+    if isinstance(val, float):
+        if math.isnan(val) or math.isinf(val): return 0.0
+    return val
+
+
+def prepara_righe(edited_df, df_cat, data_f, insegna_f, indirizzo_f, num_scontrino_f):
+    """Dall'editor di revisione alle righe da accodare: (nuovi prodotti per Catalogo, righe per Scontrini)."""
+    rows_scontrini = []
+    rows_catalogo_new = []
+
+    # Nome -> ID in un dizionario: vale il primo prodotto del catalogo con quel nome, come prima
+    ids_per_nome = {}
+    if not df_cat.empty and 'NOME_NORMALIZZATO' in df_cat.columns:
+        for nome, id_p in zip(df_cat['NOME_NORMALIZZATO'], df_cat['ID_PRODOTTO']):
+            ids_per_nome.setdefault(nome, str(id_p))
+
+    for row in edited_df.to_dict('records'):
+        # Preparazione Dati Puliti
+        norm_name = str(row["Nome Catalogo (Editabile)"]).upper().strip()
+        brand = str(row["Marca"]).upper().strip()
+        cat = str(row["Cat"]).upper().strip()
+        unit = str(row["Unità (KG/L/PZ)"]).upper().strip()
+
+        try: fmt = float(str(row["Peso/Vol (Tot)"]).replace(',', '.'))
+        except: fmt = 1.0
+        fmt = sanitize_value(fmt)
+
+        # LOGICA ID (Relazionale): catalogo e prodotti nuovi di questo scontrino nello stesso indice
+        prod_id = ids_per_nome.get(norm_name)
+        if not prod_id:
+            prod_id = ids_per_nome[norm_name] = generate_short_id()
+            rows_catalogo_new.append([str(prod_id), norm_name, brand, cat, fmt, unit])
+
+        # Prezzi e Totali
+        try: p_unit = float(str(row["Prezzo €"]).replace(',', '.'))
+        except: p_unit = 0.0
+        try: qta = float(str(row["Qtà"]).replace(',', '.'))
+        except: qta = 1.0
+
+        p_unit = sanitize_value(p_unit)
+        qta = sanitize_value(qta)
+        tot_riga = sanitize_value(p_unit * qta)
+        # Prezzo per KG/L/PZ calcolato qui una volta: ricerca e carrello ordinano su questo valore
+        p_rif, u_rif = prezzo_per_unita(p_unit, fmt, unit, norm_name)
+
+        # COSTRUZIONE RIGA (14 Colonne: Num Scontrino in L, prezzo per unità di riferimento in M e N)
+        riga_completa = [
+            str(data_f),                        # A
+            str(insegna_f),                     # B
+            str(indirizzo_f),                   # C
+            str(row["Scontrino"]).upper(),      # D
+            tot_riga,                           # E
+            0,                                  # F
+            p_unit,                             # G
+            str(row["Offerta"]).upper(),        # H
+            qta,                                # I
+            "SI",                               # J
+            str(prod_id),                       # K (ID Prodotto)
+            str(num_scontrino_f),               # L (Numero Scontrino)
+            p_rif,                              # M (Prezzo per KG/L/PZ)
+            u_rif                               # N (Unità di riferimento)
+        ]
+        rows_scontrini.append(riga_completa)
+
+    return rows_catalogo_new, rows_scontrini
+
+
+def chiave_idempotenza(piva, num_scontrino, data, righe=(), negozio="", indirizzo=""):
+    """P.IVA + negozio + indirizzo + N. Scontrino + data; senza numero scontrino si usa anche il contenuto delle righe.
+
+    None senza P.IVA né numero: due spese uguali nello stesso negozio e giorno sarebbero indistinguibili,
+    e uno scontrino vero verrebbe scartato come doppione.
+    """
+    num = str(num_scontrino).strip().upper()
+    if not str(piva).strip() and not num: return None
+    base = "|".join([str(piva).strip(), str(negozio).strip().upper(), str(indirizzo).strip().upper(), num, str(data).strip()])
+    if num: return base
+    return base + "|" + hashlib.sha256(repr([r[3:9] for r in righe]).encode()).hexdigest()[:16]
+
+
+class RegistroSalvataggi:
+    """Scontrini già salvati (chiave di idempotenza), su SQLite: un secondo clic o un nuovo tentativo non duplica.
+
+    Una prenotazione rimasta 'in_corso' oltre `scadenza` secondi (sessione chiusa o processo terminato a metà
+    salvataggio) non blocca più lo scontrino: il tentativo successivo la rileva.
+    """
+
+    def __init__(self, path=SAVE_LEDGER, scadenza=SAVE_TIMEOUT):
+        if path != ":memory:" and os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.scadenza = scadenza
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS salvataggi (chiave TEXT PRIMARY KEY, stato TEXT, righe INTEGER, quando REAL)")
+        self._db.commit()
+
+    def prenota(self, chiave):
+        """True se la chiave era libera o con una prenotazione scaduta (ora è 'in_corso'), False se salvata o in corso."""
+        ora = time.time()
+        with self._lock:
+            try:
+                self._db.execute("INSERT INTO salvataggi VALUES (?, 'in_corso', 0, ?)", (chiave, ora))
+                self._db.commit()
+                return True
+            except sqlite3.IntegrityError:
+                # Aggiornamento condizionato: tra due processi che trovano la stessa prenotazione scaduta ne vince uno
+                cur = self._db.execute("UPDATE salvataggi SET quando = ? WHERE chiave = ? AND stato = 'in_corso' AND quando < ?",
+                                       (ora, chiave, ora - self.scadenza))
+                self._db.commit()
+                return cur.rowcount == 1
+
+    def conferma(self, chiave, righe):
+        with self._lock:
+            self._db.execute("UPDATE salvataggi SET stato = 'salvato', righe = ?, quando = ? WHERE chiave = ?",
+                             (righe, time.time(), chiave))
+            self._db.commit()
+
+    def annulla(self, chiave):
+        with self._lock:
+            self._db.execute("DELETE FROM salvataggi WHERE chiave = ? AND stato = 'in_corso'", (chiave,))
+            self._db.commit()
+
+
+def _gia_presente(df_scontrini, data_f, indirizzo_f, num_scontrino_f):
+    """Controllo sul foglio (salvataggi fatti da altre istanze): stessa data, indirizzo e Num_Scontrino."""
+    if df_scontrini is None or df_scontrini.empty or 'Num_Scontrino' not in df_scontrini.columns: return False
+    if not str(num_scontrino_f).strip(): return False
+    num = df_scontrini['Num_Scontrino'].astype(str).str.strip().str.upper()
+    m = ((num == str(num_scontrino_f).strip().upper()) & (df_scontrini['Data'].astype(str) == str(data_f))
+         & (df_scontrini['Indirizzo'].astype(str) == str(indirizzo_f)))
+    return bool(m.any())
+
+
+def salva_scontrino(storage, df_cat, edited_df, data_f, insegna_f, indirizzo_f, num_scontrino_f,
+                    piva="", registro=None, df_scontrini=None, coda=None):
+    """Scrive lo scontrino revisionato su Catalogo e Scontrini (uno Storage). Restituisce il numero di righe aggiunte.
+
+    Con `registro` (RegistroSalvataggi) lo stesso scontrino non viene mai accodato due volte: solleva
+    ScontrinoGiaSalvato. df_scontrini, se passato, estende il controllo ai salvataggi di altre istanze.
+    Senza P.IVA né numero scontrino il controllo non si applica (vedi chiave_idempotenza). Con `coda` (WriteQueue) le righe vengono solo registrate e inviate in background.
+    """
+    # 1. Controlli Catalogo
+    try:
+        if df_cat.empty: storage.ensure_header("Catalogo", COLONNE_CATALOGO)
+    except: pass
+
+    rows_catalogo_new, rows_scontrini = prepara_righe(edited_df, df_cat, data_f, insegna_f, indirizzo_f, num_scontrino_f)
+
+    chiave = chiave_idempotenza(piva, num_scontrino_f, data_f, rows_scontrini, insegna_f, indirizzo_f)
+    # Senza chiave lo scontrino si salva sempre; la coda vuole comunque un identificativo del salvataggio
+    if chiave is None: registro, chiave = None, "senza-chiave-" + uuid.uuid4().hex
+    if registro is not None and not registro.prenota(chiave): raise ScontrinoGiaSalvato(chiave)
+    # Solo le righe della data dello scontrino: su SQLite con l'indice per Data, altrimenti dal DataFrame in cache
+    del_giorno = storage.righe_periodo(data_f, data_f, df=df_scontrini) if df_scontrini is not None else None
+    if _gia_presente(del_giorno, data_f, indirizzo_f, num_scontrino_f):
+        if registro is not None: registro.conferma(chiave, 0)
+        raise ScontrinoGiaSalvato(chiave)
+
+    # Scrittura (una sola append per tabella, ripetuta se Google risponde con un errore temporaneo)
+    try:
+        if coda is not None: coda.enqueue(chiave, [("Catalogo", rows_catalogo_new), ("Scontrini", rows_scontrini)])
+        else:
+            storage.append("Catalogo", rows_catalogo_new)
+            storage.append("Scontrini", rows_scontrini)
+    except Exception:
+        if registro is not None: registro.annulla(chiave)
+        raise
+    if registro is not None: registro.conferma(chiave, len(rows_scontrini))
+    return len(rows_scontrini)
@@ -0,0 +1,137 @@
+import sys
+import threading
+
+import numpy as np
+
+CAMPI_RICERCA = ('NOME_NORMALIZZATO', 'BRAND', 'CATEGORIA')
+
+
+def trigrammi(testo):
+    return {testo[i:i + 3] for i in range(len(testo) - 2)}
+
+
+class ProductIndex:
+    """Indice invertito (token e trigrammi) sul Catalogo: dalla query agli ID_PRODOTTO.
+
+    Ogni testo distinto di un campo viene indicizzato una sola volta, quindi il costo
+    di una ricerca dipende dai prodotti che corrispondono e non dalle righe di Scontrini.
+    """
+
+    def __init__(self, campi=CAMPI_RICERCA):
+        self.campi = tuple(campi)
+        self.ids = []                              # ID_PRODOTTO nell'ordine del catalogo
+        self._valori = {c: {} for c in self.campi}  # testo -> set(ID)
+        self._tri = {c: {} for c in self.campi}     # trigramma -> set(testi)
+        self._token = {c: {} for c in self.campi}   # parola -> set(testi)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_catalog(cls, df, campi=CAMPI_RICERCA):
+        ix = cls(campi)
+        ix.add(df)
+        return ix
+
+    def add(self, df):
+        """Indicizza righe di catalogo (DataFrame con ID_PRODOTTO e i campi di ricerca)."""
+        if df.empty: return
+        colonne = [df[c].astype(str) if c in df.columns else [''] * len(df) for c in self.campi]
+        with self._lock:
+            for id_p, *testi in zip(df['ID_PRODOTTO'].astype(str), *colonne):
+                self.ids.append(id_p)
+                for c, t in zip(self.campi, testi):
+                    valori = self._valori[c]
+                    if t not in valori:
+                        valori[t] = set()
+                        for g in trigrammi(t): self._tri[c].setdefault(g, set()).add(t)
+                        for w in t.split(): self._token[c].setdefault(w, set()).add(t)
+                    valori[t].add(id_p)
+
+    def sync(self, df):
+        """Allinea l'indice al catalogo: se sono state solo aggiunte righe indicizza la coda, altrimenti ricostruisce."""
+        n = len(self.ids)
+        if len(df) >= n and df['ID_PRODOTTO'].astype(str).iloc[:n].tolist() == self.ids:
+            self.add(df.iloc[n:])
+            return self
+        return ProductIndex.from_catalog(df, self.campi)
+
+    def _testi(self, campo, q):
+        # Sotto i 3 caratteri non ci sono trigrammi, e come sottostringa "LA" troverebbe mezzo catalogo:
+        # vale solo la parola intera (es. "PS", "UHT"), dall'indice delle parole
+        if len(q) < 3: return self._token[campo].get(q, ())
+        post = self._tri[campo]
+        cand = None
+        for g in sorted(trigrammi(q), key=lambda g: len(post.get(g, ()))):
+            s = post.get(g)
+            if not s: return []
+            cand = set(s) if cand is None else cand & s
+            if not cand: return []
+        return [t for t in cand if q in t]
+
+    def search(self, query, campi=None):
+        """ID_PRODOTTO che contengono `query` come sottostringa in almeno uno dei campi (come parola intera se è
+        più corta di 3 caratteri)."""
+        q = str(query)
+        out = set()
+        if not q: return out
+        with self._lock:
+            for c in campi or self.campi:
+                for t in self._testi(c, q): out |= self._valori[c][t]
+        return out
+
+    def search_tokens(self, query, campi=None):
+        """ID_PRODOTTO che contengono tutte le parole di `query` come parole intere, in qualsiasi campo e ordine."""
+        out = None
+        with self._lock:
+            for w in str(query).split():
+                trovati = set()
+                for c in campi or self.campi:
+                    for t in self._token[c].get(w, ()): trovati |= self._valori[c][t]
+                out = trovati if out is None else out & trovati
+                if not out: return set()
+        return out or set()
+
+
+class RowIndex:
+    """ID_PRODOTTO -> posizioni di riga in Scontrini, esteso in coda quando arrivano nuovi scontrini."""
+
+    def __init__(self):
+        self.ids = []
+        self._pos = {}
+        self._arr = {}  # ID -> array delle posizioni, riconvertito solo per gli ID toccati da add()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, id_series):
+        with self._lock:
+            start = len(self.ids)
+            for i, id_p in enumerate(id_series.astype(str), start):
+                id_p = sys.intern(id_p)  # un solo oggetto stringa per ID, non uno per riga
+                self.ids.append(id_p)
+                self._pos.setdefault(id_p, []).append(i)
+                self._arr.pop(id_p, None)
+
+    def sync(self, df):
+        n = len(self.ids)
+        if len(df) >= n and df['ID_PRODOTTO'].astype(str).iloc[:n].tolist() == self.ids:
+            self.add(df['ID_PRODOTTO'].iloc[n:])
+            return self
+        ix = RowIndex()
+        ix.add(df['ID_PRODOTTO'])
+        return ix
+
+    def rows(self, ids):
+        """Posizioni (ordinate) delle righe di Scontrini con uno degli ID indicati."""
+        with self._lock:
+            blocchi = []
+            for i in ids:
+                if i not in self._pos: continue
+                a = self._arr.get(i)
+                if a is None: a = self._arr[i] = np.array(self._pos[i], dtype=np.int64)
+                blocchi.append(a)
+        if not blocchi: return np.array([], dtype=np.int64)
+        return np.sort(np.concatenate(blocchi))
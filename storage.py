@@ -0,0 +1,332 @@
+"""Archivio delle tre tabelle (Scontrini, Catalogo, Anagrafe_Negozi) dietro un'unica interfaccia.
+
+SheetsStorage parla con Google Sheets come ha sempre fatto l'app; SQLiteStorage tiene le stesse tabelle
+in un file locale con indici per prodotto, negozio e data. `sincronizza` allinea i due in blocco.
+
+    python storage.py sync [--db percorso.sqlite]   # usa GOOGLE_SHEETS_JSON, come clean_db.py
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+
+import pandas as pd
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sheets")
+STORAGE_PATH = os.environ.get("STORAGE_PATH", ".cache/database.sqlite")
+
+COLONNE_CATALOGO = ["ID_PRODOTTO", "NOME_NORMALIZZATO", "BRAND", "CATEGORIA", "FORMATO", "UNITA"]
+# Ordine delle 14 colonne di Scontrini (A..N). L'app legge per nome solo Data, Negozio, Indirizzo,
+# Prezzo_Unitario, In_Offerta, ID_PRODOTTO e le due colonne di units.py: gli altri nomi servono ai fogli creati da zero.
+COLONNE_SCONTRINI = ["Data", "Negozio", "Indirizzo", "Prodotto_Scontrino", "Totale_Riga", "Sconto",
+                     "Prezzo_Unitario", "In_Offerta", "Quantita", "Normalizzato", "ID_PRODOTTO", "Num_Scontrino",
+                     "Prezzo_Per_Unita", "Unita_Riferimento"]
+COLONNE_NEGOZI = ["Insegna_Standard", "Indirizzo_Standard (Pulito)", "P_IVA", "Latitudine", "Longitudine"]
+
+SCHEMI = {"Scontrini": COLONNE_SCONTRINI, "Catalogo": COLONNE_CATALOGO, "Anagrafe_Negozi": COLONNE_NEGOZI}
+INDICI = {
+    "Scontrini": [("ID_PRODOTTO",), ("Negozio", "Indirizzo"), ("Data",)],
+    "Catalogo": [("ID_PRODOTTO",), ("NOME_NORMALIZZATO",)],
+    "Anagrafe_Negozi": [("P_IVA",), ("Indirizzo_Standard (Pulito)",)],
+}
+
+
+def _transitorio(e):
+    """Quota superata o errore temporaneo del server: si può ritentare."""
+    status = getattr(getattr(e, 'response', None), 'status_code', None)
+    return status in (429, 500, 502, 503, 504) or type(e).__name__ in ('ConnectionError', 'Timeout', 'TransportError')
+
+
+def _q(nome):
+    return '"' + str(nome).replace('"', '""') + '"'
+
+
+def _lettera(n):
+    """1 -> A, 27 -> AA"""
+    s = ""
+    while n: n, r = divmod(n - 1, 26); s = chr(65 + r) + s
+    return s
+
+
+class Storage(ABC):
+    """Interfaccia comune. Le query di base filtrano il DataFrame intero (o quello già in cache passato con df=);
+    SQLiteStorage le fa con gli indici."""
+
+    @abstractmethod
+    def records(self, tabella):
+        pass
+
+    @abstractmethod
+    def header(self, tabella):
+        pass
+
+    @abstractmethod
+    def append(self, tabella, righe, colonne=None):
+        """Accoda righe (liste nell'ordine delle colonne della tabella, o di `colonne` se indicate)."""
+
+    @abstractmethod
+    def ensure_header(self, tabella, colonne):
+        """Scrive le intestazioni se la tabella è ancora vuota."""
+
+    @abstractmethod
+    def scrivi_colonne(self, tabella, colonne, valori):
+        """Sovrascrive intere colonne (create se mancano): `valori` ha una riga per riga della tabella, nell'ordine di df()."""
+
+    def df(self, tabella):
+        df = pd.DataFrame(self.records(tabella))
+        df.columns = [str(c).strip() for c in df.columns]
+        if 'ID_PRODOTTO' in df.columns: df['ID_PRODOTTO'] = df['ID_PRODOTTO'].astype(str).str.strip()
+        return df
+
+    def righe_prodotti(self, tabella, ids, df=None):
+        df = self.df(tabella) if df is None else df
+        return df[df['ID_PRODOTTO'].astype(str).isin({str(i) for i in ids})] if not df.empty else df
+
+    def righe_negozio(self, negozio, indirizzo=None, df=None):
+        df = self.df("Scontrini") if df is None else df
+        if df.empty: return df
+        m = df['Negozio'].astype(str) == str(negozio)
+        if indirizzo is not None: m &= df['Indirizzo'].astype(str) == str(indirizzo)
+        return df[m]
+
+    def righe_periodo(self, da=None, a=None, df=None):
+        """Righe di Scontrini con Data (ISO, AAAA-MM-GG) tra da e a inclusi."""
+        df = self.df("Scontrini") if df is None else df
+        if df.empty: return df
+        d = df['Data'].astype(str)
+        m = pd.Series(True, index=df.index)
+        if da: m &= d >= str(da)
+        if a: m &= d <= str(a)
+        return df[m]
+
+
+class SheetsStorage(Storage):
+    """Tabelle su Google Sheets tramite ClientManager (o un suo sostituto con lo stesso metodo call)."""
+
+    def __init__(self, clients, tentativi=4, attesa=1.0):
+        self.clients = clients
+        self.tentativi = tentativi
+        self.attesa = attesa
+        self._larghezza = {}  # tabella -> colonne con intestazione già verificate
+
+    def records(self, tabella):
+        return self.clients.call(tabella, lambda ws: ws.get_all_records())
+
+    def header(self, tabella):
+        return self.clients.call(tabella, lambda ws: ws.row_values(1))
+
+    def _allarga_header(self, tabella, n):
+        """Intestazioni per le colonne aggiunte in coda allo schema (es. Scontrini da 12 a 14), una verifica per processo.
+
+        Senza, get_all_records troverebbe intestazioni vuote ripetute sulle righe più larghe.
+        """
+        if self._larghezza.get(tabella, 0) >= n: return
+        header = self.header(tabella)
+        schema = SCHEMI.get(tabella, [])
+        if header and len(header) < n <= len(schema) and [str(c).strip() for c in header] == schema[:len(header)]:
+            cella = f"{_lettera(len(header) + 1)}1"
+            self.clients.call(tabella, lambda ws: ws.update(range_name=cella, values=[schema[len(header):n]]))
+            header = schema[:n]
+        self._larghezza[tabella] = len(header)
+
+    def append(self, tabella, righe, colonne=None):
+        # Sul foglio le righe seguono sempre l'ordine delle colonne del foglio
+        if not righe: return
+        self._allarga_header(tabella, max(len(r) for r in righe))
+        for i in range(self.tentativi):
+            try:
+                return self.clients.call(tabella, lambda ws: ws.append_rows(righe, value_input_option='USER_ENTERED'))
+            except Exception as e:
+                if i == self.tentativi - 1 or not _transitorio(e): raise
+                time.sleep(self.attesa * 2 ** i)
+
+    def ensure_header(self, tabella, colonne):
+        if not self.header(tabella):
+            self.clients.call(tabella, lambda ws: ws.append_row(list(colonne)))
+
+    def scrivi_colonne(self, tabella, colonne, valori):
+        # Intestazione compresa (colonne nuove in coda al foglio); colonne adiacenti in un'unica update
+        header = [str(c).strip() for c in self.header(tabella)]
+        for c in colonne:
+            if c not in header: header.append(c)
+        pos = [header.index(c) for c in colonne]
+        blocchi = [list(range(len(colonne)))]
+        if pos != list(range(pos[0], pos[0] + len(pos))): blocchi = [[j] for j in range(len(colonne))]
+        for js in blocchi:
+            dati = [[colonne[j] for j in js]] + [["" if r[j] is None else r[j] for j in js] for r in valori]
+            cella = f"{_lettera(pos[js[0]] + 1)}1"
+            self.clients.call(tabella, lambda ws: ws.update(range_name=cella, values=dati,
+                                                           value_input_option='USER_ENTERED'))
+        self._larghezza[tabella] = len(header)
+
+
+class SQLiteStorage(Storage):
+    """Tabelle in un file SQLite. Le colonne non hanno tipo dichiarato: i valori restano come arrivano (numeri o testo).
+
+    L'ordine di inserimento è conservato in `_riga`, così df() restituisce le righe nello stesso ordine del foglio.
+    """
+
+    def __init__(self, path=STORAGE_PATH, schemi=SCHEMI, indici=INDICI):
+        if path != ":memory:" and os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.indici = indici
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._colonne = {}
+        for t, colonne in schemi.items(): self._crea(t, colonne)
+
+    def _crea(self, tabella, colonne):
+        with self._lock:
+            presenti = [r[1] for r in self._db.execute(f"PRAGMA table_info({_q(tabella)})")][1:]
+            if not presenti:
+                cols = ", ".join(_q(c) for c in colonne)
+                self._db.execute(f"CREATE TABLE IF NOT EXISTS {_q(tabella)} (_riga INTEGER PRIMARY KEY, {cols})")
+                presenti = list(colonne)
+            for c in colonne:
+                if c not in presenti:
+                    self._db.execute(f"ALTER TABLE {_q(tabella)} ADD COLUMN {_q(c)}")
+                    presenti.append(c)
+            for i, cols in enumerate(self.indici.get(tabella, ())):
+                if all(c in presenti for c in cols):
+                    nome = _q(f"ix_{tabella}_{i}")
+                    self._db.execute(f"CREATE INDEX IF NOT EXISTS {nome} ON {_q(tabella)} ({', '.join(map(_q, cols))})")
+            self._db.commit()
+            self._colonne[tabella] = presenti
+
+    def _select(self, tabella, where="", params=()):
+        cols = self._colonne.get(tabella)
+        if not cols: return pd.DataFrame()
+        with self._lock:
+            cur = self._db.execute(f"SELECT {', '.join(map(_q, cols))} FROM {_q(tabella)} {where} ORDER BY _riga", params)
+            righe = cur.fetchall()
+        df = pd.DataFrame(righe, columns=cols)
+        if 'ID_PRODOTTO' in df.columns: df['ID_PRODOTTO'] = df['ID_PRODOTTO'].astype(str).str.strip()
+        return df
+
+    def records(self, tabella):
+        return self._select(tabella).to_dict('records')
+
+    def df(self, tabella):
+        return self._select(tabella)
+
+    def header(self, tabella):
+        return list(self._colonne.get(tabella, []))
+
+    def append(self, tabella, righe, colonne=None):
+        """Accoda righe; con `colonne` le righe seguono quell'ordine (colonne mancanti aggiunte alla tabella)."""
+        if not righe: return
+        colonne = list(colonne or self._colonne[tabella])
+        if any(c not in self._colonne.get(tabella, ()) for c in colonne): self._crea(tabella, colonne)
+        n = len(colonne)
+        righe = [list(r[:n]) + [None] * (n - len(r)) for r in righe]
+        with self._lock:
+            self._db.executemany(
+                f"INSERT INTO {_q(tabella)} ({', '.join(map(_q, colonne))}) VALUES ({', '.join('?' * n)})", righe)
+            self._db.commit()
+
+    def ensure_header(self, tabella, colonne):
+        self._crea(tabella, colonne)
+
+    def scrivi_colonne(self, tabella, colonne, valori):
+        if any(c not in self._colonne.get(tabella, ()) for c in colonne): self._crea(tabella, colonne)
+        with self._lock:
+            righe = [r for (r,) in self._db.execute(f"SELECT _riga FROM {_q(tabella)} ORDER BY _riga")]
+            self._db.executemany(
+                f"UPDATE {_q(tabella)} SET {', '.join(f'{_q(c)} = ?' for c in colonne)} WHERE _riga = ?",
+                [list(v) + [r] for v, r in zip(valori, righe)])
+            self._db.commit()
+
+    # Le query vanno sempre al database, con gli indici: un df= in cache non serve
+    def righe_prodotti(self, tabella, ids, df=None):
+        ids = [str(i) for i in ids]
+        if not ids: return self._select(tabella, "WHERE 0")
+        # Blocchi sotto il limite di parametri di SQLite
+        blocchi = [self._select(tabella, f"WHERE ID_PRODOTTO IN ({','.join('?' * len(ids[i:i + 500]))})", ids[i:i + 500])
+                   for i in range(0, len(ids), 500)]
+        return blocchi[0] if len(blocchi) == 1 else pd.concat(blocchi, ignore_index=True)
+
+    def righe_negozio(self, negozio, indirizzo=None, df=None):
+        if indirizzo is None: return self._select("Scontrini", "WHERE Negozio = ?", (str(negozio),))
+        return self._select("Scontrini", "WHERE Negozio = ? AND Indirizzo = ?", (str(negozio), str(indirizzo)))
+
+    def righe_periodo(self, da=None, a=None, df=None):
+        cond, params = [], []
+        if da: cond.append("Data >= ?"); params.append(str(da))
+        if a: cond.append("Data <= ?"); params.append(str(a))
+        return self._select("Scontrini", ("WHERE " + " AND ".join(cond)) if cond else "", params)
+
+
+def _norma(v):
+    """Valore confrontabile tra i due lati: Sheets restituisce 1 dove SQLite ha 1.0, '' dove SQLite ha NULL."""
+    if v is None or (isinstance(v, float) and v != v): return ""
+    if isinstance(v, (int, float)): return repr(float(v))
+    s = str(v).strip()
+    try: return repr(float(s))
+    except ValueError: return s
+
+
+def sincronizza(locale, remoto, tabelle=tuple(SCHEMI)):
+    """Allinea in due direzioni SQLite e Sheets, con una lettura e al più una scrittura in blocco per lato.
+
+    Le righe sono confrontate come multinsiemi sulle colonne del foglio: quelle presenti solo in locale vengono
+    accodate al foglio, quelle solo sul foglio vengono inserite in locale. Le cancellazioni non si propagano.
+    Restituisce {tabella: (righe inviate, righe ricevute)}.
+    """
+    esito = {}
+    for t in tabelle:
+        rec_remoti = remoto.records(t)
+        header = [str(c).strip() for c in (remoto.header(t) or [])]
+        loc = locale.df(t)
+        if not header:
+            # Foglio vuoto: intestazioni dalla tabella locale
+            header = locale.header(t)
+            remoto.ensure_header(t, header)
+        cols = [c for c in header if c]
+        rem = pd.DataFrame(rec_remoti)
+        if not rem.empty: rem.columns = [str(c).strip() for c in rem.columns]
+        rem = rem.reindex(columns=cols)
+        loc_v = loc.reindex(columns=cols)
+
+        def chiavi(df):
+            return [tuple(_norma(v) for v in r) for r in df.itertuples(index=False, name=None)]
+
+        k_rem, k_loc = chiavi(rem), chiavi(loc_v)
+        da_inviare, da_ricevere = Counter(k_loc) - Counter(k_rem), Counter(k_rem) - Counter(k_loc)
+
+        def estrai(df, k, quante):
+            out = []
+            for riga, ch in zip(df.itertuples(index=False, name=None), k):
+                if quante.get(ch, 0) > 0:
+                    quante[ch] -= 1
+                    out.append(["" if pd.isna(v) else v for v in riga])
+            return out
+
+        inviate, ricevute = estrai(loc_v, k_loc, da_inviare), estrai(rem, k_rem, da_ricevere)
+        # Sul foglio append segue l'ordine delle sue colonne: le righe sono già su `cols`, riportate all'header
+        # completo (intestazioni vuote comprese) per non scalare i valori
+        pos = {c: i for i, c in enumerate(cols)}
+        inviate = [[r[pos[c]] if c in pos else "" for c in header] for r in inviate]
+        remoto.append(t, inviate)
+        locale.append(t, ricevute, colonne=cols)
+        esito[t] = (len(inviate), len(ricevute))
+    return esito
+
+
+def main(argv=None):
+    import argparse
+    from clients import ClientManager
+    ap = argparse.ArgumentParser(description="Sincronizzazione tra il database locale e Google Sheets")
+    ap.add_argument("comando", choices=["sync"])
+    ap.add_argument("--db", default=STORAGE_PATH)
+    args = ap.parse_args(argv)
+    remoto = SheetsStorage(ClientManager(json.loads(os.environ['GOOGLE_SHEETS_JSON'])))
+    for t, (inviate, ricevute) in sincronizza(SQLiteStorage(args.db), remoto).items():
+        print(f"{t}: {inviate} righe inviate a Sheets, {ricevute} righe ricevute")
+
+
+if __name__ == "__main__":
+    main()
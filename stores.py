@@ -0,0 +1,60 @@
+import re
+
+from geo import StoreIndex
+
+_NON_ALFANUM = re.compile(r'\W+')
+_NON_CIFRE = re.compile(r'\D')
+
+
+def norm_indirizzo(indirizzo):
+    return _NON_ALFANUM.sub('', str(indirizzo)).upper()
+
+
+def clean_piva(piva):
+    solo_numeri = _NON_CIFRE.sub('', str(piva))
+    return solo_numeri.zfill(11) if solo_numeri else ""
+
+
+def _coord(v):
+    try: return float(str(v).replace(',', '.'))
+    except: return None
+
+
+class StoreRegistry:
+    """Anagrafe negozi indicizzata una volta per versione: indirizzo normalizzato e P.IVA -> negozio."""
+
+    def __init__(self, records):
+        self.records = list(records)
+        self.by_indirizzo = {}
+        self.by_piva = {}
+        self.coords = {}
+        for n in self.records:
+            piva = clean_piva(n.get('P_IVA', ''))
+            if piva: self.by_piva.setdefault(piva, n)
+            k = norm_indirizzo(n.get('Indirizzo_Standard (Pulito)', ''))
+            if k in self.by_indirizzo: continue  # come prima: vale il primo negozio in anagrafe
+            self.by_indirizzo[k] = n
+            if n.get('Latitudine'):
+                lat, lon = _coord(n['Latitudine']), _coord(n.get('Longitudine'))
+                if lat is not None and lon is not None: self.coords[k] = (lat, lon)
+        keys = list(self.coords)
+        self.index = StoreIndex([self.coords[k][0] for k in keys], [self.coords[k][1] for k in keys], keys)
+
+    def __len__(self):
+        return len(self.records)
+
+    def per_indirizzo(self, indirizzo):
+        return self.by_indirizzo.get(norm_indirizzo(indirizzo))
+
+    def per_piva(self, piva):
+        piva = clean_piva(piva)
+        return self.by_piva.get(piva) if piva else None
+
+    def coords_of(self, indirizzo):
+        """(lat, lon) del negozio con questo indirizzo, None se assente o senza coordinate."""
+        return self.coords.get(norm_indirizzo(indirizzo))
+
+    def vicini(self, lat, lon, raggio_km):
+        """Indirizzi normalizzati dei negozi entro raggio_km in linea d'aria."""
+        keys, _ = self.index.within(lat, lon, raggio_km)
+        return set(keys)
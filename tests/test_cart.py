@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from cart import build_price_matrix
+from facts import FactTable
+from prices import PriceView
+from search_index import ProductIndex
+from storage import COLONNE_CATALOGO, COLONNE_SCONTRINI
+
+
+def _riga(id_p, prezzo, negozio, data="2026-01-01"):
+    return [data, negozio, "VIA ROMA 1", "X", prezzo, 0, prezzo, "NO", 1, "SI", id_p, "1", "", ""]
+
+
+def _matrice(catalogo, righe, items, shops):
+    df_c = pd.DataFrame(catalogo, columns=COLONNE_CATALOGO)
+    df_s = pd.DataFrame(righe, columns=COLONNE_SCONTRINI)
+    return build_price_matrix(PriceView.build(FactTable.build(df_s, df_c)), ProductIndex.from_catalog(df_c), items, shops)
+
+
+def test_cella_e_confronto_sullo_stesso_prezzo_della_confezione():
+    catalogo = [["l1", "LATTE 1L", "X", "LATTICINI", 1, "L"], ["l3", "LATTE 3L", "X", "LATTICINI", 3, "L"],
+                ["l05", "LATTE 0.5L", "X", "LATTICINI", 0.5, "L"]]
+    righe = [_riga("l1", 1.00, "A"), _riga("l3", 2.40, "A"), _riga("l05", 0.70, "B")]
+    pm = _matrice(catalogo, righe, ["LATTE"], ["A - VIA ROMA 1", "B - VIA ROMA 1"])
+    # Prima del confronto tra negozi A vale 1,00 € (la confezione da 1L), non i 2,40 € della 3L a miglior €/L
+    assert np.isclose(pm.prices[0], [1.00, 0.70]).all()
+    assert pm.names[0].tolist() == ["LATTE 1L", "LATTE 0.5L"]
+
+
+def test_unita_diverse_non_si_confrontano():
+    # Due prodotti a litro contro uno a pezzo: vince l'unità più frequente, il prodotto a pezzo è escluso
+    catalogo = [["a", "LATTE INTERO", "X", "C", 1, "L"], ["b", "LATTE BIO", "X", "C", 0.5, "L"],
+                ["c", "LATTE POLVERE", "X", "C", 1, "PZ"]]
+    righe = [_riga("a", 1.20, "E"), _riga("b", 0.90, "F"), _riga("c", 0.30, "E")]
+    pm = _matrice(catalogo, righe, ["LATTE", "NIENTE"], ["E - VIA ROMA 1", "F - VIA ROMA 1"])
+    assert pm.units == ["L", ""]
+    assert np.isclose(pm.prices[0], [1.20, 0.90]).all()
+    assert not np.isfinite(pm.prices[1]).any()
@@ -0,0 +1,92 @@
+import contextlib
+import io
+import os
+import random
+
+import pandas as pd
+import pytest
+
+import clean_db
+from fake_sheets import FakeSpreadsheet, FakeWorksheet
+
+HEADER = clean_db.COLONNE_DEDUP + ['Note']
+
+
+def _foglio(righe=()):
+    return FakeSpreadsheet([FakeWorksheet("Foglio1", [HEADER] + [list(r) for r in righe])]).get_worksheet(0)
+
+
+def _righe(rng, n):
+    # Pochi valori per colonna: molti duplicati, anche a distanza di più esecuzioni. Note non conta per il duplicato
+    return [[f"2026-01-0{rng.randint(1, 3)}", rng.choice(["COOP", "LIDL"]), "VIA ROMA 1", rng.choice(["LATTE", "PANE", "UOVA"]),
+             rng.choice(["1.5", "2"]), "1", str(rng.random())] for _ in range(n)]
+
+
+def _pulisci(foglio, stato, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()): return clean_db.run_cleanup(worksheet=foglio, stato_path=stato, **kwargs)
+
+
+def _atteso(storico):
+    return pd.DataFrame(storico, columns=HEADER).drop_duplicates(subset=clean_db.COLONNE_DEDUP, keep='last').values.tolist()
+
+
+@pytest.mark.parametrize("seed", range(15))
+def test_incrementale_come_drop_duplicates_keep_last(tmp_path, seed):
+    rng = random.Random(seed)
+    stato = str(tmp_path / "stato.json")
+    foglio, storico = _foglio(), []
+    for _ in range(rng.randint(2, 6)):
+        nuove = _righe(rng, rng.randint(1, 25))
+        storico += nuove
+        foglio.append_rows(nuove)
+        prima = len(foglio.rows)
+        rimosse = _pulisci(foglio, stato, blocco=rng.choice([3, 7, 5000]))
+        assert foglio.rows[1:] == _atteso(storico)
+        assert rimosse == prima - len(foglio.rows)
+
+
+def test_stato_mancante_o_illeggibile_rilegge_tutto(tmp_path):
+    rng = random.Random(1)
+    stato = str(tmp_path / "stato.json")
+    storico = _righe(rng, 30)
+    foglio = _foglio(storico)
+    _pulisci(foglio, stato)
+    nuove = _righe(rng, 10)
+    storico += nuove
+    foglio.append_rows(nuove)
+    os.remove(stato)
+    _pulisci(foglio, stato)
+    assert foglio.rows[1:] == _atteso(storico)
+    nuove = _righe(rng, 10)
+    storico += nuove
+    foglio.append_rows(nuove)
+    with open(stato, "w") as f: f.write("{non json")
+    _pulisci(foglio, stato)
+    assert foglio.rows[1:] == _atteso(storico)
+
+
+def test_stato_non_piu_valido_ricostruisce(tmp_path):
+    rng = random.Random(2)
+    stato = str(tmp_path / "stato.json")
+    storico = _righe(rng, 40)
+    foglio = _foglio(storico)
+    _pulisci(foglio, stato)
+    # Righe cancellate a mano sopra il watermark: l'ultima riga nota non è più al suo posto
+    del foglio.rows[1:4]
+    storico = [list(r) for r in foglio.rows[1:]]
+    nuove = _righe(rng, 15)
+    storico += nuove
+    foglio.append_rows(nuove)
+    _pulisci(foglio, stato)
+    assert foglio.rows[1:] == _atteso(storico)
+
+
+def test_intestazioni_cambiate_ricostruisce(tmp_path):
+    rng = random.Random(3)
+    stato = str(tmp_path / "stato.json")
+    foglio = _foglio(_righe(rng, 20))
+    _pulisci(foglio, stato)
+    # Stato di un altro foglio (intestazioni diverse) ma stesso percorso
+    altro = FakeSpreadsheet([FakeWorksheet("Foglio1", [['Data', 'Prodotto']] + [["2026-01-01", "PANE"]] * 3)]).get_worksheet(0)
+    assert _pulisci(altro, stato) == 2
+    assert altro.rows == [['Data', 'Prodotto'], ["2026-01-01", "PANE"]]
@@ -0,0 +1,32 @@
+import pandas as pd
+
+from facts import FactTable, _concat_compatto
+from storage import COLONNE_CATALOGO, COLONNE_SCONTRINI
+
+CATALOGO = pd.DataFrame([["a", "LATTE 1L", "X", "LATTICINI", 1, "L"]], columns=COLONNE_CATALOGO)
+
+
+def _scontrini(numeri):
+    return pd.DataFrame([["2026-01-01", "COOP", "VIA ROMA 1", "LATTE", 1.2, 0, 1.2, "NO", 1, "SI", "a", n, "", ""]
+                         for n in numeri], columns=COLONNE_SCONTRINI)
+
+
+def test_blocco_numerico_resta_category():
+    # Primo caricamento con numeri scontrino tutti interi, poi arrivano anche codici alfanumerici
+    ft = FactTable.build(_scontrini([12, 13]), CATALOGO)
+    nuovo = ft.sync(pd.concat([_scontrini([12, 13]), _scontrini(["RT-7"])], ignore_index=True).astype({'Num_Scontrino': object}),
+                    CATALOGO)
+    assert nuovo is ft
+    assert isinstance(ft.df['Num_Scontrino'].dtype, pd.CategoricalDtype)
+    assert ft.df['Num_Scontrino'].astype(str).tolist() == ["12", "13", "RT-7"]
+    assert isinstance(ft.df['ID_PRODOTTO'].dtype, pd.CategoricalDtype)
+
+
+def test_concat_cast_del_blocco_alle_categorie_esistenti():
+    a = pd.DataFrame({'Num_Scontrino': pd.Series(["RT-7", "12"]).astype('category')})
+    b = pd.DataFrame({'Num_Scontrino': [12, 14]})
+    out = _concat_compatto(a, b)
+    assert isinstance(out['Num_Scontrino'].dtype, pd.CategoricalDtype)
+    assert out['Num_Scontrino'].astype(str).tolist() == ["RT-7", "12", "12", "14"]
+    # I codici già assegnati non cambiano
+    assert out['Num_Scontrino'].cat.codes.tolist()[:2] == a['Num_Scontrino'].cat.codes.tolist()
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from ingest import JsonStreamParser
+
+RISPOSTA = {
+    "testata": {"p_iva": "0123", "indirizzo": "VIA {ROMA} 1", "data_iso": "2026-01-02", "num_scontrino": "12"},
+    "prodotti": [
+        {"nome_grezzo": "LATTE \"UHT\" {1L}", "nome_normalizzato": "LATTE UHT 1L", "formato": 1.0, "unita": "L",
+         "prezzo_unitario": 1.2, "extra": {"sconti": [0.1, 0.2]}},
+        {"nome_grezzo": "PANE ]", "nome_normalizzato": "PANE", "formato": 0.5, "unita": "KG", "prezzo_unitario": 2.0},
+        {"nome_grezzo": "UOVA\\", "nome_normalizzato": "UOVA", "formato": 6, "unita": "PZ", "prezzo_unitario": 2.5},
+    ],
+}
+TESTO = "```json\n" + json.dumps(RISPOSTA, indent=2) + "\n```"
+
+
+@pytest.mark.parametrize("passo", [1, 2, 3, 7, 64, len(TESTO)])
+def test_pezzi_di_qualsiasi_lunghezza(passo):
+    p = JsonStreamParser()
+    letti = []
+    for i in range(0, len(TESTO), passo): letti += p.feed(TESTO[i:i + passo])
+    assert letti == RISPOSTA["prodotti"]
+    assert p.testata == RISPOSTA["testata"]
+    assert p.risultato() == (RISPOSTA, True)
+
+
+def test_ogni_prodotto_appena_si_chiude():
+    p = JsonStreamParser()
+    fine_primo = TESTO.index('"nome_grezzo": "PANE')
+    assert p.feed(TESTO[:fine_primo]) == RISPOSTA["prodotti"][:1]
+    assert p.feed(TESTO[fine_primo:]) == RISPOSTA["prodotti"][1:]
+
+
+def test_risposta_interrotta_tiene_i_prodotti_letti():
+    p = JsonStreamParser()
+    p.feed(TESTO[:TESTO.index('"nome_grezzo": "UOVA') + 5])
+    dati, completo = p.risultato()
+    assert not completo
+    assert dati == {"testata": RISPOSTA["testata"], "prodotti": RISPOSTA["prodotti"][:2]}
+
+
+def test_risposta_interrotta_senza_prodotti_solleva():
+    p = JsonStreamParser()
+    p.feed(TESTO[:40])
+    with pytest.raises(ValueError): p.risultato()
@@ -0,0 +1,34 @@
+import pandas as pd
+import pytest
+
+from matcher import CatalogMatcher, abbina_prodotti
+
+CATALOGO = pd.DataFrame({
+    'ID_PRODOTTO': ['a', 'b', 'c'],
+    'NOME_NORMALIZZATO': ['LATTE GRANAROLO P.S. 0.5L', 'PASTA BARILLA SPAGHETTI N5 500G', 'COCA COLA 1.5L'],
+    'BRAND': ['GRANAROLO', 'BARILLA', 'COCA COLA'],
+    'FORMATO': [0.5, 500, 1.5],
+    'UNITA': ['L', 'G', 'L'],
+})
+
+
+def _abbina(nome, brand="", formato=None, unita=""):
+    p = {'nome_normalizzato': nome, 'nome_grezzo': nome, 'brand': brand, 'formato': formato, 'unita': unita}
+    abbina_prodotti([p], CatalogMatcher.from_catalog(CATALOGO))
+    return p
+
+
+@pytest.mark.parametrize("nome, brand, formato, unita, simile", [
+    ("LATTE GRANAROLO P.S. 1L", "GRANAROLO", 1, "L", "LATTE GRANAROLO P.S. 0.5L"),
+    ("PASTA BARILLA PENNE RIGATE 500G", "BARILLA", 500, "G", "PASTA BARILLA SPAGHETTI N5 500G"),
+    ("COCA COLA ZERO 1.5L", "COCA COLA", 1.5, "L", "COCA COLA 1.5L"),
+])
+def test_prodotto_simile_ma_diverso_resta_suggerimento(nome, brand, formato, unita, simile):
+    p = _abbina(nome, brand, formato, unita)
+    assert p['nome_normalizzato'] == nome
+    assert simile in p['alternative'].split(" | ")
+
+
+def test_stesso_prodotto_scritto_diversamente_viene_sostituito():
+    assert _abbina("COCA COLA 1,5L")['nome_normalizzato'] == "COCA COLA 1.5L"
+    assert _abbina("LATTE GRAN P.S. 500ML", formato=0.5, unita="L")['nome_normalizzato'] == "LATTE GRANAROLO P.S. 0.5L"
@@ -0,0 +1,54 @@
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+from optimizer import PENALITA_MANCANTE, optimize
+
+
+def _costo(prezzi, viaggio, scelti):
+    c = np.where(np.isfinite(prezzi), prezzi, PENALITA_MANCANTE)
+    if not scelti: return prezzi.shape[0] * PENALITA_MANCANTE
+    return float(c[:, list(scelti)].min(axis=1).sum() + viaggio[list(scelti)].sum())
+
+
+def _forza_bruta(prezzi, viaggio, k):
+    n_s = prezzi.shape[1]
+    return min(_costo(prezzi, viaggio, s) for r in range(min(k, n_s) + 1) for s in combinations(range(n_s), r))
+
+
+def _istanza(seed, n_i, n_s):
+    rng = np.random.default_rng(seed)
+    prezzi = np.round(rng.uniform(0.5, 10, (n_i, n_s)), 2)
+    prezzi[rng.random(prezzi.shape) < 0.35] = np.inf
+    return prezzi, rng.uniform(0, 15, n_s)
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_ottimo_come_forza_bruta(seed):
+    rng = np.random.default_rng(1000 + seed)
+    prezzi, km = _istanza(seed, int(rng.integers(1, 9)), int(rng.integers(1, 8)))
+    costo_km = float(rng.choice([0.0, 0.2, 1.0]))
+    for k in [1, 2, 3, None]:
+        plan = optimize(prezzi, k=k, travel_km=km, costo_km=costo_km)
+        viaggio = km * costo_km
+        assert plan.ottimo
+        assert len(plan.shops) <= (k or prezzi.shape[1])
+        assert plan.costo == pytest.approx(_costo(prezzi, viaggio, plan.shops))
+        assert plan.costo == pytest.approx(_forza_bruta(prezzi, viaggio, k or prezzi.shape[1]))
+        # Ogni articolo assegnato a un negozio scelto al suo prezzo minimo tra quelli
+        for i, j in enumerate(plan.assignment):
+            if j >= 0: assert j in plan.shops and prezzi[i, j] == prezzi[i, plan.shops].min()
+
+
+def test_tempo_scaduto_restituisce_il_migliore_trovato():
+    prezzi, km = _istanza(7, 40, 30)
+    viaggio = km * 0.3
+    plan = optimize(prezzi, k=4, travel_km=km, costo_km=0.3, time_budget=0)
+    completo = optimize(prezzi, k=4, travel_km=km, costo_km=0.3)
+    assert not plan.ottimo and completo.ottimo
+    # Piano valido (al più k negozi, costo coerente) e mai migliore dell'ottimo
+    assert 0 < len(plan.shops) <= 4
+    assert plan.costo == pytest.approx(_costo(prezzi, viaggio, plan.shops))
+    assert plan.costo >= completo.costo - 1e-9
+    assert plan.mancanti < prezzi.shape[0]
@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+
+from receipts import RegistroSalvataggi, ScontrinoGiaSalvato, _gia_presente, chiave_idempotenza, salva_scontrino
+from storage import COLONNE_SCONTRINI, SQLiteStorage
+
+EDITOR = pd.DataFrame([{"Scontrino": "LATTE", "Nome Catalogo (Editabile)": "LATTE INTERO 1L", "Marca": "GRANAROLO",
+                        "Cat": "LATTE", "Unità (KG/L/PZ)": "L", "Peso/Vol (Tot)": "1", "Prezzo €": "1,50", "Qtà": "1",
+                        "Offerta": "NO"}])
+
+
+def _salva(storage, registro, num, piva="", negozio="COOP", indirizzo="VIA A 1", df_scontrini=None):
+    return salva_scontrino(storage, storage.df("Catalogo"), EDITOR, "2026-01-02", negozio, indirizzo, num,
+                           piva=piva, registro=registro, df_scontrini=df_scontrini)
+
+
+def test_chiave_distingue_negozi_e_manca_senza_piva_ne_numero():
+    assert chiave_idempotenza("", "12", "2026-01-02", negozio="COOP", indirizzo="VIA A 1") != \
+        chiave_idempotenza("", "12", "2026-01-02", negozio="LIDL", indirizzo="VIA B 2")
+    assert chiave_idempotenza("", "", "2026-01-02", negozio="COOP") is None
+    assert chiave_idempotenza("0123", "", "2026-01-02", negozio="COOP") is not None
+
+
+def test_stesso_numero_in_negozi_diversi_non_e_un_doppione():
+    storage, registro = SQLiteStorage(":memory:"), RegistroSalvataggi(":memory:")
+    assert _salva(storage, registro, "0001") == 1
+    assert _salva(storage, registro, "0001", negozio="LIDL", indirizzo="VIA B 2") == 1
+    with pytest.raises(ScontrinoGiaSalvato): _salva(storage, registro, "0001")
+
+
+def test_senza_piva_ne_numero_si_salva_sempre():
+    storage, registro = SQLiteStorage(":memory:"), RegistroSalvataggi(":memory:")
+    assert _salva(storage, registro, "") == 1
+    assert _salva(storage, registro, "") == 1
+    assert len(storage.df("Scontrini")) == 2
+
+
+def test_doppione_sul_foglio_cercato_per_nome_di_colonna():
+    storage = SQLiteStorage(":memory:")
+    _salva(storage, None, "0042")
+    # Colonne in un altro ordine: Num_Scontrino non è più la dodicesima
+    df = storage.df("Scontrini")[list(reversed(COLONNE_SCONTRINI))]
+    assert _gia_presente(df, "2026-01-02", "VIA A 1", "0042")
+    assert not _gia_presente(df, "2026-01-02", "VIA A 1", "0043")
+    assert not _gia_presente(df.drop(columns="Num_Scontrino"), "2026-01-02", "VIA A 1", "0042")
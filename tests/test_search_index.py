@@ -0,0 +1,41 @@
+import pandas as pd
+
+from search_index import ProductIndex
+
+CATALOGO = pd.DataFrame({
+    'ID_PRODOTTO': ['A', 'B', 'C', 'D'],
+    'NOME_NORMALIZZATO': ['LATTE INTERO UHT', 'LATTE PS 1L', 'PASTA SPAGHETTI', 'LATTINA COLA'],
+    'BRAND': ['GRANAROLO', 'PARMALAT', 'BARILLA', 'COCA COLA'],
+    'CATEGORIA': ['LATTICINI', 'LATTICINI', 'PASTA', 'BIBITE'],
+})
+
+
+def test_sottostringa_con_i_trigrammi():
+    ix = ProductIndex.from_catalog(CATALOGO)
+    assert ix.search("LATT") == {'A', 'B', 'D'}
+    assert ix.search("SPAGH") == {'C'}
+
+
+def test_query_corte_solo_parole_intere():
+    ix = ProductIndex.from_catalog(CATALOGO)
+    # "PS" come sottostringa troverebbe anche altro: vale solo la parola intera
+    assert ix.search("PS") == {'B'}
+    assert ix.search("LA") == set()
+    assert ix.search("1L") == {'B'}
+
+
+def test_search_tokens_parole_in_qualsiasi_ordine_e_campo():
+    ix = ProductIndex.from_catalog(CATALOGO)
+    assert ix.search("GRANAROLO LATTE") == set()
+    assert ix.search_tokens("GRANAROLO LATTE") == {'A'}
+    assert ix.search_tokens("LATTE") == {'A', 'B'}
+    assert ix.search_tokens("LATTE BARILLA") == set()
+
+
+def test_sync_in_coda_aggiorna_le_parole():
+    ix = ProductIndex.from_catalog(CATALOGO.iloc[:2])
+    nuovo = pd.concat([CATALOGO, pd.DataFrame([{'ID_PRODOTTO': 'E', 'NOME_NORMALIZZATO': 'UOVA 6 PZ',
+                                                'BRAND': 'AIA', 'CATEGORIA': 'UOVA'}])], ignore_index=True)
+    ix2 = ix.sync(nuovo)
+    assert ix2 is ix
+    assert ix.search("PZ") == {'E'} and ix.search_tokens("AIA UOVA") == {'E'}
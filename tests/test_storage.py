@@ -0,0 +1,62 @@
+import pandas as pd
+
+from storage import COLONNE_SCONTRINI, SQLiteStorage, Storage, sincronizza
+
+
+class MemoriaStorage(Storage):
+    """Backend in memoria con le query di base (filtri sul DataFrame intero), come SheetsStorage."""
+
+    def __init__(self, header=None, righe=()):
+        self._header, self.righe = list(header or []), [list(r) for r in righe]
+
+    def records(self, tabella):
+        return [dict(zip(self._header, r)) for r in self.righe]
+
+    def header(self, tabella):
+        return list(self._header)
+
+    def append(self, tabella, righe, colonne=None):
+        self.righe += [list(r) for r in righe]
+
+    def ensure_header(self, tabella, colonne):
+        if not self._header: self._header = list(colonne)
+
+    def scrivi_colonne(self, tabella, colonne, valori):
+        raise AssertionError("non usato")
+
+
+def _riga(data, negozio, indirizzo, id_p, prezzo):
+    r = dict.fromkeys(COLONNE_SCONTRINI, "")
+    r.update(Data=data, Negozio=negozio, Indirizzo=indirizzo, ID_PRODOTTO=id_p, Prezzo_Unitario=prezzo)
+    return [r[c] for c in COLONNE_SCONTRINI]
+
+
+RIGHE = [_riga("2026-01-02", "COOP", "VIA A 1", "P1", 1.5), _riga("2026-01-05", "COOP", "VIA B 2", "P2", 2.0),
+         _riga("2026-01-09", "LIDL", "VIA C 3", "P1", 1.3)]
+
+
+def test_query_sqlite_e_di_base_coincidono():
+    sql = SQLiteStorage(":memory:")
+    sql.append("Scontrini", RIGHE)
+    base = MemoriaStorage(COLONNE_SCONTRINI, RIGHE)
+    df = base.df("Scontrini")
+    casi = [lambda s, **kw: s.righe_prodotti("Scontrini", ["P1"], **kw),
+            lambda s, **kw: s.righe_negozio("COOP", **kw),
+            lambda s, **kw: s.righe_negozio("COOP", "VIA B 2", **kw),
+            lambda s, **kw: s.righe_periodo("2026-01-03", "2026-01-09", **kw)]
+    for q in casi:
+        atteso = q(base)['Data'].tolist()
+        assert q(sql)['Data'].tolist() == atteso
+        assert q(base, df=df)['Data'].tolist() == atteso
+    assert sql.righe_prodotti("Scontrini", []).empty
+
+
+def test_sincronizza_segue_le_colonne_del_foglio():
+    # Foglio con le colonne in un altro ordine e una colonna senza intestazione
+    header = ["Negozio", "", "Data"]
+    remoto = MemoriaStorage(header)
+    locale = SQLiteStorage(":memory:", schemi={"T": ["Data", "Negozio"]}, indici={})
+    locale.append("T", [["2026-01-02", "COOP"]])
+    assert sincronizza(locale, remoto, tabelle=("T",)) == {"T": (1, 0)}
+    assert remoto.righe == [["COOP", "", "2026-01-02"]]
+    assert sincronizza(locale, remoto, tabelle=("T",)) == {"T": (0, 0)}
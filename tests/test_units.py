@@ -0,0 +1,20 @@
+import pandas as pd
+
+from storage import COLONNE_SCONTRINI
+from units import COLONNE_UNITA, calcola_colonne, quantita_canonica
+
+
+def test_colonne_unita_nello_schema():
+    assert all(c in COLONNE_SCONTRINI for c in COLONNE_UNITA)
+
+
+def test_quantita_canonica():
+    assert quantita_canonica("500", "ML") == (0.5, 'L')
+    assert quantita_canonica("500", "L") == (0.5, 'L')
+    assert quantita_canonica("", "", "ACQUA 6X1,5L") == (9.0, 'L')
+
+
+def test_calcola_colonne_legge_i_prezzi_come_clean_price():
+    df_c = pd.DataFrame({'ID_PRODOTTO': ['A'], 'NOME_NORMALIZZATO': ['LATTE'], 'FORMATO': ['0.5'], 'UNITA': ['L']})
+    df_s = pd.DataFrame({'ID_PRODOTTO': ['A'] * 4, 'Prezzo_Unitario': ["€ 1,50", "1.50", 1.5, "n.d."]})
+    assert calcola_colonne(df_s, df_c) == [[3.0, 'L'], [3.0, 'L'], [3.0, 'L'], [0.0, 'L']]
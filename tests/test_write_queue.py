@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+from storage import SQLiteStorage
+from write_queue import WriteQueue
+
+
+class StorageInstabile(SQLiteStorage):
+    """SQLite in memoria che fallisce le prime `guasti` append e quelle verso le tabelle `giu`, e rifiuta sempre
+    le righe con 'KO'."""
+
+    def __init__(self, guasti=0, giu=()):
+        super().__init__(":memory:")
+        self.guasti = guasti
+        self.giu = giu
+        self.chiamate = []
+
+    def append(self, tabella, righe, colonne=None):
+        self.chiamate.append(tabella)
+        if self.guasti or tabella in self.giu:
+            self.guasti = max(0, self.guasti - 1)
+            raise ConnectionError("rete giù")
+        if any('KO' in map(str, r) for r in righe): raise ValueError("riga non valida")
+        super().append(tabella, righe, colonne)
+
+
+def _scritture(n):
+    return [("Scontrini", [[f"2026-01-0{n}", "COOP", "VIA A 1"]]), ("Catalogo", [[f"P{n}", f"PRODOTTO {n}"]])]
+
+
+def test_ritenta_fino_a_invio_riuscito_e_catalogo_prima():
+    storage = StorageInstabile(guasti=2)
+    coda = WriteQueue(storage, path=":memory:")
+    coda.enqueue("k1", _scritture(1))
+    for _ in range(2):
+        with pytest.raises(ConnectionError): coda.flush()
+        assert coda.stato("k1") == 'in_attesa'
+    assert coda.flush() == 2
+    assert coda.stato("k1") == 'inviato' and coda.flush() == 0
+    assert storage.chiamate[-2:] == ["Catalogo", "Scontrini"]
+    assert len(storage.df("Scontrini")) == 1 and len(storage.df("Catalogo")) == 1
+
+
+def test_voce_non_valida_va_in_errore_senza_bloccare_le_altre():
+    storage = StorageInstabile()
+    coda = WriteQueue(storage, path=":memory:", max_tentativi=2)
+    coda.enqueue("buono", _scritture(1))
+    coda.enqueue("cattivo", [("Catalogo", [["KO", "X"]]), ("Scontrini", [["2026-01-09", "KO", "VIA"]])])
+    coda.enqueue("buono2", _scritture(2))
+    for _ in range(2):
+        with pytest.raises(ValueError): coda.flush()
+    assert coda.stato("cattivo") == 'errore'
+    assert coda.flush() == 2  # Scontrini degli altri due salvataggi, ora che il Catalogo non blocca più
+    assert coda.stato("buono") == coda.stato("buono2") == 'inviato'
+    assert coda.stats()['scontrini_in_errore'] == 1
+    assert coda.riprova_errori() == 2 and coda.stato("cattivo") == 'in_attesa'
+
+
+def test_voci_in_attesa_sopravvivono_al_riavvio(tmp_path):
+    path = str(tmp_path / "coda.sqlite")
+    storage = StorageInstabile()
+    # Il processo si ferma dopo aver inviato il Catalogo: Scontrini resta in attesa
+    prima = WriteQueue(StorageInstabile(giu=("Scontrini",)), path=path)
+    prima.enqueue("k1", _scritture(1))
+    with pytest.raises(ConnectionError): prima.flush()
+    del prima
+    dopo = WriteQueue(storage, path=path)
+    assert dopo.in_attesa("Scontrini") == [["2026-01-01", "COOP", "VIA A 1"]]
+    assert dopo.in_attesa("Catalogo") == []
+    assert dopo.flush() == 1
+    assert storage.chiamate == ["Scontrini"] and dopo.stato("k1") == 'inviato'
+
+
+def test_flush_concorrenti_non_duplicano():
+    storage = StorageInstabile()
+    coda = WriteQueue(storage, path=":memory:")
+    for n in range(1, 6): coda.enqueue(f"k{n}", _scritture(n))
+    fili = [threading.Thread(target=coda.flush) for _ in range(4)]
+    for f in fili: f.start()
+    for f in fili: f.join()
+    assert len(storage.df("Scontrini")) == 5 and len(storage.df("Catalogo")) == 5
@@ -0,0 +1,150 @@
+"""Prezzo per unità di misura confrontabile: KG, L o PZ, calcolato una volta al salvataggio.
+
+Formato e unità arrivano dal modello o dall'editor (500 ML, 0,5 L, 6X1.5L, 4 PZ, a volte 500 con unità L):
+quantita_canonica li riporta alla misura di riferimento, così 1 L e 500 ML si ordinano sullo stesso prezzo.
+
+    python units.py backfill [--forza]   # completa le righe di Scontrini salvate prima di questa colonna
+"""
+import argparse
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from storage import STORAGE_BACKEND, STORAGE_PATH, SheetsStorage, SQLiteStorage
+
+COLONNE_UNITA = ['Prezzo_Per_Unita', 'Unita_Riferimento']  # colonne M e N di COLONNE_SCONTRINI
+
+# Unità lette -> (unità di riferimento, fattore)
+UNITA = {
+    'KG': ('KG', 1.0), 'KGM': ('KG', 1.0), 'CHILO': ('KG', 1.0), 'HG': ('KG', 0.1), 'G': ('KG', 0.001),
+    'GR': ('KG', 0.001), 'GRAMMI': ('KG', 0.001), 'MG': ('KG', 0.000001),
+    'L': ('L', 1.0), 'LT': ('L', 1.0), 'LITRO': ('L', 1.0), 'LITRI': ('L', 1.0), 'DL': ('L', 0.1),
+    'CL': ('L', 0.01), 'ML': ('L', 0.001),
+    'PZ': ('PZ', 1.0), 'PZZ': ('PZ', 1.0), 'PEZZI': ('PZ', 1.0), 'PEZZO': ('PZ', 1.0), 'N': ('PZ', 1.0),
+    'NR': ('PZ', 1.0), 'CONF': ('PZ', 1.0), 'UOVA': ('PZ', 1.0), 'BUSTINE': ('PZ', 1.0), 'CAPSULE': ('PZ', 1.0),
+    'ROTOLI': ('PZ', 1.0),
+}
+# Oltre questa quantità in KG o L il numero è quasi certamente in grammi o millilitri (500 L -> 0.5 L)
+SOGLIA_SCALA = 50
+
+_NUM = r'(\d+(?:[.,]\d+)?)'
+_SIGLE = '|'.join(sorted(UNITA, key=len, reverse=True))
+_MULTIPACK = re.compile(rf'(\d+)\s*[X×]\s*{_NUM}\s*({_SIGLE})\b')
+_MISURA = re.compile(rf'{_NUM}\s*({_SIGLE})\b')
+
+
+def _num(v):
+    try:
+        x = float(str(v).replace(',', '.'))
+        return x if x == x and x not in (float('inf'), float('-inf')) else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _dal_testo(testo):
+    """(quantità, unità di riferimento) da un testo come '6X1.5L' o 'LATTE 500ML', None se non c'è una misura."""
+    t = str(testo).upper()
+    m = _MULTIPACK.search(t)
+    if m:
+        u, f = UNITA[m.group(3)]
+        return int(m.group(1)) * float(m.group(2).replace(',', '.')) * f, u
+    m = _MISURA.search(t)
+    if m:
+        u, f = UNITA[m.group(2)]
+        return float(m.group(1).replace(',', '.')) * f, u
+    return None
+
+
+def quantita_canonica(formato, unita, nome=""):
+    """(quantità, unità) nella misura di riferimento KG, L o PZ; (1.0, 'PZ') se non si ricava niente di sensato."""
+    sigla = re.sub(r'[^A-Z]', '', str(unita).upper())
+    q = _num(formato)
+    if q is None:
+        # Formato non numerico: la misura può essere scritta nel formato stesso, nell'unità o nel nome
+        for testo in (f"{formato}", f"{formato}{unita}", f"{unita}", nome):
+            trovata = _dal_testo(testo)
+            if trovata: return trovata
+        return 1.0, 'PZ'
+    if sigla in UNITA:
+        u, f = UNITA[sigla]
+        q *= f
+        if u != 'PZ' and f == 1.0 and q >= SOGLIA_SCALA: q /= 1000.0
+    else:
+        trovata = _dal_testo(nome)
+        if trovata: return trovata
+        u = 'PZ'
+    if q <= 0: return 1.0, 'PZ'
+    return round(q, 6), u
+
+
+def prezzo_per_unita(prezzo, formato, unita, nome=""):
+    """(prezzo per KG/L/PZ, unità) di una confezione al prezzo indicato."""
+    q, u = quantita_canonica(formato, unita, nome)
+    p = _num(prezzo) or 0.0
+    return round(p / q, 4), u
+
+
+def prezzi_float(serie):
+    """Versione vettoriale di clean_price: numeri invariati, stringhe ripulite ('€ 1,50' -> 1.5), errori a 0."""
+    num = pd.to_numeric(serie, errors='coerce')
+    testo = serie[num.isna()].astype(str).str.replace(r'[^\d,.-]', '', regex=True).str.replace(',', '.', regex=False)
+    num[num.isna()] = pd.to_numeric(testo, errors='coerce')
+    return num.fillna(0.0).astype(float)
+
+
+def quantita_colonne(formato, unita, nomi):
+    """Versione per colonne di quantita_canonica: ogni terna distinta viene convertita una sola volta."""
+    noti = {}
+    qs, us = [], []
+    for terna in zip(formato.tolist(), unita.tolist(), nomi.tolist()):
+        r = noti.get(terna)
+        if r is None: r = noti[terna] = quantita_canonica(*terna)
+        qs.append(r[0])
+        us.append(r[1])
+    return np.array(qs, dtype=float), np.array(us, dtype=object)
+
+
+def calcola_colonne(df_s, df_c):
+    """[Prezzo_Per_Unita, Unita_Riferimento] per ogni riga di Scontrini, dal prodotto del Catalogo (FORMATO, UNITA)."""
+    cat = df_c.drop_duplicates('ID_PRODOTTO').set_index('ID_PRODOTTO')
+    ids = df_s['ID_PRODOTTO'].astype(str)
+    campo = lambda c: ids.map(cat[c]) if c in cat.columns else pd.Series("", index=ids.index)
+    q, u = quantita_colonne(campo('FORMATO').fillna(""), campo('UNITA').fillna(""), campo('NOME_NORMALIZZATO').fillna(""))
+    prezzi = prezzi_float(df_s['Prezzo_Unitario'])
+    return [[round(float(p / qi), 4), str(ui)] for p, qi, ui in zip(prezzi.to_numpy(), q, u)]
+
+
+def backfill(storage, forza=False):
+    """Scrive Prezzo_Per_Unita e Unita_Riferimento sulle righe di Scontrini che non li hanno (tutte con forza=True).
+
+    Una sola scrittura per colonna. Restituisce il numero di righe completate.
+    """
+    df_s, df_c = storage.df("Scontrini"), storage.df("Catalogo")
+    if df_s.empty: return 0
+    calcolate = calcola_colonne(df_s, df_c)
+    presenti = df_s.reindex(columns=COLONNE_UNITA).fillna("").astype(str).apply(lambda c: c.str.strip())
+    mancanti = forza | (presenti == "").any(axis=1).to_numpy()
+    valori = [c if m else list(p) for c, p, m in zip(calcolate, presenti.values.tolist(), mancanti)]
+    if not mancanti.any(): return 0
+    storage.scrivi_colonne("Scontrini", COLONNE_UNITA, valori)
+    return int(mancanti.sum())
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Prezzo per unità di misura sulle righe di Scontrini già salvate")
+    ap.add_argument("comando", choices=["backfill"])
+    ap.add_argument("--forza", action="store_true", help="ricalcola anche le righe che hanno già il valore")
+    ap.add_argument("--db", default=STORAGE_PATH, help="database SQLite (con STORAGE_BACKEND=sqlite)")
+    args = ap.parse_args(argv)
+    if STORAGE_BACKEND == "sqlite": storage = SQLiteStorage(args.db)
+    else:
+        from clients import ClientManager
+        storage = SheetsStorage(ClientManager(json.loads(os.environ['GOOGLE_SHEETS_JSON'])))
+    print(f"Scontrini: {backfill(storage, forza=args.forza)} righe completate")
+
+
+if __name__ == "__main__":
+    main()
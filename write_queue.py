@@ -0,0 +1,168 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+WRITE_QUEUE = os.environ.get("WRITE_QUEUE", ".cache/coda_scritture.sqlite")
+ORDINE_TABELLE = ("Catalogo", "Anagrafe_Negozi", "Scontrini")  # i prodotti nuovi prima delle righe che li citano
+MAX_TENTATIVI = int(os.environ.get("WRITE_QUEUE_TENTATIVI", 10))  # poi il salvataggio passa in 'errore' e non blocca gli altri
+
+
+class WriteQueue:
+    """Coda persistente delle scritture verso lo Storage, svuotata da un thread in background.
+
+    I salvataggi vengono registrati subito su SQLite; il worker accoda al backend tutte le righe in attesa
+    con una sola append per tabella, ritenta con attesa crescente se fallisce e, a invio riuscito, chiama
+    on_flush(tabelle) (es. per invalidare la cache dei fogli). Le voci non inviate sopravvivono a un riavvio.
+    Se l'append di una tabella fallisce le voci si ritentano una per una: quelle che falliscono ancora dopo
+    max_tentativi mettono in 'errore' tutto il loro salvataggio, che resta da riprovare a mano (riprova_errori).
+    """
+
+    def __init__(self, storage, path=WRITE_QUEUE, on_flush=None, intervallo=2.0, attesa_max=60.0,
+                 max_tentativi=MAX_TENTATIVI):
+        if path != ":memory:" and os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.storage = storage
+        self.on_flush = on_flush
+        self.intervallo = intervallo
+        self.attesa_max = attesa_max
+        self.max_tentativi = max_tentativi
+        self.ultimo_errore = None
+        self.ultimo_invio = None
+        self._fallimenti = 0
+        self._lock = threading.Lock()
+        self._lock_invio = threading.Lock()  # un solo flush alla volta (worker e pulsante "Invia ora")
+        self._sveglia = threading.Event()
+        self._thread = None
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS coda (
+            id INTEGER PRIMARY KEY, chiave TEXT, tabella TEXT, righe TEXT, stato TEXT,
+            tentativi INTEGER DEFAULT 0, errore TEXT, creato REAL, inviato REAL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_coda_stato ON coda (stato)")
+        self._db.commit()
+
+    def enqueue(self, chiave, scritture):
+        """Registra in un'unica transazione le scritture di un salvataggio: [(tabella, righe), ...]."""
+        ora = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO coda (chiave, tabella, righe, stato, creato) VALUES (?, ?, ?, 'in_attesa', ?)",
+                [(chiave, t, json.dumps(righe), ora) for t, righe in scritture if righe])
+            self._db.commit()
+        self._sveglia.set()
+
+    def in_attesa(self, tabella):
+        """Righe non ancora inviate per una tabella, nell'ordine di salvataggio."""
+        with self._lock:
+            cur = self._db.execute("SELECT righe FROM coda WHERE stato = 'in_attesa' AND tabella = ? ORDER BY id", (tabella,))
+            return [r for (testo,) in cur for r in json.loads(testo)]
+
+    def flush(self):
+        """Invia tutte le voci in attesa, una append per tabella. Restituisce il numero di righe inviate.
+
+        Lettura, invio e marcatura avvengono sotto _lock_invio: due flush concorrenti non inviano le stesse righe.
+        """
+        with self._lock_invio: return self._flush()
+
+    def _segna_inviate(self, ids):
+        with self._lock:
+            self._db.executemany("UPDATE coda SET stato = 'inviato', inviato = ? WHERE id = ?", [(time.time(), i) for i in ids])
+            self._db.commit()
+
+    def _segna_fallite(self, voci, errore):
+        """+1 tentativo alle voci; i salvataggi con una voce oltre max_tentativi passano interi in 'errore'."""
+        with self._lock:
+            self._db.executemany("UPDATE coda SET tentativi = tentativi + 1, errore = ? WHERE id = ?",
+                                 [(errore, i) for i, _, _ in voci])
+            chiavi = [c for (c,) in self._db.execute(
+                f"SELECT DISTINCT chiave FROM coda WHERE tentativi >= ? AND id IN ({','.join('?' * len(voci))})",
+                [self.max_tentativi] + [i for i, _, _ in voci])]
+            self._db.executemany("UPDATE coda SET stato = 'errore' WHERE chiave = ? AND stato = 'in_attesa'",
+                                 [(c,) for c in chiavi])
+            self._db.commit()
+
+    def _flush(self):
+        with self._lock:
+            voci = self._db.execute("SELECT id, tabella, chiave, righe FROM coda WHERE stato = 'in_attesa' ORDER BY id").fetchall()
+        if not voci: return 0
+        per_tabella = {}
+        for id_v, t, chiave, testo in voci: per_tabella.setdefault(t, []).append((id_v, chiave, json.loads(testo)))
+        ordine = sorted(per_tabella, key=lambda t: ORDINE_TABELLE.index(t) if t in ORDINE_TABELLE else len(ORDINE_TABELLE))
+        inviate, toccate = 0, []
+        try:
+            for t in ordine:
+                gruppo = per_tabella[t]
+                try:
+                    self.storage.append(t, [r for _, _, righe in gruppo for r in righe])
+                    # Segnate subito: se la tabella successiva fallisce, queste non vengono reinviate
+                    self._segna_inviate([i for i, _, _ in gruppo])
+                    inviati, fallite = gruppo, []
+                except Exception as e:
+                    errore, inviati, fallite = e, [], gruppo[:1]
+                    if len(gruppo) > 1:
+                        # Una voce non valida non deve bloccare le altre: si ritenta voce per voce
+                        fallite = []
+                        for voce in gruppo:
+                            try: self.storage.append(t, voce[2])
+                            except Exception as e_voce: fallite.append(voce); errore = e_voce
+                            else: self._segna_inviate([voce[0]]); inviati.append(voce)
+                if inviati:
+                    inviate += sum(len(righe) for _, _, righe in inviati)
+                    toccate.append(t)
+                if fallite:
+                    self._segna_fallite(fallite, str(errore))
+                    # Le tabelle successive aspettano: le loro righe possono citare i prodotti non inviati
+                    raise errore
+        except Exception as e:
+            self.ultimo_errore = str(e)
+            raise
+        finally:
+            if toccate and self.on_flush: self.on_flush(toccate)
+        self.ultimo_errore = None
+        self.ultimo_invio = time.time()
+        return inviate
+
+    def _ciclo(self):
+        while True:
+            self._sveglia.wait(self.intervallo if not self._fallimenti else
+                               min(self.attesa_max, self.intervallo * 2 ** self._fallimenti))
+            self._sveglia.clear()
+            try:
+                self.flush()
+                self._fallimenti = 0
+            except Exception:
+                self._fallimenti += 1
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._ciclo, name="coda-scritture", daemon=True)
+            self._thread.start()
+        self._sveglia.set()
+        return self
+
+    def stato(self, chiave):
+        """'errore' se una scrittura del salvataggio è stata scartata, 'in_attesa' finché non sono tutte inviate,
+        poi 'inviato' (None se sconosciuto)."""
+        with self._lock:
+            stati = {s for (s,) in self._db.execute("SELECT stato FROM coda WHERE chiave = ?", (chiave,))}
+        if not stati: return None
+        for s in ('errore', 'in_attesa'):
+            if s in stati: return s
+        return 'inviato'
+
+    def riprova_errori(self):
+        """Rimette in attesa i salvataggi in 'errore' con i tentativi azzerati. Restituisce quante voci."""
+        with self._lock:
+            n = self._db.execute("UPDATE coda SET stato = 'in_attesa', tentativi = 0 WHERE stato = 'errore'").rowcount
+            self._db.commit()
+        if n: self._sveglia.set()
+        return n
+
+    def stats(self):
+        with self._lock:
+            conteggi = dict(self._db.execute("SELECT stato, COUNT(DISTINCT chiave) FROM coda GROUP BY stato").fetchall())
+            righe = self._db.execute("SELECT COUNT(*) FROM coda WHERE stato = 'in_attesa'").fetchone()[0]
+        return {"scontrini_in_attesa": conteggi.get('in_attesa', 0), "scontrini_inviati": conteggi.get('inviato', 0),
+                "scontrini_in_errore": conteggi.get('errore', 0),
+                "voci_in_attesa": righe, "tentativi_falliti": self._fallimenti, "ultimo_errore": self.ultimo_errore,
+                "ultimo_invio": time.strftime("%H:%M:%S", time.localtime(self.ultimo_invio)) if self.ultimo_invio else None}